@@ -2,9 +2,12 @@ import reflex as rx
 
 from typing import List, Dict, Any
 from WealthWorks.components import basic
-from WealthWorks.workers.debtRepaymentCalculator import calculate_repayment, priority_payment
+from WealthWorks.workers.debtRepaymentCalculator import Debt, cached_calculate_repayment, priority_payment, solve_extra_payment, what_if_payments
 from WealthWorks.workers import consoleStatements as Display
 
+# Ways to enter the calculation, either the extra payment or the months in which to be debt-free
+input_modes = ["Extra monthly payment", "Debt-free in months"]
+
 
 # State
 class DebtState(rx.State):
@@ -16,6 +19,7 @@ class DebtState(rx.State):
     minimumPaymentState: str
     interestRateState: str
     extraMonthlyPaymentState: str
+    targetMonthsState: str
 
     # Inputs from the user
     name: str
@@ -23,6 +27,8 @@ class DebtState(rx.State):
     minimumPayment: float
     interestRate: float
     extraMonthlyPayment: float
+    targetMonths: int
+    inputMode: str
     inputState: str
 
     # Outputs from the calculations
@@ -32,6 +38,8 @@ class DebtState(rx.State):
     totalPaid: float
     totalInterestPaid: float
     yearMonth: list
+    whatIf: List[Dict[str, Any]]
+    requiredExtraPayment: float
 
     def __init__(self, *args, **kwargs):
         # Initialize state
@@ -42,6 +50,9 @@ class DebtState(rx.State):
         self.minimumPayment = 0
         self.interestRate = 0
         self.extraMonthlyPayment = 0
+        self.targetMonths = 0
+        self.inputMode = input_modes[0]
+        self.requiredExtraPayment = 0
         self.months = 0
         self.monthlyPayment = 0
         self.priority = ""
@@ -51,10 +62,12 @@ class DebtState(rx.State):
         self.debts = []
         self.previousDebts = []
         self.yearMonth = [0, 0]
+        self.whatIf = []
         self.repaymentBalanceState = ""
         self.minimumPaymentState = ""
         self.interestRateState = ""
         self.extraMonthlyPaymentState = ""
+        self.targetMonthsState = ""
 
     # Setters
     @staticmethod
@@ -70,6 +83,11 @@ class DebtState(rx.State):
             self.extraMonthlyPayment = float(value)
             self.extraMonthlyPaymentState = f"{value}"
 
+    def set_targetMonths(self, value: int):
+        if self.is_float(value):
+            self.targetMonths = int(float(value))
+            self.targetMonthsState = f"{value}"
+
     def set_repaymentBalance(self, value: float):
         if self.is_float(value):
             self.repaymentBalance = float(value)
@@ -121,14 +139,8 @@ class DebtState(rx.State):
         Save the debts to the previous debts list, for future reference
         :return:
         """
-        self.previousDebts = []
-        dictionary = {"name": "", "amount": 0, "min_payment": 0, "interest_rate": 0}
-        for i in self.debts:
-            dictionary["name"] = i["name"]
-            dictionary["amount"] = i["amount"]
-            dictionary["min_payment"] = i["min_payment"]
-            dictionary["interest_rate"] = i["interest_rate"]
-            self.previousDebts.append(dictionary.copy())
+        # The calculator never changes the debts, so they can be kept as they are
+        self.previousDebts = self.debts
 
     def calculate_repayment(self):
         """
@@ -136,10 +148,18 @@ class DebtState(rx.State):
         """
         if len(self.debts) > 0:
             self.save_debts()
+            debts = [Debt(**debt) for debt in self.debts]
+            # Find the extra payment needed to be debt-free in time, if that was asked for
+            extra_payment = self.extraMonthlyPayment
+            if self.inputMode == input_modes[1]:
+                extra_payment = solve_extra_payment(debts=debts, target_months=self.targetMonths)
+                self.requiredExtraPayment = extra_payment if extra_payment is not None else 0
             # Calculate the repayment
-            results = calculate_repayment(debts=self.debts, extra_payment=self.extraMonthlyPayment)
+            results = None
+            if extra_payment is not None:
+                results = cached_calculate_repayment(debts=debts, extra_payment=extra_payment)
             # Calculate the priority
-            priority = priority_payment(debts=self.debts)
+            priority = priority_payment(debts=debts)
 
             if results is not None:
                 # Set the results
@@ -154,6 +174,9 @@ class DebtState(rx.State):
                 self.resources[0]["value"] = round((self.totalPaid - self.totalInterestPaid), 2)
                 self.resources[1]["value"] = round(self.totalInterestPaid)
 
+                # Update the "what if" graph
+                self.whatIf = what_if_payments(debts=debts, extra_payment=extra_payment)
+
             # Clearing the debts from memory
             self.debts = []
 
@@ -178,6 +201,31 @@ def graph() -> rx.Component:
     )
 
 
+def what_if_graph() -> rx.Component:
+    return rx.cond(
+        DebtState.whatIf,
+        rx.flex(
+            rx.card(
+                rx.text("What if I pay more each month?", size="4", weight="medium", align="center"),
+                rx.recharts.line_chart(
+                    rx.recharts.line(
+                        data_key="months",
+                        stroke="#4662D5",
+                    ),
+                    rx.recharts.x_axis(data_key="extra"),
+                    rx.recharts.y_axis(),
+                    rx.recharts.graphing_tooltip(),
+                    data=DebtState.whatIf,
+                    min_height=250,
+                ),
+                rx.box(height="10px"),
+                width="100%",
+            ),
+            width="100%"
+        ),
+    )
+
+
 def debt_input() -> rx.Component:
     return rx.flex(
         rx.flex(
@@ -241,14 +289,34 @@ def debt_input() -> rx.Component:
 def other_input() -> rx.Component:
     return rx.flex(
         rx.flex(
-            rx.chakra.input(
-                value=DebtState.extraMonthlyPaymentState,
-                placeholder="Extra monthly payment",
-                on_change=DebtState.set_extraMonthlyPayment,
-                is_required=True,
+            rx.chakra.select(
+                input_modes,
+                default_value=input_modes[0],
+                on_change=DebtState.set_inputMode,
                 border_color="#CDCED6",
-                size="sm",
-                border_radius="8"
+                border_radius="8",
+                size="sm"
+            ),
+            rx.cond(
+                DebtState.inputMode == input_modes[1],
+                rx.chakra.input(
+                    value=DebtState.targetMonthsState,
+                    placeholder="Debt-free in how many months",
+                    on_change=DebtState.set_targetMonths,
+                    is_required=True,
+                    border_color="#CDCED6",
+                    size="sm",
+                    border_radius="8"
+                ),
+                rx.chakra.input(
+                    value=DebtState.extraMonthlyPaymentState,
+                    placeholder="Extra monthly payment",
+                    on_change=DebtState.set_extraMonthlyPayment,
+                    is_required=True,
+                    border_color="#CDCED6",
+                    size="sm",
+                    border_radius="8"
+                ),
             ),
             justify="start",
             width="100%",
@@ -276,6 +344,16 @@ def debt_summary() -> rx.Component:
                 weight="regular",
                 align="center"
             ),
+            rx.cond(
+                DebtState.inputMode == input_modes[1],
+                rx.text(
+                    f"To be debt-free in {DebtState.targetMonths} months, "
+                    f"pay an extra {DebtState.requiredExtraPayment} each month.",
+                    size="4",
+                    weight="regular",
+                    align="center"
+                ),
+            ),
             rx.text(
                 f"We recommend you pay off '{DebtState.priority}' first.",
                 size="4",
@@ -367,6 +445,7 @@ def debt_repayment() -> rx.Component:
             other_input(),
             debt_summary(),
             debt_summary_table(),
+            what_if_graph(),
             debt_table(),
             rx.chakra.divider(border_color="lightgrey"),
             basic.footer(),
@@ -0,0 +1,182 @@
+"""
+Load harness for the news workers, against the offline stand-in of workers_standin.py
+
+For every table size, the news table is seeded with that many articles (some of them duplicates) and one full cycle
+runs against the stand-in: newsCollector.collectNews, newsCollector.correctDbSize, newsCleanner.clean_news and
+newsFetcher.FetchNews. The time, articles per second and round trips of every phase are reported.
+
+    python -m WealthWorks.tests.bench_workers --articles 10000 100000 1000000
+    python -m WealthWorks.tests.bench_workers --articles 10000 --functions --unique --latency 0.05 --error-rate 0.1
+
+Without --functions the workers use the fallbacks they take when insert_news and trim_news are not set up.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from WealthWorks.tests.workers_standin import STANDIN_KEY, StandIn, as_article, make_items
+
+WORKERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workers")
+
+# The collector, the cleaner and the daemon import their neighbours as scripts do
+if WORKERS not in sys.path:
+    sys.path.insert(0, WORKERS)
+
+
+def use_standin(standin: StandIn, directory: str):
+    """
+    Point the workers at the stand-in, with their local files in a directory
+    :param standin: The running stand-in
+    :param directory: The directory of the spool, the watermark and the index of the cleaner
+    """
+    import supabaseClient
+    from WealthWorks.workers import newsFetcher
+    from WealthWorks.workers import supabaseClient as package_supabase_client
+
+    os.environ.update({
+        "MARKETAUX_API_KEY": "standin",
+        "MARKETAUX_URL": standin.marketaux_url,
+        "SUPABASE_URL": standin.supabase_url,
+        "SUPABASE_API_KEY": STANDIN_KEY,
+        "NEWS_SPOOL_FILE": os.path.join(directory, "newsSpool.sqlite3"),
+        "NEWS_WATERMARK_FILE": os.path.join(directory, "newsWatermark.json"),
+        "NEWS_INDEX_FILE": os.path.join(directory, "newsIndex.sqlite3"),
+    })
+    # Both copies of the module, the workers are imported as scripts and as a package
+    supabaseClient.resetClients()
+    package_supabase_client.resetClients()
+    # The cached news are the ones of the previous database
+    newsFetcher.newsCache.clear()
+
+
+def measure(standin: StandIn, phase: str, articles: int, run: Callable[[], Any]) -> Dict[str, Any]:
+    """
+    Run one phase of the cycle
+    :param standin: The running stand-in
+    :param phase: The name of the phase
+    :param articles: The number of articles in the table when the phase starts
+    :param run: The phase
+    :return: The seconds, articles per second and round trips of the phase
+    """
+    before = standin.round_trips.copy()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    round_trips = standin.round_trips - before
+    return {
+        "phase": phase,
+        "articles": articles,
+        "seconds": round(seconds, 3),
+        "articles_per_second": round(articles / seconds, 1) if seconds else 0.0,
+        "marketaux_round_trips": round_trips["marketaux"],
+        "postgrest_round_trips": round_trips["postgrest"],
+        "rows_after": len(standin.table.rows),
+    }
+
+
+def run_cycle(
+    articles: int,
+    new_articles: int = 300,
+    duplicate_rate: float = 0.05,
+    near_duplicate_rate: float = 0.0,
+    functions: bool = False,
+    unique: bool = False,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    phases: List[str] = ("collect", "trim", "clean", "fetch"),
+) -> List[Dict[str, Any]]:
+    """
+    Seed the stand-in with a table of articles and run one collect/trim/clean/fetch cycle against it
+    :param articles: The number of articles in the table before the cycle
+    :param new_articles: The number of articles MarketAux has that are not in the table yet
+    :param duplicate_rate: The share of the seeded articles repeating an earlier one
+    :param near_duplicate_rate: The share of the seeded articles that are a syndicated copy of an earlier one
+    :param functions: Serve the insert_news and trim_news functions
+    :param unique: Enforce the unique constraints of newsDatabase.md, the seeded duplicates are kept
+    :param latency: Seconds every MarketAux request takes
+    :param error_rate: The share of the MarketAux requests that fail
+    :param phases: The phases to run, in order
+    :return: The measurements of every phase
+    """
+    import newsCleanner
+    import newsCollector
+    from WealthWorks.workers import newsFetcher
+
+    seeded = [as_article(item) for item in reversed(make_items(articles, duplicate_rate,
+                                                               near_duplicate_rate=near_duplicate_rate))]
+    items = make_items(new_articles, start=articles, seed=articles)
+    standin = StandIn(items, unique=unique, functions=functions, latency=latency, error_rate=error_rate,
+                      page_limit=100)
+    standin.seed(seeded)
+    os.environ["MARKETAUX_PAGES"] = str(-(-new_articles // 100))
+
+    results = []
+    with standin, tempfile.TemporaryDirectory() as directory:
+        use_standin(standin, directory)
+        cycle = {
+            "collect": lambda: asyncio.run(newsCollector.collectNews(
+                marketaux_key="standin", supabase_key=STANDIN_KEY, supabase_url=standin.supabase_url
+            )),
+            "trim": lambda: newsCollector.correctDbSize(
+                key=STANDIN_KEY, url=standin.supabase_url, max_size=articles
+            ),
+            "clean": lambda: newsCleanner.clean_news(),
+            "fetch": lambda: newsFetcher.FetchNews(),
+        }
+        for phase in phases:
+            results.append(measure(standin, phase, len(standin.table.rows), cycle[phase]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the news workers against the offline stand-in")
+    parser.add_argument("--articles", type=int, nargs="+", default=[10000], help="table sizes, e.g. 10000 1000000")
+    parser.add_argument("--new-articles", type=int, default=300, help="articles MarketAux has that are not stored yet")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="share of duplicate articles in the table")
+    parser.add_argument("--near-duplicate-rate", type=float, default=0.0,
+                        help="share of syndicated copies of an earlier article in the table")
+    parser.add_argument("--functions", action="store_true", help="serve insert_news and trim_news")
+    parser.add_argument("--unique", action="store_true", help="enforce the unique constraints on url and title")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every MarketAux request takes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of MarketAux requests that fail")
+    parser.add_argument("--phases", nargs="+", default=["collect", "trim", "clean", "fetch"],
+                        choices=["collect", "trim", "clean", "fetch"], help="phases of the cycle to run")
+    parser.add_argument("--json", action="store_true", help="print the measurements as JSON lines")
+    arguments = parser.parse_args()
+
+    # Keeping the per-article messages of the workers out of the report
+    os.environ.setdefault("WEALTHWORKS_LOG_LEVEL", "WARNING")
+    from WealthWorks.workers import consoleStatements as Display
+    Display.configure()
+
+    for size in arguments.articles:
+        results = run_cycle(
+            size,
+            new_articles=arguments.new_articles,
+            duplicate_rate=arguments.duplicate_rate,
+            near_duplicate_rate=arguments.near_duplicate_rate,
+            functions=arguments.functions,
+            unique=arguments.unique,
+            latency=arguments.latency,
+            error_rate=arguments.error_rate,
+            phases=arguments.phases,
+        )
+        for result in results:
+            if arguments.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{result['articles']:>8} articles  {result['phase']:<8} {result['seconds']:>9.3f} s "
+                    f"{result['articles_per_second']:>12.1f} articles/s  "
+                    f"{result['marketaux_round_trips']:>4} MarketAux  {result['postgrest_round_trips']:>6} PostgREST  "
+                    f"{result['rows_after']:>8} rows after"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import pytest
+
+from WealthWorks.tests.debt_portfolios import PORTFOLIO_SIZES, RATE_REGIMES
+
+
+@pytest.fixture(params=PORTFOLIO_SIZES, ids=lambda size: f"{size}-debts")
+def size(request):
+    return request.param
+
+
+@pytest.fixture(params=list(RATE_REGIMES))
+def regime(request):
+    return request.param
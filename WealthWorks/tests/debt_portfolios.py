@@ -0,0 +1,35 @@
+"""
+Reproducible portfolios of debts for the tests and benchmarks of the debt repayment calculator
+"""
+import random
+
+from WealthWorks.workers.debtRepaymentCalculator import Debt
+
+PORTFOLIO_SIZES = [1, 10, 100, 1000]
+
+# Interest rate ranges in percent
+RATE_REGIMES = {
+    "near-zero": (0.1, 0.5),
+    "moderate": (4, 12),
+    "high": (20, 30),
+}
+
+
+def make_portfolio(size: int, regime: str, seed: int = 42):
+    """
+    Make a reproducible portfolio of debts that can be paid off
+    :param size: Number of debts
+    :param regime: Key of RATE_REGIMES
+    :param seed: Seed of the random generator
+    :return: List of Debt
+    """
+    generator = random.Random(seed)
+    low, high = RATE_REGIMES[regime]
+    debts = []
+    for i in range(size):
+        amount = round(generator.uniform(500, 50000), 2)
+        interest_rate = round(generator.uniform(low, high), 2)
+        # The minimum payment covers the interest and pays off 1-3% of the balance per month
+        min_payment = round(amount * (interest_rate / 1200 + generator.uniform(0.01, 0.03)), 2)
+        debts.append(Debt(f"Debt {i}", amount, interest_rate, min_payment))
+    return debts
@@ -0,0 +1,110 @@
+"""
+Tests of the formatters, the queue and the level of consoleStatements.py, written to a StringIO instead of stdout
+"""
+import io
+import json
+import logging.handlers
+
+import pytest
+
+from WealthWorks.workers import consoleStatements as Display
+
+
+@pytest.fixture
+def output():
+    """The stream the statements are written to, the console is set up again afterwards"""
+    stream = io.StringIO()
+    yield stream
+    Display.configure()
+
+
+def written(stream: io.StringIO) -> str:
+    """Everything written, once the statements still in the queue are written out"""
+    Display.shutdown()
+    return stream.getvalue()
+
+
+def test_text_format(output):
+    Display.configure(level="INFO", json_format=False, stream=output)
+    Display.start("Test Service")
+    Display.message("Test Service", "%d articles", 3)
+    Display.completed("Test Service")
+
+    assert written(output) == "\nStarting Test Service...\nTest Service: 3 articles\nTest Service completed.\n"
+
+
+def test_json_format(output):
+    Display.configure(level="INFO", json_format=True, stream=output)
+    Display.start("Test Service")
+    Display.error("Test Service", "Request failed: %s", "timeout")
+
+    started, failed = [json.loads(line) for line in written(output).splitlines()]
+    assert set(started) == {"time", "level", "service", "event", "message"}
+    assert started["message"] == "Starting Test Service..."
+    assert (started["level"], started["service"], started["event"]) == ("INFO", "Test Service", "start")
+    assert (failed["level"], failed["event"], failed["message"]) == ("ERROR", "message", "Request failed: timeout")
+
+
+def test_json_format_with_exception(output):
+    Display.configure(level="INFO", json_format=True, stream=output)
+    try:
+        raise ValueError("bad article")
+    except ValueError:
+        Display.logger.exception("Sending failed", extra={"service": "Test Service"})
+
+    statement = json.loads(written(output))
+    assert statement["message"] == "Sending failed"
+    assert "ValueError: bad article" in statement["exception"]
+
+
+def test_text_format_with_exception(output):
+    Display.configure(level="INFO", json_format=False, stream=output)
+    try:
+        raise ValueError("bad article")
+    except ValueError:
+        Display.logger.exception("Sending failed", extra={"service": "Test Service"})
+
+    text = written(output)
+    assert text.startswith("Test Service: Sending failed\nTraceback (most recent call last):")
+    assert text.endswith("ValueError: bad article\n")
+
+
+def test_shutdown_writes_out_the_queue(output):
+    Display.configure(level="INFO", json_format=False, stream=output)
+    # Set up twice, the handlers of the first setup are replaced and nothing is written twice
+    Display.configure(level="INFO", json_format=False, stream=output)
+    for number in range(1000):
+        Display.message("Test Service", "statement %d", number)
+
+    assert written(output).splitlines() == [f"Test Service: statement {number}" for number in range(1000)]
+    assert not any(isinstance(handler, logging.handlers.QueueHandler) for handler in Display.logger.handlers)
+
+
+def test_statements_below_the_level_are_not_formatted(output):
+    class Unprintable:
+        def __str__(self):
+            raise AssertionError("formatted a skipped statement")
+
+    Display.configure(level="INFO", json_format=False, stream=output)
+    Display.debug("Test Service", "%s", Unprintable())
+
+    assert written(output) == ""
+
+
+@pytest.mark.parametrize("name, level", [("debug", Display.DEBUG), (" Warning ", Display.WARNING), ("40", Display.ERROR)])
+def test_level_from_the_environment(output, monkeypatch, name, level):
+    monkeypatch.setenv("WEALTHWORKS_LOG_LEVEL", name)
+    Display.configure(json_format=False, stream=output)
+
+    assert Display.logger.level == level
+    assert written(output) == ""
+
+
+def test_unknown_level_falls_back_to_info(output, monkeypatch):
+    monkeypatch.setenv("WEALTHWORKS_LOG_LEVEL", "verbose")
+    Display.configure(json_format=False, stream=output)
+    Display.debug("Test Service", "skipped")
+    Display.message("Test Service", "displayed")
+
+    assert Display.logger.level == Display.INFO
+    assert written(output) == "WealthWorks: Unknown log level VERBOSE, using INFO\nTest Service: displayed\n"
@@ -0,0 +1,56 @@
+"""
+Benchmarks for the debt repayment calculator
+
+Runs with pytest-benchmark (see requirements-dev.txt), across portfolios of 1 to 1000 debts and interest rates from
+near zero to 30%, and is skipped without it. The results are checked in test_debt_calculator.py.
+
+Record a baseline:
+    pytest WealthWorks/tests/test_debt_benchmarks.py --benchmark-autosave
+
+Compare against the latest baseline and fail on regressions:
+    pytest WealthWorks/tests/test_debt_benchmarks.py --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+import pytest
+
+from WealthWorks.tests.debt_portfolios import make_portfolio
+from WealthWorks.workers.debtRepaymentCalculator import (
+    calculate_repayment,
+    check_if_possible,
+    check_min_payment,
+    perc_to_dec,
+    priority_payment,
+    simulate_variable_rates,
+)
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.mark.parametrize("engine", ["loop", "closed_form"])
+def test_calculate_repayment(benchmark, size, regime, engine):
+    debts = make_portfolio(size, regime)
+    results = benchmark(calculate_repayment, debts, 100, engine)
+    assert results is not None
+    assert results[0] > 0
+
+
+@pytest.mark.parametrize("paths", [1000, 10000])
+def test_simulate_variable_rates(benchmark, regime, paths):
+    debts = make_portfolio(10, regime)
+    results = benchmark(simulate_variable_rates, debts, 100, paths, seed=42)
+    assert results.paths == paths
+    assert list(results.months) == sorted(results.months)
+
+
+def test_priority_payment(benchmark, size, regime):
+    debts = make_portfolio(size, regime)
+    assert benchmark(priority_payment, debts) in {debt.name for debt in debts}
+
+
+def test_check_if_possible(benchmark, size, regime):
+    debts = perc_to_dec(make_portfolio(size, regime))
+    assert benchmark(check_if_possible, debts, 100)
+
+
+def test_check_min_payment(benchmark, size, regime):
+    debts = perc_to_dec(make_portfolio(size, regime))
+    assert all(benchmark(check_min_payment, debts))
@@ -0,0 +1,332 @@
+"""
+Tests of the results of the debt repayment calculator, see test_debt_benchmarks.py for its benchmarks
+"""
+import numpy as np
+import pytest
+
+from WealthWorks.tests.debt_portfolios import make_portfolio
+from WealthWorks.workers.debtRepaymentCalculator import (
+    MAX_MONTHS,
+    PAID_OFF_TOLERANCE,
+    STRATEGIES,
+    Debt,
+    RepaymentCache,
+    cached_calculate_repayment,
+    calculate_repayment,
+    compare_strategies,
+    portfolio_key,
+    repayment_cache,
+    repayment_schedule,
+    repayment_schedule_array,
+    repayment_schedule_chunks,
+    simulate_strategies,
+    simulate_variable_rates,
+    solve_extra_payment,
+    strategy_order,
+    sweep_repayment,
+    what_if_payments,
+)
+
+
+def test_engines_agree(size, regime):
+    debts = make_portfolio(size, regime)
+    loop = calculate_repayment(debts, 100, "loop")
+    closed_form = calculate_repayment(debts, 100, "closed_form")
+    assert loop[0] == closed_form[0]
+    assert loop[2] == pytest.approx(closed_form[2], abs=0.011, rel=1e-5)
+    assert loop[3] == pytest.approx(closed_form[3], abs=0.011, rel=1e-5)
+
+
+def test_simulate_variable_rates_without_volatility(size, regime):
+    debts = make_portfolio(size, regime)
+    results = simulate_variable_rates(debts, 100, paths=3, rate_volatility=0)
+    expected = calculate_repayment(debts, 100)
+    assert list(results.months) == [expected[0]] * 3
+    assert results.total_interest_paid[1] == pytest.approx(expected[3], abs=0.011, rel=1e-5)
+
+
+def rollover_reference(debts, extra_payment, order):
+    """
+    Pay off the debts month by month in plain Python, with the rules of simulate_strategies
+    :return: months, total_interest_paid and the payoff month of every debt
+    """
+    balances = [debt.amount for debt in debts]
+    monthly_rates = [debt.interest_rate / 1200 for debt in debts]
+    min_payments = [max(debt.min_payment, debt.amount * rate) for debt, rate in zip(debts, monthly_rates)]
+    budget = sum(min_payments) + extra_payment
+    payoff_months = [0] * len(debts)
+    interest_paid = 0.0
+    month = 0
+    while not all(payoff_months):
+        month += 1
+        spare = budget
+        for i in order:
+            if not payoff_months[i]:
+                interest = balances[i] * monthly_rates[i]
+                interest_paid += interest
+                payment = min(balances[i] + interest, min_payments[i])
+                balances[i] += interest - payment
+                spare -= payment
+        for i in order:
+            payment = min(spare, balances[i])
+            balances[i] -= payment
+            spare -= payment
+        for i in order:
+            if not payoff_months[i] and balances[i] <= 1e-6:
+                balances[i] = 0
+                payoff_months[i] = month
+    return month, interest_paid, payoff_months
+
+
+def shocked(debts, rate_shock):
+    """The debts with every interest rate changed by a number of percentage points"""
+    return [debt._replace(interest_rate=debt.interest_rate + rate_shock) for debt in debts]
+
+
+def test_sweep_matches_calculate_repayment(size, regime):
+    debts = make_portfolio(size, regime)
+    extra_payments = np.array([0, 100, 2500.5])
+    # A shock of -1 leaves the near-zero rates at or below zero, which can not be paid off
+    rate_shocks = np.array([-1, 0, 2.5, 10])
+    grid_extra_payments, grid_rate_shocks = np.meshgrid(extra_payments, rate_shocks)
+
+    results = sweep_repayment(debts, grid_extra_payments, grid_rate_shocks)
+
+    assert results.months.shape == (len(rate_shocks), len(extra_payments))
+    for row, rate_shock in enumerate(rate_shocks):
+        for column, extra_payment in enumerate(extra_payments):
+            expected = calculate_repayment(shocked(debts, rate_shock), extra_payment, engine="closed_form")
+            if expected is None:
+                assert results.months[row, column] == -1
+                assert np.isnan(results.total_paid[row, column]) and np.isnan(results.total_interest_paid[row, column])
+                continue
+            months, monthly_payment, total_paid, total_interest_paid = expected
+            assert results.months[row, column] == months
+            assert results.monthly_payment[row, column] == pytest.approx(monthly_payment)
+            assert results.total_paid[row, column] == pytest.approx(total_paid, abs=0.01)
+            assert results.total_interest_paid[row, column] == pytest.approx(total_interest_paid, abs=0.01)
+
+
+@pytest.mark.parametrize("extra_payments, rate_shocks, shape", [
+    (0, 0, (1,)),
+    ([0, 100, 200], 0, (3,)),
+    ([0, 100, 200], [[0], [1]], (2, 3)),
+    ([[0, 100], [200, 300]], [[0, 1], [2, 3]], (2, 2)),
+])
+def test_sweep_keeps_the_shape_of_the_grid(extra_payments, rate_shocks, shape):
+    debts = make_portfolio(10, "moderate")
+    results = sweep_repayment(debts, extra_payments, rate_shocks)
+
+    flat = sweep_repayment(debts, *[np.broadcast_to(grid, shape).ravel() for grid in (extra_payments, rate_shocks)])
+    for field, flat_field in zip(results, flat):
+        assert field.shape == shape
+        np.testing.assert_array_equal(field.ravel(), flat_field)
+
+
+def test_sweep_rejects_shapes_that_do_not_broadcast():
+    with pytest.raises(ValueError, match="can not be broadcast"):
+        sweep_repayment(make_portfolio(10, "moderate"), [0, 100, 200], [0, 1])
+
+
+def test_what_if_payments_match_calculate_repayment():
+    debts = make_portfolio(10, "moderate")
+    rows = what_if_payments(debts, 100, steps=(0, 50, 500))
+
+    assert [row["extra"] for row in rows] == ["+0", "+50", "+500"]
+    for row, extra_payment in zip(rows, (100, 150, 600)):
+        months, _, _, total_interest_paid = calculate_repayment(debts, extra_payment, "closed_form")
+        assert row["months"] == months
+        assert row["interest"] == round(total_interest_paid)
+
+
+def test_strategy_order():
+    debts = [Debt("Card", 3000, 24, 90), Debt("Car", 8000, 6, 250), Debt("Store", 500, 18, 25), Debt("Loan", 500, 24, 20)]
+
+    # Highest rate first and smallest balance first, the other one breaking ties
+    assert strategy_order(debts, "avalanche") == [3, 0, 2, 1]
+    assert strategy_order(debts, "snowball") == [3, 2, 0, 1]
+    with pytest.raises(ValueError):
+        strategy_order(debts, "tsunami")
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+@pytest.mark.parametrize("extra_payment", [0, 250])
+def test_simulate_strategies_matches_a_month_by_month_rollover(strategy, extra_payment):
+    debts = make_portfolio(10, "moderate")
+    order = strategy_order(debts, strategy)
+
+    result, = simulate_strategies(debts, extra_payment, {strategy: order})
+
+    months, interest_paid, payoff_months = rollover_reference(debts, extra_payment, order)
+    assert result.months == months
+    assert result.payoff_months == payoff_months
+    assert result.total_interest_paid == pytest.approx(interest_paid, abs=0.01)
+    assert result.monthly_payment == pytest.approx(sum(debt.min_payment for debt in debts) + extra_payment)
+
+
+def test_freed_minimum_payments_roll_over():
+    # The minimum payment of the loan only covers its interest, it is paid off with the one of the card
+    debts = [Debt("Card", 300, 12, 100), Debt("Loan", 10000, 12, 100)]
+
+    result, = simulate_strategies(debts, 0, {"custom": [0, 1]})
+
+    assert result.payoff_months[0] == 4
+    assert 4 < result.payoff_months[1] < MAX_MONTHS
+    assert result.payoff_order == ["Card", "Loan"]
+    assert result.monthly_payment == 200
+
+
+@pytest.mark.parametrize("custom_order", [["Car"], ["Car", "Card", "Store"], ["Car", "Car"], []])
+def test_compare_strategies_rejects_invalid_custom_order(custom_order):
+    debts = [Debt("Card", 3000, 24, 90), Debt("Car", 8000, 6, 250)]
+
+    with pytest.raises(ValueError):
+        compare_strategies(debts, 100, custom_order)
+    with pytest.raises(ValueError):
+        simulate_strategies(debts, 100, {"custom": [0, 0]})
+
+
+def test_compare_strategies_with_custom_order():
+    debts = [Debt("Card", 3000, 24, 90), Debt("Car", 8000, 6, 250), Debt("Store", 500, 18, 25)]
+
+    results = {result.strategy: result for result in compare_strategies(debts, 100, ["Car", "Store", "Card"])}
+
+    assert list(results) == ["avalanche", "snowball", "custom"]
+    assert results["custom"].total_interest_paid > results["avalanche"].total_interest_paid
+
+
+@pytest.mark.parametrize("extra_payment", [0, 500])
+def test_avalanche_never_pays_more_interest_than_snowball(size, regime, extra_payment):
+    results = {result.strategy: result for result in compare_strategies(make_portfolio(size, regime), extra_payment)}
+
+    assert results["avalanche"].total_interest_paid <= results["snowball"].total_interest_paid
+
+
+def test_solve_extra_payment_without_extra_needed():
+    debts = make_portfolio(10, "moderate")
+    months = calculate_repayment(debts)[0]
+
+    assert solve_extra_payment(debts, months) == 0
+    assert solve_extra_payment(debts, months + 24) == 0
+
+
+@pytest.mark.parametrize("target_months", [0, -3])
+def test_solve_extra_payment_for_a_target_that_can_not_be_met(target_months):
+    assert solve_extra_payment(make_portfolio(10, "moderate"), target_months) is None
+    # A debt without interest is never possible, like in calculate_repayment
+    assert solve_extra_payment([Debt("Friend", 100, 0, 10)], 5) is None
+
+
+@pytest.mark.parametrize("target_months", [1, 12, 24, 50])
+@pytest.mark.parametrize("tolerance", [0.01, 1])
+def test_solve_extra_payment_is_minimal(size, regime, target_months, tolerance):
+    debts = make_portfolio(size, regime)
+
+    extra_payment = solve_extra_payment(debts, target_months, tolerance)
+
+    # The target is met, and one step of the tolerance less misses it
+    assert calculate_repayment(debts, extra_payment, "closed_form")[0] <= target_months
+    if extra_payment > 0:
+        assert calculate_repayment(debts, extra_payment - tolerance, "closed_form")[0] > target_months
+    assert round(extra_payment / tolerance, 6) == round(extra_payment / tolerance)
+
+
+@pytest.mark.parametrize("extra_payment", [0, 100])
+def test_schedules_agree_row_for_row(size, regime, extra_payment):
+    debts = make_portfolio(size, regime)
+
+    rows = list(repayment_schedule(debts, extra_payment))
+    schedule = repayment_schedule_array(debts, extra_payment)
+
+    assert [row.month for row in rows] == schedule.months.tolist() == list(range(1, len(rows) + 1))
+    for column in ("balances", "interest", "principal"):
+        assert np.array([getattr(row, column) for row in rows]) == pytest.approx(getattr(schedule, column), abs=1e-5)
+    assert [row.remaining for row in rows] == pytest.approx(schedule.remaining, abs=1e-5)
+
+    # Smaller chunks make the same schedule
+    chunks = list(repayment_schedule_chunks(debts, extra_payment, chunk_months=7))
+    assert len(chunks) == -(-len(rows) // 7)
+    assert np.concatenate([chunk.balances for chunk in chunks]) == pytest.approx(schedule.balances)
+
+
+@pytest.mark.parametrize("extra_payment", [0, 100])
+def test_schedule_totals_match_calculate_repayment(size, regime, extra_payment):
+    debts = make_portfolio(size, regime)
+    months, _, total_paid, total_interest_paid = calculate_repayment(debts, extra_payment)
+
+    rows = list(repayment_schedule(debts, extra_payment))
+    schedule = repayment_schedule_array(debts, extra_payment)
+
+    assert len(rows) == len(schedule.months) == months
+    assert sum(sum(row.interest) for row in rows) == pytest.approx(total_interest_paid, abs=0.011, rel=1e-5)
+    assert schedule.interest.sum() == pytest.approx(total_interest_paid, abs=0.011, rel=1e-5)
+    assert sum(debt.amount for debt in debts) + schedule.interest.sum() == pytest.approx(total_paid, abs=0.011, rel=1e-5)
+
+    # The remaining balance of all debts together reaches zero in the last month
+    assert schedule.remaining[-1] <= PAID_OFF_TOLERANCE
+    assert len(rows) == 1 or schedule.remaining[-2] > PAID_OFF_TOLERANCE
+
+
+def test_schedule_of_debts_that_can_not_be_paid_off():
+    debts = [Debt("Friend", 100, 0, 10)]
+
+    assert list(repayment_schedule(debts)) == []
+    assert list(repayment_schedule_chunks(debts)) == []
+    assert repayment_schedule_array(debts) is None
+
+
+@pytest.fixture
+def cache():
+    """The shared repayment cache, empty"""
+    repayment_cache.clear()
+    yield repayment_cache
+    repayment_cache.clear()
+
+
+def test_cache_hit_returns_the_same_result(cache):
+    debts = make_portfolio(10, "moderate")
+
+    first = cached_calculate_repayment(debts, 100)
+    second = cached_calculate_repayment(debts, 100)
+
+    assert second == first == calculate_repayment(debts, 100, "closed_form")
+    assert cache.info() == {"hits": 1, "misses": 1, "size": 1, "maxsize": 256}
+
+
+def test_cache_evicts_the_least_recently_used():
+    cache = RepaymentCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (True, 1)
+
+    cache.put("c", 3)
+
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1) and cache.get("c") == (True, 3)
+    cache.resize(1)
+    assert cache.get("a") == (False, None) and cache.get("c") == (True, 3)
+    assert cache.info() == {"hits": 4, "misses": 2, "size": 1, "maxsize": 1}
+
+
+def test_portfolio_key_ignores_order_and_representation():
+    debts = [Debt("Card", 3000, 24, 90), Debt("Car", 8000.0, 6.0, 250)]
+    as_dicts = [debt._asdict() for debt in reversed(debts)]
+    renamed = [debt._replace(name=f"My {debt.name}") for debt in debts]
+
+    assert portfolio_key(debts, 100) == portfolio_key(as_dicts, 100.0) == portfolio_key(renamed, 100)
+    assert portfolio_key(debts, 100) != portfolio_key(debts, 101)
+    assert portfolio_key(debts, 100) != portfolio_key(debts, 100, "loop")
+    assert portfolio_key(debts, 100) != portfolio_key([debts[0]._replace(interest_rate=25), debts[1]], 100)
+
+
+def test_cached_results_can_not_be_changed(cache):
+    debts = [Debt("Card", 3000, 24, 90)._asdict(), Debt("Car", 8000, 6, 250)._asdict()]
+    result = cached_calculate_repayment(debts, 100)
+
+    with pytest.raises(TypeError):
+        result[0] = 0
+    # Changing the debts afterwards is a different portfolio, the cached result stays as it was
+    debts[0]["amount"] = 1
+    assert cached_calculate_repayment(debts, 100) != result
+    debts[0]["amount"] = 3000
+    assert cached_calculate_repayment(debts, 100) is result
@@ -0,0 +1,159 @@
+"""
+Tests of the rate limiting, retries and credit ledger of marketauxClient.py, with a fake clock and httpx.MockTransport
+"""
+import asyncio
+import datetime
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from WealthWorks.workers.marketauxClient import MarketauxClient, QuotaExhausted, TokenBucket, retryAfter
+
+
+class Clock:
+    """A clock that only moves when sleep is called"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def client_for(responses, clock: Clock, **options) -> MarketauxClient:
+    """A client answered by the responses in order, a response can be an exception to raise"""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        response = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = MarketauxClient(
+        client=httpx.AsyncClient(base_url="https://marketaux.test/v1", transport=httpx.MockTransport(handler)),
+        sleep=clock.sleep, backoff=0.5, **options
+    )
+    client.bucket = TokenBucket(60, clock=clock)
+    client.requests = requests
+    return client
+
+
+def get(client: MarketauxClient) -> httpx.Response:
+    async def run():
+        try:
+            return await client.get("/news/all")
+        finally:
+            await client.client.aclose()
+    return asyncio.run(run())
+
+
+def test_bucket_refills_at_the_rate():
+    clock = Clock()
+    bucket = TokenBucket(60, capacity=2, clock=clock)
+
+    async def take(count):
+        for _ in range(count):
+            await bucket.acquire(clock.sleep)
+
+    asyncio.run(take(2))
+    assert clock.sleeps == []
+
+    # One token a second once the burst is used up
+    asyncio.run(take(2))
+    assert clock.now == pytest.approx(2)
+
+    # A quiet period refills the bucket up to its capacity only
+    clock.now += 60
+    asyncio.run(take(3))
+    assert clock.now == pytest.approx(63)
+
+
+def test_bucket_pause():
+    clock = Clock()
+    bucket = TokenBucket(60, clock=clock)
+
+    bucket.pause(5)
+    bucket.pause(2)
+    assert bucket.waitTime() == 5
+
+    asyncio.run(bucket.acquire(clock.sleep))
+    assert clock.now == 5
+
+
+def test_retries_server_errors_and_rate_limits():
+    clock = Clock()
+    client = client_for([
+        httpx.Response(500),
+        httpx.Response(429, headers={"Retry-After": "7"}),
+        httpx.Response(200, json={"data": []}),
+    ], clock)
+
+    response = get(client)
+
+    assert response.status_code == 200
+    assert len(client.requests) == 3
+    # The backoff of a 500 is slept, the Retry-After of a 429 pauses the bucket for every request
+    assert clock.sleeps[0] <= 0.5
+    assert clock.now >= 7
+    assert client.ledger.summary() == {
+        "credits": 3, "articles": 0, "articles_per_credit": 0.0, "retries": 2,
+        "status_codes": {500: 1, 429: 1, 200: 1}
+    }
+
+
+def test_does_not_retry_client_errors():
+    clock = Clock()
+    client = client_for([httpx.Response(401)], clock)
+
+    assert get(client).status_code == 401
+    assert len(client.requests) == 1 and client.ledger.retries == 0
+
+
+def test_gives_up_after_the_last_retry():
+    clock = Clock()
+    client = client_for([httpx.Response(503)], clock, max_retries=2)
+
+    assert get(client).status_code == 503
+    assert len(client.requests) == 3
+
+    client = client_for([httpx.ConnectError("refused")], clock, max_retries=2)
+    with pytest.raises(httpx.ConnectError):
+        get(client)
+    assert len(client.requests) == 3 and client.ledger.credits == 0
+
+
+def test_stops_at_the_credit_budget():
+    clock = Clock()
+    client = client_for([httpx.Response(500)], clock, credit_budget=2)
+
+    with pytest.raises(QuotaExhausted):
+        get(client)
+    assert len(client.requests) == 2 and client.ledger.credits == 2
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("12", 12), ("1.5", 1.5), ("-3", 0), ("soon", None), (None, None),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", 0), ("Wed, 21 Oct 2015 07:28:00 -0000", 0),
+])
+def test_retry_after(value, seconds):
+    headers = {} if value is None else {"Retry-After": value}
+
+    assert retryAfter(httpx.Response(429, headers=headers)) == seconds
+
+
+@pytest.mark.parametrize("usegmt", [True, False])
+def test_retry_after_date(usegmt):
+    retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=120)
+    value = format_datetime(retry_at, usegmt=usegmt)
+    if not usegmt:
+        value = value.replace("+0000", "-0000")
+
+    assert 110 < retryAfter(httpx.Response(429, headers={"Retry-After": value})) <= 120
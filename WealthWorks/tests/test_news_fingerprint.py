@@ -0,0 +1,91 @@
+"""
+Tests of the near duplicate detection of newsFingerprint.py
+"""
+import pytest
+
+from WealthWorks.tests.workers_standin import as_article, make_items
+from WealthWorks.workers.newsFingerprint import (
+    EMPTY,
+    NearDuplicateIndex,
+    bandsFor,
+    fingerprints,
+    removeNearDuplicates,
+    similarity,
+)
+
+ORIGINAL = {
+    "title": "Apple shares jump after record iPhone sales in China",
+    "description": "Apple stock rose 4% on Tuesday after the company reported record iPhone sales in China during "
+                   "the holiday quarter.",
+    "url": "https://news.example.com/apple-record-iphone-sales",
+}
+SYNDICATED = {
+    "title": "Apple Shares Jump After Record iPhone Sales In China - Example Wire",
+    "description": ORIGINAL["description"],
+    "url": "https://wire.example.com/apple-record-iphone-sales?utm_source=feed",
+}
+UNRELATED = {
+    "title": "Tesla recalls 2 million cars over autopilot",
+    "description": "Tesla is recalling more than 2 million vehicles in the US to fix its Autopilot system.",
+    "url": "https://news.example.com/tesla-recall",
+}
+
+
+def test_similarity():
+    original, syndicated, unrelated = fingerprints([ORIGINAL, SYNDICATED, UNRELATED])
+
+    assert similarity(original, original) == 1
+    assert similarity(original, syndicated) > 0.8
+    assert similarity(original, unrelated) < 0.2
+
+
+def test_article_without_text_is_never_a_duplicate():
+    empty = {"title": "", "description": None, "url": "https://news.example.com/empty"}
+
+    assert (fingerprints([empty]) == EMPTY).all()
+    kept, duplicates = removeNearDuplicates([empty, dict(empty, url="https://news.example.com/other")], threshold=0.5)
+    assert len(kept) == 2 and duplicates == []
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.8, 0.9, 0.95])
+def test_bands_find_pairs_at_the_threshold(threshold):
+    bands, rows = bandsFor(threshold)
+
+    assert bands * rows == 128
+    # A pair at the threshold becomes a candidate nearly always
+    assert 1 - (1 - threshold ** rows) ** bands >= 0.9
+
+
+def test_remove_near_duplicates_keeps_the_first():
+    kept, duplicates = removeNearDuplicates([ORIGINAL, UNRELATED, SYNDICATED], threshold=0.8)
+
+    assert kept == [ORIGINAL, UNRELATED]
+    assert duplicates == [SYNDICATED]
+
+
+def test_threshold_of_one_turns_detection_off():
+    kept, duplicates = removeNearDuplicates([ORIGINAL, SYNDICATED], threshold=1)
+
+    assert kept == [ORIGINAL, SYNDICATED] and duplicates == []
+
+
+def test_index_is_kept_across_batches():
+    index = NearDuplicateIndex(threshold=0.8)
+    removeNearDuplicates([ORIGINAL], index=index)
+
+    kept, duplicates = removeNearDuplicates([SYNDICATED, UNRELATED], index=index)
+
+    assert kept == [UNRELATED] and duplicates == [SYNDICATED]
+    assert len(index) == 2
+    index.remove(ORIGINAL["url"])
+    assert index.find(fingerprints([SYNDICATED])[0]) is None
+
+
+def test_syndicated_copies_in_a_large_batch():
+    articles = [as_article(item) for item in reversed(make_items(3000, near_duplicate_rate=0.1))]
+
+    kept, duplicates = removeNearDuplicates(articles, threshold=0.8)
+
+    # Only the copies are removed, the first item of every story is kept
+    assert all("utm_source" in article["url"] for article in duplicates)
+    assert len({article["title"].removesuffix(" - Example Wire") for article in kept}) == len(kept)
@@ -0,0 +1,732 @@
+"""
+Tests of the news workers against the offline stand-in of workers_standin.py
+
+Load test them with bench_workers.py:
+    python -m WealthWorks.tests.bench_workers --articles 10000 100000
+"""
+import asyncio
+import json
+import os
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from WealthWorks.tests.bench_workers import run_cycle, use_standin
+from WealthWorks.tests.workers_standin import STANDIN_KEY, StandIn, as_article, make_items
+
+ENVIRONMENT = (
+    "MARKETAUX_API_KEY", "MARKETAUX_URL", "MARKETAUX_PAGES", "SUPABASE_URL", "SUPABASE_API_KEY",
+    "NEWS_SPOOL_FILE", "NEWS_WATERMARK_FILE", "NEWS_INDEX_FILE",
+)
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    """Put the variables the stand-in sets back afterwards"""
+    for name in ENVIRONMENT:
+        monkeypatch.delenv(name, raising=False)
+
+
+def collect(standin: StandIn):
+    import newsCollector
+    return asyncio.run(newsCollector.collectNews(
+        marketaux_key="standin", supabase_key=STANDIN_KEY, supabase_url=standin.supabase_url
+    ))
+
+
+@pytest.mark.parametrize("functions", [False, True])
+def test_collect_is_incremental(tmp_path, monkeypatch, functions):
+    with StandIn(make_items(25), functions=functions, page_limit=10) as standin:
+        use_standin(standin, str(tmp_path))
+        monkeypatch.setenv("MARKETAUX_PAGES", "5")
+
+        assert collect(standin) == 25
+        assert standin.round_trips["marketaux"] == 3
+
+        # Nothing was published since, one request finds it out
+        assert collect(standin) == 0
+        assert standin.round_trips["marketaux"] == 4
+        assert len(standin.table.rows) == 25
+
+
+def test_collect_resumes_after_the_page_cap(tmp_path, monkeypatch):
+    items = make_items(20)
+    with StandIn(items[-2:], page_limit=3) as standin:
+        use_standin(standin, str(tmp_path))
+        monkeypatch.setenv("MARKETAUX_PAGES", "2")
+        assert collect(standin) == 2
+
+        # 18 articles are published, more than the 2 pages of 3 a run gets, the next runs pick up where one stopped.
+        # The first item of a run is the last one of the run before, published_after includes it
+        standin.items = items
+        assert [collect(standin) for _ in range(5)] == [5, 5, 5, 3, 0]
+        assert sorted(row["url"] for row in standin.table.rows.values()) == sorted(item["url"] for item in items)
+
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_collect_requests_pages_concurrently(tmp_path, monkeypatch, concurrency):
+    with StandIn(make_items(20), page_limit=3, latency=0.05) as standin:
+        use_standin(standin, str(tmp_path))
+        monkeypatch.setenv("MARKETAUX_PAGES", "5")
+        monkeypatch.setenv("MARKETAUX_CONCURRENCY", str(concurrency))
+
+        # The first page alone, then the other 4 pages, as many at a time as the concurrency
+        assert collect(standin) == 15
+        assert standin.round_trips["marketaux"] == 5
+        assert standin.max_in_flight == concurrency
+
+        # Nothing was published since, the first page is not full and no other page is requested
+        assert collect(standin) == 0
+        assert standin.round_trips["marketaux"] == 6
+
+
+def test_collect_stops_the_watermark_at_a_failed_page(tmp_path, monkeypatch):
+    items = make_items(20)
+    with StandIn(items[-2:], page_limit=3) as standin:
+        use_standin(standin, str(tmp_path))
+        monkeypatch.setenv("MARKETAUX_PAGES", "5")
+        assert collect(standin) == 2
+
+        # Pages 2 to 5 are requested together and page 3 fails, only the 2 pages before it are kept
+        standin.items = items
+        standin.failing_pages = {3}
+        assert collect(standin) == 5
+        assert standin.round_trips["marketaux"] == 6
+
+        # The next runs pick up the articles of page 3 onwards, nothing is skipped
+        standin.failing_pages = set()
+        assert [collect(standin) for _ in range(2)] == [13, 0]
+        assert sorted(row["url"] for row in standin.table.rows.values()) == sorted(item["url"] for item in items)
+
+
+@pytest.mark.parametrize("functions", [False, True])
+def test_collect_skips_stored_articles(tmp_path, functions):
+    items = make_items(10)
+    with StandIn(items, unique=True, functions=functions, page_limit=10) as standin:
+        standin.seed([as_article(item) for item in items[5:]])
+        use_standin(standin, str(tmp_path))
+
+        assert collect(standin) == 5
+        assert len(standin.table.rows) == 10
+
+
+@pytest.mark.parametrize("unique", [False, True])
+def test_insert_missing_articles(tmp_path, unique):
+    import newsCollector
+    from supabaseClient import getClient
+
+    items = make_items(6)
+    stored = [dict(as_article(item), title=f'"Quoted", (and) {item["title"]}') for item in items[3:]]
+    with StandIn(unique=unique) as standin:
+        standin.seed(stored)
+        use_standin(standin, str(tmp_path))
+        new = [as_article(item) for item in items[:3]]
+        # A stored url, a stored title in other case and spacing, and a repeat of a new article
+        renamed = dict(stored[1], url="https://news.example.com/renamed", title=stored[1]["title"].upper())
+        articles = [stored[0], renamed] + new + [dict(new[0])]
+
+        inserted = newsCollector.insertMissing(articles, getClient(standin.supabase_url, STANDIN_KEY))
+
+        # Without the title_key column only the urls are checked
+        assert inserted == (3 if unique else 4)
+        assert len(standin.table.rows) == 3 + inserted
+
+
+@pytest.mark.parametrize("unique", [False, True])
+def test_send_without_insert_news(tmp_path, unique):
+    import newsCollector
+
+    items = make_items(4)
+    with StandIn(unique=unique) as standin:
+        standin.seed([as_article(items[-1])])
+        use_standin(standin, str(tmp_path))
+        # The upsert on url is rejected, 42P10 without the url constraint and 23505 for a title already stored
+        retitled = dict(as_article(items[-2]), title=items[-1]["title"].lower())
+        articles = [as_article(items[-1]), retitled] + [as_article(item) for item in items[:2]]
+
+        inserted = newsCollector.sendToDb(key=STANDIN_KEY, url=standin.supabase_url, articles=articles)
+
+        assert inserted == (2 if unique else 3)
+        assert len(standin.table.rows) == 1 + inserted
+
+
+def test_standin_rejects_upserts_postgrest_rejects():
+    from supabaseClient import getClient
+    import postgrest.exceptions
+
+    stored, new = [as_article(item) for item in make_items(2)]
+    retitled = dict(new, title=stored["title"])
+    with StandIn() as plain, StandIn(unique=True) as unique:
+        plain.seed([stored])
+        unique.seed([stored])
+
+        def upsert(standin: StandIn, article: dict, on_conflict: str):
+            table = getClient(standin.supabase_url, STANDIN_KEY).table("WealthworksNews")
+            return table.upsert([article], on_conflict=on_conflict, ignore_duplicates=True).execute().data
+
+        # No unique constraint on the target, and a conflict on another column than the target
+        for standin, article, on_conflict, code in ((plain, new, "url", "42P10"), (unique, retitled, "url", "23505"),
+                                                    (unique, stored, "id", "23505")):
+            with pytest.raises(postgrest.exceptions.APIError) as error:
+                upsert(standin, article, on_conflict)
+            assert error.value.code == code
+
+        # Conflicts on the target are ignored
+        assert upsert(unique, stored, "url") == []
+        assert len(upsert(unique, new, "url")) == 1
+
+
+def test_standin_filters():
+    from WealthWorks.tests.workers_standin import predicate
+
+    urls = predicate("in", '("https://a.example.com/?q=1,2","https://b.example.com/\\"x\\"")')
+    assert urls("https://a.example.com/?q=1,2") and urls('https://b.example.com/"x"')
+    assert not urls("https://a.example.com/?q=1") and not urls(None)
+    ids = predicate("in", "(1,2,3)")
+    assert ids(2) and not ids(4)
+    assert predicate("lte", "42")(42) and not predicate("lt", "42")(42)
+    assert predicate("gt", "1.5")(2.0) and predicate("neq", "a")("b")
+    assert predicate("is", "null")(None) and not predicate("eq", "5")(None)
+
+
+def test_collect_keeps_articles_while_database_fails(tmp_path):
+    with StandIn(make_items(10), unique=True, page_limit=10) as standin:
+        use_standin(standin, str(tmp_path))
+        standin.database_up = False
+
+        assert collect(standin) == 0
+        assert standin.table.rows == {}
+
+        standin.database_up = True
+        assert collect(standin) == 10
+
+
+def test_drain_spool_past_a_poison_article(tmp_path):
+    import newsCollector
+    import postgrest.exceptions
+    from newsSpool import drainSpool, spoolArticles
+
+    path = str(tmp_path / "spool.sqlite3")
+    articles = [as_article(item) for item in make_items(10)]
+    articles[3]["sentiment_score"] = "not a number"
+    spoolArticles(path, articles)
+    stored = []
+
+    def send(batch):
+        if any(article["sentiment_score"] == "not a number" for article in batch):
+            raise postgrest.exceptions.APIError({"code": "22P02", "message": "invalid input syntax for type numeric"})
+        stored.extend(batch)
+
+    assert drainSpool(path, send, batch_size=4, permanent=newsCollector.permanentError) == 9
+    assert stored == articles[:3] + articles[4:]
+    with closing(sqlite3.connect(path)) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0] == 0
+        dead_letters = connection.execute("SELECT article, error FROM dead_letters").fetchall()
+    assert [json.loads(article) for article, _ in dead_letters] == [articles[3]]
+    assert "22P02" in dead_letters[0][1]
+
+
+def test_drain_spool_keeps_articles_on_transient_errors(tmp_path):
+    import newsCollector
+    import postgrest.exceptions
+    from newsSpool import drainSpool, spoolArticles
+
+    path = str(tmp_path / "spool.sqlite3")
+    spoolArticles(path, [as_article(item) for item in make_items(10)])
+
+    def send(batch):
+        raise postgrest.exceptions.APIError({"message": "database unavailable"})
+
+    with pytest.raises(postgrest.exceptions.APIError):
+        drainSpool(path, send, batch_size=4, permanent=newsCollector.permanentError)
+    with closing(sqlite3.connect(path)) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0] == 10
+        assert connection.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("functions", [False, True])
+def test_cycle(functions):
+    results = {result["phase"]: result for result in run_cycle(500, new_articles=50, duplicate_rate=0.1,
+                                                               functions=functions)}
+
+    assert results["collect"]["rows_after"] == 550
+    assert results["trim"]["rows_after"] == 500
+    assert results["clean"]["rows_after"] < results["trim"]["rows_after"]
+    assert results["fetch"]["rows_after"] == results["clean"]["rows_after"]
+    assert results["fetch"]["postgrest_round_trips"] > 0
+
+
+def test_delete_articles_in_chunks(tmp_path, monkeypatch):
+    import newsCleanner
+
+    with StandIn() as standin:
+        standin.seed([as_article(item) for item in make_items(25)])
+        use_standin(standin, str(tmp_path))
+        monkeypatch.setattr(newsCleanner, "DELETE_CHUNK_SIZE", 10)
+        old_articles = newsCleanner.fetchNews(standin.supabase_url, STANDIN_KEY, "test")
+        before = standin.round_trips["postgrest"]
+
+        newsCleanner.deleteArticles(
+            url=standin.supabase_url, key=STANDIN_KEY, service="test",
+            old_articles=old_articles, new_articles=old_articles[:4]
+        )
+
+        assert standin.round_trips["postgrest"] - before == 3
+        assert sorted(standin.table.rows) == [article["id"] for article in old_articles[:4]]
+
+
+def test_pages_tolerate_gaps_in_ids(tmp_path):
+    from WealthWorks.workers import newsFetcher
+
+    with StandIn() as standin:
+        standin.seed([as_article(item) for item in make_items(12)])
+        for row_id in (3, 4, 8, 11):
+            standin.table.remove(row_id)
+        use_standin(standin, str(tmp_path))
+
+        news, pages = newsFetcher.FetchNews()
+
+        assert [article["id"] for article in news] == [12, 10, 9, 7, 6, 5, 2, 1]
+        assert pages == {1: 12, 2: 5}
+        page = newsFetcher.getNewsPage(standin.supabase_url, STANDIN_KEY, first_id=pages[2])
+        assert [article["id"] for article in page] == [5, 2, 1]
+
+
+def test_cleaner_only_checks_new_articles(tmp_path):
+    import newsCleanner
+
+    items = make_items(60)
+    with StandIn() as standin:
+        standin.seed([as_article(item) for item in reversed(items[10:])])
+        use_standin(standin, str(tmp_path))
+        newsCleanner.clean_news()
+        assert len(standin.table.rows) == 50
+
+        # A copy, a syndicated copy and a new story arrive
+        copy, syndicated, new = as_article(items[-1]), as_article(items[-2]), as_article(items[0])
+        syndicated.update(title=syndicated["title"] + " - Example Wire", url=syndicated["url"] + "?utm_source=wire")
+        standin.seed([copy, syndicated, new])
+        before = standin.round_trips["postgrest"]
+        newsCleanner.clean_news()
+
+        # The id range, one page of the 3 new articles and one delete
+        assert standin.round_trips["postgrest"] - before == 4
+        assert len(standin.table.rows) == 51
+        assert new["url"] in {row["url"] for row in standin.table.rows.values()}
+
+
+def test_cleaner_forgets_trimmed_articles(tmp_path):
+    import newsCleanner
+    import newsCollector
+
+    items = make_items(20)
+    with StandIn() as standin:
+        standin.seed([as_article(item) for item in reversed(items)])
+        use_standin(standin, str(tmp_path))
+        newsCleanner.clean_news()
+        newsCollector.correctDbSize(key=STANDIN_KEY, url=standin.supabase_url, max_size=10)
+
+        # The oldest story comes back after it was trimmed, it is not a duplicate anymore
+        standin.seed([as_article(items[-1])])
+        newsCleanner.clean_news()
+
+        assert len(standin.table.rows) == 11
+
+
+def test_cleaner_checks_again_when_deletes_fail(tmp_path, monkeypatch):
+    import newsCleanner
+
+    items = make_items(10)
+    with StandIn() as standin:
+        standin.seed([as_article(item) for item in reversed(items)] + [as_article(items[0])])
+        use_standin(standin, str(tmp_path))
+        with monkeypatch.context() as patch:
+            patch.setattr(newsCleanner, "deleteArticles", lambda **kwargs: 0)
+            newsCleanner.clean_news()
+        assert len(standin.table.rows) == 11
+
+        newsCleanner.clean_news()
+        assert len(standin.table.rows) == 10
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def test_news_cache_serves_stale_news_while_loading_them_again():
+    import threading
+    from WealthWorks.workers.newsFetcher import NewsCache
+
+    clock = Clock()
+    cache = NewsCache(ttl=10, stale_ttl=20, clock=clock)
+    loads = []
+    release = threading.Event()
+
+    def load():
+        loads.append(clock.now)
+        if len(loads) > 1:
+            release.wait(5)
+        return len(loads)
+
+    assert cache.get(load) == 1
+    clock.now = 5
+    assert cache.get(load) == 1
+
+    # Stale: the old news at once, and a single load in the background
+    clock.now = 15
+    assert cache.get(load) == 1
+    assert cache.get(load) == 1
+    release.set()
+    for _ in range(500):
+        if cache.info()["loads"] == 2:
+            break
+        threading.Event().wait(0.01)
+    assert cache.get(load) == 2
+    assert loads == [0, 15]
+    assert cache.info() == {"hits": 2, "stale_hits": 2, "misses": 1, "loads": 2, "errors": 0, "age": 0}
+
+
+def test_news_cache_loads_once_for_many_sessions():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from WealthWorks.workers.newsFetcher import NewsCache
+
+    cache = NewsCache(ttl=10, stale_ttl=0, clock=Clock())
+    loads = []
+    started = threading.Event()
+
+    def load():
+        loads.append(1)
+        started.wait(5)
+        return "news"
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        sessions = [pool.submit(cache.get, load) for _ in range(20)]
+        for _ in range(500):
+            if cache.info()["misses"] == 20:
+                break
+            threading.Event().wait(0.01)
+        started.set()
+        assert [session.result() for session in sessions] == ["news"] * 20
+
+    assert len(loads) == 1
+
+
+def test_news_cache_does_not_keep_errors():
+    from WealthWorks.workers.newsFetcher import NewsCache
+
+    clock = Clock()
+    cache = NewsCache(ttl=10, stale_ttl=0, clock=clock)
+
+    def fail():
+        raise ConnectionError("database down")
+
+    with pytest.raises(ConnectionError):
+        cache.get(fail)
+    assert cache.get(lambda: "news") == "news"
+    assert cache.info()["errors"] == 1
+
+
+def schedule(job, interval: float, stop: asyncio.Event, lock: asyncio.Lock, clock=None):
+    import newsDaemon
+    if clock is None:
+        return newsDaemon.scheduleJob("test", job, interval, lock, stop, "Test")
+    return newsDaemon.scheduleJob("test", job, interval, lock, stop, "Test", clock=clock, sleep=clock.sleep)
+
+
+@pytest.mark.parametrize("duration, starts, sleeps", [
+    (3, [0, 10, 20], [7, 7]),
+    (10, [0, 10, 20], [0, 0]),
+    # The starts at 10 and 20 are missed and skipped, not run back to back
+    (25, [0, 30, 60], [5, 5]),
+])
+def test_schedule_keeps_starts_on_the_interval(duration, starts, sleeps):
+    clock = Clock()
+    calls = []
+
+    async def run():
+        stop = asyncio.Event()
+
+        async def job():
+            calls.append(clock.now)
+            clock.now += duration
+            if len(calls) == 3:
+                stop.set()
+
+        await schedule(job, 10, stop, asyncio.Lock(), clock)
+
+    asyncio.run(run())
+    assert calls == starts
+    assert clock.sleeps == sleeps
+
+
+def test_schedule_survives_a_failed_job():
+    clock = Clock()
+    calls = []
+
+    async def run():
+        stop = asyncio.Event()
+
+        async def job():
+            calls.append(clock.now)
+            if len(calls) == 1:
+                raise ConnectionError("database down")
+            stop.set()
+
+        await schedule(job, 10, stop, asyncio.Lock(), clock)
+
+    asyncio.run(run())
+    assert calls == [0, 10]
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_schedule_never_overlaps_jobs_sharing_a_lock(shared):
+    clock = Clock()
+    calls = []
+    running = set()
+    overlaps = []
+
+    async def run():
+        stop = asyncio.Event()
+        locks = [asyncio.Lock()] * 2 if shared else [asyncio.Lock(), asyncio.Lock()]
+
+        def recording(name):
+            async def job():
+                running.add(name)
+                calls.append(name)
+                # Handing the loop to the other job a few times while running
+                for _ in range(3):
+                    await asyncio.sleep(0)
+                    overlaps.append(len(running) > 1)
+                running.discard(name)
+                if len(calls) >= 6:
+                    stop.set()
+            return job
+
+        await asyncio.gather(
+            schedule(recording("collect"), 10, stop, locks[0], clock),
+            schedule(recording("trim"), 10, stop, locks[1], clock)
+        )
+
+    asyncio.run(run())
+    assert calls.count("collect") >= 2 and calls.count("trim") >= 2
+    assert any(overlaps) != shared
+
+
+def test_schedule_stops_while_waiting():
+    calls = []
+
+    async def run():
+        stop = asyncio.Event()
+
+        async def job():
+            calls.append(1)
+            asyncio.get_running_loop().call_later(0.01, stop.set)
+
+        # The real clock, an hour until the next start
+        await asyncio.wait_for(schedule(job, 3600, stop, asyncio.Lock()), timeout=5)
+
+    asyncio.run(run())
+    assert calls == [1]
+
+
+def test_schedule_does_not_start_jobs_once_stopped():
+    calls = []
+
+    async def run():
+        stop = asyncio.Event()
+        lock = asyncio.Lock()
+
+        async def first():
+            calls.append("first")
+            await asyncio.sleep(0)
+            stop.set()
+
+        async def second():
+            calls.append("second")
+
+        # The second job waits for the lock while the first one stops the daemon
+        await asyncio.wait_for(asyncio.gather(
+            schedule(first, 3600, stop, lock), schedule(second, 3600, stop, lock)
+        ), timeout=5)
+        stopped = asyncio.Event()
+        stopped.set()
+        await asyncio.wait_for(schedule(second, 3600, stopped, lock), timeout=5)
+
+    asyncio.run(run())
+    assert calls == ["first"]
+
+
+def test_daemon_stops_on_the_stop_event(tmp_path):
+    import newsDaemon
+
+    with StandIn(make_items(5)) as standin:
+        use_standin(standin, str(tmp_path))
+
+        async def run():
+            stop = asyncio.Event()
+            daemon = asyncio.ensure_future(newsDaemon.runDaemon(
+                marketaux_key="standin", supabase_key=STANDIN_KEY, supabase_url=standin.supabase_url,
+                collect_interval=3600, clean_interval=3600, trim_interval=3600, stop=stop
+            ))
+            for _ in range(500):
+                if standin.table.rows or daemon.done():
+                    break
+                await asyncio.sleep(0.01)
+            stop.set()
+            await asyncio.wait_for(daemon, timeout=10)
+
+        asyncio.run(run())
+        assert len(standin.table.rows) == 5
+
+
+def test_pipeline_from_a_file(tmp_path):
+    import newsPipeline
+
+    items = make_items(6)
+    # A repeated url, a repeated title with extra spaces, an item without entities, and a blank line
+    fixture = items + [
+        {**items[0], "uuid": "repeat"},
+        {**items[1], "uuid": "retitled", "title": "  " + items[1]["title"].upper() + " ",
+         "url": "https://news.example.com/elsewhere"},
+        {**items[2], "uuid": "no-entities", "url": "https://news.example.com/bare", "entities": []},
+    ]
+    source = tmp_path / "backfill.jsonl"
+    source.write_text("".join(json.dumps(item) + "\n" for item in fixture[:5]) + "\n"
+                      + "".join(json.dumps(item) + "\n" for item in fixture[5:]))
+
+    def run():
+        sinks = [newsPipeline.JsonlSink(str(tmp_path / "news.jsonl")),
+                 newsPipeline.SQLiteSink(str(tmp_path / "news.sqlite3"))]
+        return asyncio.run(newsPipeline.runPipeline(newsPipeline.fileSource(str(source), batch_size=4), sinks))
+
+    timings = run()
+    assert {stage: summary["articles"] for stage, summary in timings.summary().items()} == {
+        "fetch": 9, "parse": 8, "dedupe": 6, "enrich": 6, "sink": 6
+    }
+    written = [json.loads(line) for line in (tmp_path / "news.jsonl").read_text().splitlines()]
+    assert [article["url"] for article in written] == [item["url"] for item in items]
+    with closing(sqlite3.connect(tmp_path / "news.sqlite3")) as connection:
+        assert [row[0] for row in connection.execute("SELECT url FROM WealthworksNews ORDER BY id")] == \
+            [item["url"] for item in items]
+
+    # The database keeps the articles it has, the JSONL file gets them again
+    run()
+    with closing(sqlite3.connect(tmp_path / "news.sqlite3")) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM WealthworksNews").fetchone()[0] == 6
+    assert len((tmp_path / "news.jsonl").read_text().splitlines()) == 12
+
+
+@pytest.mark.parametrize("malformed", [
+    lambda item: {**item, "entities": [{key: value for key, value in item["entities"][0].items() if key != "country"}]},
+    lambda item: {**item, "entities": ["Example Corp"]},
+    lambda item: {**item, "entities": item["entities"][0]},
+    lambda item: {key: value for key, value in item.items() if key != "image_url"},
+    lambda item: {**item, "title": None},
+])
+def test_pipeline_skips_malformed_items(tmp_path, malformed):
+    import newsPipeline
+
+    items = make_items(2)
+    source = tmp_path / "backfill.jsonl"
+    source.write_text(json.dumps(malformed(items[0])) + "\n" + json.dumps(items[1]) + "\n")
+
+    sink = newsPipeline.JsonlSink(str(tmp_path / "news.jsonl"))
+    timings = asyncio.run(newsPipeline.runPipeline(newsPipeline.fileSource(str(source)), [sink]))
+    assert timings.articles["fetch"] == 2
+    assert timings.articles["parse"] == 1
+    assert [json.loads(line)["url"] for line in (tmp_path / "news.jsonl").read_text().splitlines()] == [items[1]["url"]]
+
+
+def test_pipeline_into_supabase_through_the_spool(tmp_path):
+    import argparse
+    import newsPipeline
+
+    items = make_items(5)
+    source = tmp_path / "backfill.jsonl"
+    source.write_text("".join(json.dumps(item) + "\n" for item in items))
+    with StandIn() as standin:
+        standin.seed([as_article(item) for item in make_items(998, start=100)])
+        use_standin(standin, str(tmp_path))
+
+        # The database is down, the articles wait in the spool
+        standin.database_up = False
+        sink = newsPipeline.SupabaseSink()
+        asyncio.run(newsPipeline.runPipeline(newsPipeline.fileSource(str(source)), [sink]))
+        assert sink.inserted == 0
+        with closing(sqlite3.connect(tmp_path / "newsSpool.sqlite3")) as connection:
+            assert connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0] == 5
+
+        # Back up, the next run sends them, then trims the table to 1000 articles
+        standin.database_up = True
+        (tmp_path / "empty.jsonl").write_text("")
+        asyncio.run(newsPipeline.runFromArguments(argparse.Namespace(
+            source=str(tmp_path / "empty.jsonl"), sink=["supabase"], batch_size=500, pages=3
+        )))
+        with closing(sqlite3.connect(tmp_path / "newsSpool.sqlite3")) as connection:
+            assert connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0] == 0
+        assert len(standin.table.rows) == 1000
+        assert {item["url"] for item in items} <= {row["url"] for row in standin.table.rows.values()}
+
+
+def test_pipeline_saves_the_watermark_after_the_last_page(tmp_path):
+    import newsCollector
+    import newsPipeline
+
+    watermark = str(tmp_path / "newsWatermark.json")
+    with StandIn(make_items(7), page_limit=3) as standin:
+        use_standin(standin, str(tmp_path))
+
+        async def run():
+            pages = []
+            async with newsCollector.newsClient() as client:
+                source = newsPipeline.marketauxSource("standin", client, watermark_path=watermark, max_pages=5)
+                async for items in source:
+                    pages.append(len(items))
+                    assert not os.path.exists(watermark)
+            return pages
+
+        assert asyncio.run(run()) == [3, 3, 1]
+        assert newsCollector.loadWatermark(watermark)["published_at"] == max(item["published_at"]
+                                                                               for item in standin.items)
+
+
+def test_pipeline_keeps_the_watermark_when_a_sink_fails(tmp_path):
+    import newsCollector
+    import newsPipeline
+
+    class FailingSink:
+        def __init__(self):
+            self.batches = 0
+
+        def write(self, articles):
+            self.batches += 1
+            if self.batches == 2:
+                raise ConnectionError("database down")
+
+        def close(self):
+            pass
+
+    watermark = str(tmp_path / "newsWatermark.json")
+    with StandIn(make_items(7), page_limit=3) as standin:
+        use_standin(standin, str(tmp_path))
+
+        async def run():
+            async with newsCollector.newsClient() as client:
+                source = newsPipeline.marketauxSource("standin", client, watermark_path=watermark, max_pages=5)
+                await newsPipeline.runPipeline(source, [FailingSink()])
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(run())
+        assert not os.path.exists(watermark)
@@ -1,23 +1,179 @@
-def start(service: str = "WealthWorks"):
+"""
+Console statements of the WealthWorks services, built on the logging module.
+
+Statements go through the "WealthWorks" logger to a queue, and a background thread writes them to the console,
+so the services never wait on stdout. Statements below the level are skipped before any formatting is done,
+so the text of a message is only formatted with its arguments if the statement is displayed.
+
+Set WEALTHWORKS_LOG_LEVEL to change the level (INFO by default) and WEALTHWORKS_LOG_FORMAT=json to write one
+JSON object per line instead of plain text.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+logger = logging.getLogger("WealthWorks")
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Formats statements the same way the services always printed them"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = record.getMessage()
+        event = getattr(record, "event", "message")
+        if event == "message":
+            text = f"{getattr(record, 'service', record.name)}: {text}"
+        elif event == "start":
+            # A blank line between the runs of the services
+            text = f"\n{text}"
+        if record.exc_text:
+            text = f"{text}\n{record.exc_text}"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats statements as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        statement = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "service": getattr(record, "service", record.name),
+            "event": getattr(record, "event", "message"),
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            statement["exception"] = record.exc_text
+        return json.dumps(statement)
+
+
+class StatementQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts the statements on the queue with their message formatted, like QueueHandler, but keeps the exception apart
+    in exc_text instead of adding it to the message, so the JSON statements have it in a field of its own
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def configure(level=None, json_format: bool = None, stream=None):
+    """
+    Set up the WealthWorks logger, done once when the module is imported.
+    Calling it again replaces the previous setup, so the handlers are never added twice.
+    :param level: Level name or number, WEALTHWORKS_LOG_LEVEL or INFO if None, an unknown level falls back to INFO
+    :param json_format: Write JSON lines, True if WEALTHWORKS_LOG_FORMAT is json if None
+    :param stream: Stream to write to, stdout if None
+    """
+    if level is None:
+        level = os.getenv("WEALTHWORKS_LOG_LEVEL", "INFO")
+    unknown_level = None
+    if isinstance(level, str):
+        name = level.strip().upper()
+        level = int(name) if name.isdigit() else logging.getLevelName(name)
+        # getLevelName gives back "Level NAME" for a name it does not know
+        if not isinstance(level, int):
+            unknown_level, level = name, INFO
+    if json_format is None:
+        json_format = os.getenv("WEALTHWORKS_LOG_FORMAT", "text").lower() == "json"
+
+    shutdown()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_format else ConsoleFormatter())
+
+    statements = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(statements, handler)
+    listener.start()
+
+    queue_handler = StatementQueueHandler(statements)
+    queue_handler.listener = listener
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    if unknown_level is not None:
+        message("WealthWorks", "Unknown log level %s, using INFO", unknown_level, level=WARNING)
+
+
+def shutdown():
+    """Write out the statements still in the queue and remove the handlers added by configure"""
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+            listener = getattr(handler, "listener", None)
+            if listener is not None:
+                listener.stop()
+
+
+def start(service: str = "WealthWorks", level: int = INFO):
     """
     Print a message to the console when a service starts
     :param service: The name of the service starting
+    :param level: Level of the statement
     """
-    print(f"\nStarting {service}...")
+    if logger.isEnabledFor(level):
+        logger.log(level, "Starting %s...", service, extra={"service": service, "event": "start"})
 
 
-def completed(service: str = "WealthWorks"):
+def completed(service: str = "WealthWorks", level: int = INFO):
     """
     Print a message to the console when a service completes
     :param service: The name of the service being completed
+    :param level: Level of the statement
     """
-    print(service, "completed.")
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s completed.", service, extra={"service": service, "event": "completed"})
 
 
-def message(service: str, text: str):
+def message(service: str, text: str, *args, level: int = INFO):
     """
     Print a message to the console
     :param service: The name of the service displaying a message
-    :param text: The message to be displayed
+    :param text: The message to be displayed, with %-style placeholders for args
+    :param args: Values of the placeholders, only formatted if the message is displayed
+    :param level: Level of the statement
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, text, *args, extra={"service": service, "event": "message"})
+
+
+def debug(service: str, text: str, *args):
+    """
+    Print a debug message to the console, skipped unless the level is DEBUG
+    :param service: The name of the service displaying a message
+    :param text: The message to be displayed, with %-style placeholders for args
+    :param args: Values of the placeholders
+    """
+    message(service, text, *args, level=DEBUG)
+
+
+def error(service: str, text: str, *args):
+    """
+    Print an error message to the console
+    :param service: The name of the service displaying a message
+    :param text: The message to be displayed, with %-style placeholders for args
+    :param args: Values of the placeholders
     """
-    print(f"{service}: {text}")
+    message(service, text, *args, level=ERROR)
+
+
+configure()
+atexit.register(shutdown)
@@ -1,23 +1,135 @@
 """Debt Repayment Calculator Module"""
 
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
 from WealthWorks.workers import consoleStatements as Display
 
 
 service = "Repayment Calculator"
 
+# Engines that calculate_repayment can use, "loop" steps through every month and
+# "closed_form" solves the amortization directly (see closed_form_repayment for the tolerance)
+ENGINES = ("loop", "closed_form")
+
+# Remaining balances at or below this are treated as paid off, so floating point residue
+# from the monthly steps does not add an extra month with nothing left to pay
+PAID_OFF_TOLERANCE = 1e-6
+
+# Payoff strategies with rollover, see simulate_strategies
+STRATEGIES = ("avalanche", "snowball")
+
+# Simulations stop after this many months (100 years)
+MAX_MONTHS = 1200
+
+# Percentiles reported by simulate_variable_rates
+PERCENTILES = (10, 50, 90)
+
+# Amounts paid on top of the extra payment by what_if_payments
+WHAT_IF_STEPS = (0, 50, 100, 150, 200, 300, 400, 500)
+
 
-def calculate_repayment(debts: list, extra_payment=0):
+class Debt(NamedTuple):
+    """
+    A single debt, the calculator functions take a list of these (or of dicts with the same keys).
+    The interest rate is in percent, until perc_to_dec changes it to decimal.
+    """
+    name: str
+    amount: float
+    interest_rate: float
+    min_payment: float
+
+
+class StrategyResult(NamedTuple):
+    """Results of simulate_strategies for one strategy"""
+    strategy: str
+    months: int
+    monthly_payment: float
+    total_paid: float
+    total_interest_paid: float
+    payoff_order: List[str]
+    payoff_months: List[int]
+
+
+class ScheduleRow(NamedTuple):
+    """One month of repayment_schedule"""
+    month: int
+    balances: Tuple[float, ...]
+    interest: Tuple[float, ...]
+    principal: Tuple[float, ...]
+    # Remaining balance of all debts together, after the extra payment
+    remaining: float
+
+
+class ScheduleChunk(NamedTuple):
+    """A chunk of months of repayment_schedule_chunks, with one row per month and one column per debt"""
+    months: np.ndarray
+    balances: np.ndarray
+    interest: np.ndarray
+    principal: np.ndarray
+    remaining: np.ndarray
+
+
+class SweepResult(NamedTuple):
+    """Results of sweep_repayment, one entry per scenario"""
+    months: np.ndarray
+    monthly_payment: np.ndarray
+    total_paid: np.ndarray
+    total_interest_paid: np.ndarray
+
+
+class MonteCarloResult(NamedTuple):
+    """Results of simulate_variable_rates, one entry per percentile of PERCENTILES"""
+    percentiles: Tuple[int, ...]
+    months: np.ndarray
+    total_paid: np.ndarray
+    total_interest_paid: np.ndarray
+    monthly_payment: float
+    paths: int
+    # Paths in which the debts are not paid off within MAX_MONTHS, left out of the percentiles
+    unpaid_paths: int
+
+
+def as_debt(debt) -> Debt:
+    """
+    Turn a debt dict into a Debt, a Debt is returned as it is
+    :param debt: Debt or dict with the name, amount, interest_rate and min_payment of a debt
+    :return: Debt
+    """
+    if isinstance(debt, Debt):
+        return debt
+    return Debt(debt['name'], debt['amount'], debt['interest_rate'], debt['min_payment'])
+
+
+def as_debts(debts: list) -> List[Debt]:
+    """
+    Turn a list of debt dicts into a list of Debt
+    :param debts: List of Debt or dicts
+    :return: List of Debt
+    """
+    return [as_debt(debt) for debt in debts]
+
+
+def calculate_repayment(debts: list, extra_payment=0, engine="loop"):
     """
     Calculate the repayment of debts
-    :param debts: List of debts
+    :param debts: List of debts, left unchanged
     :param extra_payment:
+    :param engine: The engine to use, one of ENGINES
     :return: months, monthly_payment, total_paid, total_interest_paid
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown repayment engine '{engine}', expected one of {ENGINES}")
+
     # Displaying in the console
-    Display.start(service)
+    Display.start(service, Display.DEBUG)
 
     # cleaning the data, making sure the interest rate is in decimal
-    debts = perc_to_dec(debts)
+    debts = perc_to_dec(as_debts(debts))
 
     # checking if the minimum payment is enough to cover the interest
     min_pay_bool = check_min_payment(debts)
@@ -32,42 +144,827 @@ def calculate_repayment(debts: list, extra_payment=0):
         Display.message(service, "It is not possible to pay off the debts")
         return None
 
-    # setting main variables
-    total_debt = sum(debt['amount'] for debt in debts)
-    monthly_payment = sum(debt['min_payment'] for debt in debts)
-    total_payment = monthly_payment + extra_payment
-    total_paid = total_debt
+    # calculating the repayment with the selected engine
+    if engine == "loop":
+        months, monthly_payment, total_paid, total_interest_paid = loop_repayment(debts, extra_payment)
+    else:
+        months, monthly_payment, total_paid, total_interest_paid = closed_form_repayment(debts, extra_payment)
+
+    # Displaying in the console
+    Display.completed(service, Display.DEBUG)
+    return months, monthly_payment, round(total_paid, 2), round(total_interest_paid, 2)
+
+
+def cached_calculate_repayment(debts: list, extra_payment=0, engine="closed_form"):
+    """
+    Calculate the repayment of debts through repayment_cache, so identical portfolios are only calculated once.
+    The order and names of the debts do not matter, the result is calculated for the debts in canonical order.
+    :param debts: List of debts, left unchanged
+    :param extra_payment: Additional payment per month
+    :param engine: The engine to use, one of ENGINES
+    :return: months, monthly_payment, total_paid, total_interest_paid, or None like calculate_repayment
+    """
+    debts = as_debts(debts)
+    key = portfolio_key(debts, extra_payment, engine)
+    found, results = repayment_cache.get(key)
+    if found:
+        Display.debug(service, "Repayment found in cache")
+        return results
+
+    canonical_debts = sorted(debts, key=lambda debt: (debt.amount, debt.interest_rate, debt.min_payment))
+    results = calculate_repayment(canonical_debts, extra_payment, engine)
+    repayment_cache.put(key, results)
+    return results
+
+
+def portfolio_key(debts: list, extra_payment=0, engine="closed_form"):
+    """
+    Canonical key of a repayment calculation, the same for any order of the debts
+    :param debts: List of debts
+    :param extra_payment: Additional payment per month
+    :param engine: The engine to use, one of ENGINES
+    :return: Hashable tuple of the sorted (amount, interest_rate, min_payment) of every debt, the extra payment and engine
+    """
+    terms = sorted(
+        (float(debt.amount), float(debt.interest_rate), float(debt.min_payment)) for debt in as_debts(debts)
+    )
+    return tuple(terms), float(extra_payment), engine
+
+
+class RepaymentCache:
+    """
+    Bounded least recently used cache of repayment results, with hit and miss counters.
+    Results are immutable tuples, so they are safe to share between sessions.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a result and mark it as recently used
+        :param key: Key from portfolio_key
+        :return: (True, result) if the key is cached, otherwise (False, None)
+        """
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return True, self._results[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, results):
+        """
+        Store a result, dropping the least recently used ones when the cache is full
+        :param key: Key from portfolio_key
+        :param results: The result to store
+        """
+        with self._lock:
+            self._results[key] = results
+            self._results.move_to_end(key)
+            self._evict()
+
+    def resize(self, maxsize: int):
+        """
+        Change the number of results kept
+        :param maxsize: The new maximum number of results
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """
+        Remove every result and reset the counters
+        """
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> Dict[str, int]:
+        """
+        :return: hits, misses, current size and maximum size of the cache
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._results), "maxsize": self.maxsize}
+
+    def _evict(self):
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+
+# Cache shared by every session, see cached_calculate_repayment
+repayment_cache = RepaymentCache()
+
+
+def loop_repayment(debts: list, extra_payment=0):
+    """
+    Step through the repayment one month at a time, by consuming the repayment schedule
+    :param debts: List of debts, already cleaned by calculate_repayment
+    :param extra_payment: Additional payment per month
+    :return: months, monthly_payment, total_paid, total_interest_paid (unrounded)
+    """
+    total_debt = sum(debt.amount for debt in debts)
+    monthly_payment = sum(debt.min_payment for debt in debts)
     total_interest_paid = 0
     months = 0
 
-    # calculating the repayment
-    while total_debt > 0:
-        months += 1
-        interest = 0
-        for debt in debts:
-            if debt['amount'] <= 0:  # Skip if debt amount is zero or negative
+    schedule = _schedule_rows(
+        [debt.amount for debt in debts],
+        [debt.interest_rate / 12 for debt in debts],
+        [debt.min_payment for debt in debts],
+        extra_payment
+    )
+    for row in schedule:
+        months = row.month
+        total_interest_paid += sum(row.interest)
+
+    return months, monthly_payment, total_debt + total_interest_paid, total_interest_paid
+
+
+def repayment_schedule(debts: list, extra_payment=0):
+    """
+    Generate the repayment schedule lazily, one row per month, until the debts are paid off.
+
+    The debts are cleaned the same way as calculate_repayment and every debt gets its minimum payment,
+    the extra payment only reduces the remaining balance of all debts together, as calculate_repayment does.
+    :param debts: List of debts, left unchanged
+    :param extra_payment: Additional payment per month
+    :return: Generator of ScheduleRow, empty if it is not possible to pay off the debts
+    """
+    # Displaying in the console
+    Display.start(service, Display.DEBUG)
+
+    amounts, monthly_rates, min_payments = _debt_columns(debts)
+    if not _possible_columns(amounts, monthly_rates, min_payments, extra_payment):
+        Display.message(service, "It is not possible to pay off the debts")
+        return
+
+    yield from _schedule_rows(amounts.tolist(), monthly_rates.tolist(), min_payments.tolist(), extra_payment)
+
+    Display.completed(service, Display.DEBUG)
+
+
+def repayment_schedule_chunks(debts: list, extra_payment=0, chunk_months: int = 120):
+    """
+    Generate the repayment schedule as arrays, a chunk of months at a time, for charts.
+
+    Every chunk is calculated in closed form for all of its months at once instead of stepping through
+    them, so it matches repayment_schedule within the tolerance described in closed_form_repayment.
+    :param debts: List of debts, left unchanged
+    :param extra_payment: Additional payment per month
+    :param chunk_months: Number of months per chunk
+    :return: Generator of ScheduleChunk, empty if it is not possible to pay off the debts
+    """
+    # Displaying in the console
+    Display.start(service, Display.DEBUG)
+
+    amounts, monthly_rates, min_payments = _debt_columns(debts)
+    if not _possible_columns(amounts, monthly_rates, min_payments, extra_payment):
+        Display.message(service, "It is not possible to pay off the debts")
+        return
+
+    balance, last_payoff = _portfolio_balance(amounts, min_payments, monthly_rates, extra_payment)
+    months = _first_paid_month(balance, float(last_payoff))
+
+    growth, paying, steady, gap, payoff = _amortization(amounts, min_payments, monthly_rates)
+
+    for first in range(1, months + 1, chunk_months):
+        month = np.arange(first, min(first + chunk_months, months + 1))
+        debt_month = month[:, None]
+
+        # Balance after the payment of the month and of the month before, zero once a debt is paid off
+        balances = np.where(debt_month < payoff, steady - gap * growth ** np.where(paying, debt_month, 0), 0.0)
+        previous = np.where(debt_month - 1 < payoff, steady - gap * growth ** np.where(paying, debt_month - 1, 0), 0.0)
+        interest = np.where(debt_month <= payoff, previous * monthly_rates, 0.0)
+        payments = np.where(debt_month < payoff, min_payments, np.where(debt_month == payoff, previous * growth, 0.0))
+
+        yield ScheduleChunk(month, balances, interest, payments - interest, balance(month)[0])
+
+    Display.completed(service, Display.DEBUG)
+
+
+def repayment_schedule_array(debts: list, extra_payment=0):
+    """
+    Calculate the whole repayment schedule as one set of arrays, only use this when all months are needed
+    :param debts: List of debts, left unchanged
+    :param extra_payment: Additional payment per month
+    :return: ScheduleChunk covering every month, or None if it is not possible to pay off the debts
+    """
+    chunks = list(repayment_schedule_chunks(debts, extra_payment))
+    if not chunks:
+        return None
+    return ScheduleChunk(*(np.concatenate(column) for column in zip(*chunks)))
+
+
+def _schedule_rows(amounts: List[float], monthly_rates: List[float], min_payments: List[float], extra_payment=0):
+    """
+    Step through the repayment one month at a time, the engine behind loop_repayment and repayment_schedule
+    :param amounts: Starting balance per debt
+    :param monthly_rates: Interest rate per month per debt, in decimal
+    :param min_payments: Minimum payment per debt, already covering the interest
+    :param extra_payment: Additional payment per month
+    :return: Generator of ScheduleRow
+    """
+    balances = list(amounts)
+    total_debt = sum(amounts)
+    total_payment = sum(min_payments) + extra_payment
+    month = 0
+
+    while total_debt > PAID_OFF_TOLERANCE:
+        month += 1
+        interest = [0.0] * len(balances)
+        principal = [0.0] * len(balances)
+        for i, amount in enumerate(balances):
+            if amount <= 0:  # Skip if debt amount is zero or negative
                 continue
 
-            interest += debt['amount'] * (debt['interest_rate'] / 12)
-            debt['amount'] += debt['amount'] * (debt['interest_rate'] / 12)
-            if debt['amount'] < debt['min_payment']:
-                total_payment -= (debt['min_payment'] - debt['amount'])
-                debt['amount'] = 0
+            interest[i] = amount * monthly_rates[i]
+            amount += interest[i]
+            if amount < min_payments[i]:
+                # the unused part of the final minimum payment is not paid again
+                total_payment -= (min_payments[i] - amount)
+                principal[i] = amount - interest[i]
+                amount = 0
             else:
-                debt['amount'] -= debt['min_payment']
+                amount -= min_payments[i]
+                principal[i] = min_payments[i] - interest[i]
+            balances[i] = amount
 
-        total_interest_paid += interest
-        total_debt += interest
+        total_debt += sum(interest)
         total_debt -= total_payment
+        yield ScheduleRow(month, tuple(balances), tuple(interest), tuple(principal), total_debt)
 
-        if total_debt <= 0:
-            break
 
-    total_paid += total_interest_paid
+def closed_form_repayment(debts: list, extra_payment=0):
+    """
+    Calculate the same results as loop_repayment without stepping through every month.
+
+    Each debt is amortized in closed form: the month it is paid off comes from a logarithm and the
+    interest paid up to any month from a geometric series. The month the combined balance reaches
+    zero is then found with a bisection over whole months, which needs about log2(months) evaluations.
+    A single debt is handled with plain floats, several debts are evaluated together with NumPy.
+
+    Tolerance: the result only differs from loop_repayment by floating point rounding, so months are
+    the same unless the final balance lands within rounding noise of PAID_OFF_TOLERANCE, and total_paid
+    and total_interest_paid agree to within a cent once rounded. Schedules that run for centuries, where
+    the rounding drift of the loop itself grows, agree to a relative 1e-5.
+    :param debts: List of debts, already cleaned by calculate_repayment
+    :param extra_payment: Additional payment per month
+    :return: months, monthly_payment, total_paid, total_interest_paid (unrounded)
+    """
+    total_debt = sum(debt.amount for debt in debts)
+    monthly_payment = sum(debt.min_payment for debt in debts)
+
+    if len(debts) == 1:
+        debt = debts[0]
+        balance, last_payoff = _single_debt_balance(
+            debt.amount, debt.min_payment, debt.interest_rate / 12, extra_payment
+        )
+        months = _first_paid_month(balance, last_payoff)
+    else:
+        balance, last_payoff = _portfolio_balance(
+            np.array([debt.amount for debt in debts], dtype=float),
+            np.array([debt.min_payment for debt in debts], dtype=float),
+            np.array([debt.interest_rate for debt in debts], dtype=float) / 12,
+            extra_payment
+        )
+        months = _first_paid_month(balance, float(last_payoff))
+
+    total_interest_paid = float(balance(months)[1])
+    return months, monthly_payment, total_debt + total_interest_paid, total_interest_paid
 
+
+def sweep_repayment(debts: list, extra_payments=(0,), rate_shocks=(0,)):
+    """
+    Calculate the repayment of one set of debts under many scenarios in a single vectorized pass,
+    for example to show how much sooner the debts are paid off with every extra amount per month.
+
+    Every scenario is cleaned and checked the same way as calculate_repayment and solved with the
+    closed form engine, so the results match calculate_repayment(..., engine="closed_form").
+    The extra payments and rate shocks are broadcast together, so they can also be a grid of any
+    shape, e.g. from np.meshgrid, and the results then have the shape of the grid.
+    :param debts: List of debts, left unchanged
+    :param extra_payments: Additional payment per month for each scenario
+    :param rate_shocks: Change of every interest rate for each scenario, in percentage points
+    :return: SweepResult with one entry per scenario, scenarios in which the debts can not be paid off
+    have -1 months and NaN totals
+    """
     # Displaying in the console
-    Display.completed(service)
-    return months, monthly_payment, round(total_paid, 2), round(total_interest_paid, 2)
+    Display.start(service, Display.DEBUG)
+
+    extra_payments = np.atleast_1d(np.asarray(extra_payments, dtype=float))
+    rate_shocks = np.atleast_1d(np.asarray(rate_shocks, dtype=float))
+    try:
+        extra_payments, rate_shocks = np.broadcast_arrays(extra_payments, rate_shocks)
+    except ValueError:
+        raise ValueError(
+            f"Extra payments of shape {extra_payments.shape} and rate shocks of shape {rate_shocks.shape} "
+            f"can not be broadcast together"
+        ) from None
+
+    # One scenario per cell of the grid
+    shape = extra_payments.shape
+    extra_payments = extra_payments.ravel()
+    rate_shocks = rate_shocks.ravel()
+
+    # One row per scenario and one column per debt
+    amounts, monthly_rates, min_payments = _debt_columns(debts, rate_shocks[:, None])
+    possible = _possible_columns(amounts, monthly_rates, min_payments, extra_payments)
+
+    months = np.full(extra_payments.shape, -1)
+    total_paid = np.full(extra_payments.shape, np.nan)
+    total_interest_paid = np.full(extra_payments.shape, np.nan)
+
+    if possible.any():
+        balance, last_payoff = _portfolio_balance(
+            amounts[possible], min_payments[possible], monthly_rates[possible], extra_payments[possible]
+        )
+        months[possible] = _first_paid_months(balance, last_payoff)
+        total_interest_paid[possible] = balance(months[possible])[1]
+        total_paid[possible] = amounts[possible].sum(axis=1) + total_interest_paid[possible]
+
+    Display.debug(service, "%d of %d scenarios can be paid off", possible.sum(), len(possible))
+    Display.completed(service, Display.DEBUG)
+    return SweepResult(
+        months.reshape(shape),
+        min_payments.sum(axis=1).reshape(shape),
+        total_paid.round(2).reshape(shape),
+        total_interest_paid.round(2).reshape(shape)
+    )
+
+
+def what_if_payments(debts: list, extra_payment=0, steps=WHAT_IF_STEPS) -> List[Dict[str, Any]]:
+    """
+    Calculate how the repayment changes when paying more each month, for the "what if" graph of the debt page
+    :param debts: List of debts, left unchanged
+    :param extra_payment: The extra payment the repayment was calculated with
+    :param steps: Amounts paid on top of the extra payment
+    :return: One dict per step in which the debts can be paid off, with the step, the months and the interest paid
+    """
+    results = sweep_repayment(debts=debts, extra_payments=[extra_payment + step for step in steps])
+    return [
+        {"extra": f"+{step}", "months": int(months), "interest": round(float(interest))}
+        for step, months, interest in zip(steps, results.months, results.total_interest_paid)
+        if months > 0
+    ]
+
+
+def solve_extra_payment(debts: list, target_months: int, tolerance=0.01, points: int = 16, max_rounds: int = 20):
+    """
+    Find the smallest extra payment per month that pays off the debts within a number of months.
+
+    Paying the whole balance divided by the target months on top of the minimum payments is always
+    enough, which brackets the answer between zero and that amount. The bracket is then narrowed by
+    solving the closed form engine for a grid of candidates at once per round, a bisection that splits
+    into points + 1 parts. A last round checks every multiple of the tolerance left in the bracket,
+    so at most points * (max_rounds + 1) + 1 payoff months are solved.
+    :param debts: List of debts, left unchanged
+    :param target_months: The number of months in which the debts should be paid off
+    :param tolerance: Precision of the extra payment, the result is rounded up to it
+    :param points: Number of candidates solved per round
+    :param max_rounds: Maximum number of rounds
+    :return: The extra payment per month, or None if the target can not be reached
+    """
+    # Displaying in the console
+    Display.start(service, Display.DEBUG)
+
+    amounts, monthly_rates, min_payments = _debt_columns(debts)
+    high = amounts.sum() / target_months if target_months >= 1 else math.nan
+    if not target_months >= 1 or not _possible_columns(amounts, monthly_rates, min_payments, high):
+        Display.message(service, "It is not possible to pay off the debts in %s months", target_months)
+        return None
+
+    def months_for(extra_payments: np.ndarray) -> np.ndarray:
+        # Payoff months per extra payment, impossible ones never finish
+        possible = _possible_columns(amounts, monthly_rates, min_payments, extra_payments)
+        months = np.full(extra_payments.shape, np.iinfo(np.int64).max)
+        if possible.any():
+            balance, last_payoff = _portfolio_balance(amounts, min_payments, monthly_rates, extra_payments[possible])
+            months[possible] = _first_paid_months(balance, np.full(int(possible.sum()), last_payoff))
+        return months
+
+    low = 0.0
+    if months_for(np.array([low]))[0] <= target_months:
+        high = low
+
+    rounds = 0
+    while high - low > tolerance and rounds < max_rounds:
+        candidates = np.linspace(low, high, points + 2)[1:-1]
+        # The payoff month never increases with the extra payment, so the candidates split in two
+        fast_enough = months_for(candidates) <= target_months
+        if fast_enough.any():
+            high = float(candidates[fast_enough][0])
+        if not fast_enough.all():
+            low = float(candidates[~fast_enough][-1])
+        rounds += 1
+
+    # The smallest multiple of the tolerance in the final bracket that reaches the target
+    steps = np.arange(math.floor(low / tolerance), math.ceil(high / tolerance) + 1)
+    if len(steps) <= points:
+        fast_enough = months_for(steps * tolerance) <= target_months
+        high = float(steps[fast_enough][0] * tolerance)
+    extra_payment = round(math.ceil(round(high / tolerance, 6)) * tolerance, 10)
+    Display.debug(service, "Extra payment of %s found in %d rounds", extra_payment, rounds)
+    Display.completed(service, Display.DEBUG)
+    return extra_payment
+
+
+def simulate_variable_rates(debts: list, extra_payment=0, paths: int = 10000, rate_volatility=1.0,
+                            variable_debts: Optional[List[str]] = None, seed: Optional[int] = None):
+    """
+    Monte Carlo version of calculate_repayment for debts with a variable interest rate.
+
+    Every path samples its own rates: each month the rate of every variable debt moves by a normal step
+    with a standard deviation of rate_volatility / sqrt(12) percentage points, and never drops below zero.
+    The paths are stepped through the months together with NumPy, following the same rules as the loop
+    engine, so with a rate_volatility of 0 every path matches calculate_repayment.
+    :param debts: List of debts, left unchanged
+    :param extra_payment: Additional payment per month
+    :param paths: Number of rate paths to sample
+    :param rate_volatility: Standard deviation of the rate change over a year, in percentage points
+    :param variable_debts: Names of the debts with a variable rate, all debts if None
+    :param seed: Seed of the random generator, for reproducible results
+    :return: MonteCarloResult, or None if it is not possible to pay off the debts at the starting rates
+    """
+    # Displaying in the console
+    Display.start(service, Display.DEBUG)
+
+    amounts, monthly_rates, min_payments = _debt_columns(debts)
+    if not _possible_columns(amounts, monthly_rates, min_payments, extra_payment):
+        Display.message(service, "It is not possible to pay off the debts")
+        return None
+
+    names = [debt.name for debt in as_debts(debts)]
+    variable = np.array([variable_debts is None or name in variable_debts for name in names])
+    step = rate_volatility * (10**(-2)) / 12 / math.sqrt(12) * variable
+
+    generator = np.random.default_rng(seed)
+    # One row per path that is not paid off yet and one column per debt, paid off paths are dropped
+    index = np.arange(paths)
+    balances = np.tile(amounts, (paths, 1))
+    rates = np.tile(monthly_rates, (paths, 1))
+    total_debt = np.full(paths, amounts.sum())
+    total_payment = np.full(paths, min_payments.sum() + extra_payment)
+    interest_paid = np.zeros(paths)
+    months = np.full(paths, -1)
+    total_interest_paid = np.full(paths, np.nan)
+
+    for month in range(1, MAX_MONTHS + 1):
+        if step.any():
+            rates = np.maximum(rates + generator.standard_normal(rates.shape) * step, 0)
+
+        interest = balances * rates
+        balances = balances + interest
+        # the unused part of the final minimum payment is not paid again
+        final = (balances < min_payments) & (balances > 0)
+        total_payment -= np.where(final, min_payments - balances, 0).sum(axis=1)
+        balances = np.where(balances < min_payments, 0, balances - min_payments)
+
+        interest = interest.sum(axis=1)
+        interest_paid += interest
+        total_debt += interest - total_payment
+
+        paid = total_debt <= PAID_OFF_TOLERANCE
+        if paid.any():
+            months[index[paid]] = month
+            total_interest_paid[index[paid]] = interest_paid[paid]
+            owing = ~paid
+            index, balances, rates = index[owing], balances[owing], rates[owing]
+            total_debt, total_payment, interest_paid = total_debt[owing], total_payment[owing], interest_paid[owing]
+            if not len(index):
+                break
+
+    paid = months > 0
+    if paid.any():
+        months_percentiles = np.percentile(months[paid], PERCENTILES)
+        interest_percentiles = np.percentile(total_interest_paid[paid], PERCENTILES)
+    else:
+        months_percentiles = interest_percentiles = np.full(len(PERCENTILES), np.nan)
+
+    Display.debug(service, "%d of %d rate paths are paid off", paid.sum(), paths)
+    Display.completed(service, Display.DEBUG)
+    return MonteCarloResult(
+        PERCENTILES,
+        months_percentiles,
+        (amounts.sum() + interest_percentiles).round(2),
+        interest_percentiles.round(2),
+        float(min_payments.sum()),
+        paths,
+        len(index)
+    )
+
+
+def compare_strategies(debts: list, extra_payment=0, custom_order: Optional[List[str]] = None):
+    """
+    Compare paying off the debts with the avalanche and snowball strategies, and a custom order if given
+    :param debts: List of debts, left unchanged
+    :param extra_payment: Additional payment per month
+    :param custom_order: Names of the debts in the order they should be paid off, every debt once
+    :return: List of StrategyResult, one per strategy, or None if it is not possible to pay off the debts
+    """
+    debts = as_debts(debts)
+    orders = {strategy: strategy_order(debts, strategy) for strategy in STRATEGIES}
+    if custom_order is not None:
+        names = [debt.name for debt in debts]
+        if sorted(custom_order) != sorted(names):
+            raise ValueError(f"Custom order {custom_order} must name every debt once, expected an order of {names}")
+        orders["custom"] = [names.index(name) for name in custom_order]
+    return simulate_strategies(debts, extra_payment, orders)
+
+
+def strategy_order(debts: list, strategy: str = "avalanche") -> List[int]:
+    """
+    Find the order in which a strategy pays off the debts
+    :param debts: List of debts
+    :param strategy: "avalanche" pays the highest interest rate first, "snowball" the smallest balance first
+    :return: Indices of the debts, the first debt gets any money left after the minimum payments
+    """
+    debts = as_debts(debts)
+    if strategy == "avalanche":
+        return sorted(range(len(debts)), key=lambda i: (-debts[i].interest_rate, debts[i].amount))
+    if strategy == "snowball":
+        return sorted(range(len(debts)), key=lambda i: (debts[i].amount, -debts[i].interest_rate))
+    raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES}")
+
+
+def simulate_strategies(debts: list, extra_payment=0, orders: Optional[Dict[str, List[int]]] = None):
+    """
+    Simulate paying off the debts month by month with rollover: every month each debt gets its minimum
+    payment, and everything left of the monthly budget (the minimum payments plus the extra payment)
+    goes to the debts in the order of the strategy. Once a debt is paid off its minimum payment rolls
+    over to the next debt in line.
+
+    The state is kept as columnar arrays with one row per strategy and one column per debt, sorted in
+    the order of that strategy, so all strategies are stepped through together.
+    :param debts: List of debts, left unchanged
+    :param extra_payment: Additional payment per month
+    :param orders: Strategy name mapped to the indices of the debts in the order they are paid off,
+    defaults to every strategy in STRATEGIES
+    :return: List of StrategyResult, one per strategy, or None if it is not possible to pay off the debts
+    """
+    # Displaying in the console
+    Display.start(service, Display.DEBUG)
+
+    debts = as_debts(debts)
+    if orders is None:
+        orders = {strategy: strategy_order(debts, strategy) for strategy in STRATEGIES}
+    for name, order in orders.items():
+        if sorted(order) != list(range(len(debts))):
+            raise ValueError(f"The order of '{name}' must have the index of every debt once, got {order}")
+    names = list(orders)
+    columns = np.array([orders[name] for name in names], dtype=np.int64)
+
+    amounts, monthly_rates, min_payments = _debt_columns(debts)
+    if not _possible_columns(amounts, monthly_rates, min_payments, extra_payment):
+        Display.message(service, "It is not possible to pay off the debts")
+        return None
+
+    # One row per strategy, the columns of each row in the order of its strategy
+    balances = amounts[columns]
+    monthly_rates = monthly_rates[columns]
+    min_payments = min_payments[columns]
+    budget = min_payments.sum(axis=1, keepdims=True) + extra_payment
+
+    interest_paid = np.zeros(balances.shape)
+    unpaid_months = np.zeros(balances.shape, dtype=np.int64)
+    paid = balances <= PAID_OFF_TOLERANCE
+    month = 0
+
+    while not paid.all() and month < MAX_MONTHS:
+        month += 1
+        interest = balances * monthly_rates
+        balances += interest
+        interest_paid += interest
+
+        # Minimum payments first, then the rest of the budget down the line of debts
+        payments = np.minimum(balances, min_payments)
+        balances -= payments
+        spare = budget - payments.sum(axis=1, keepdims=True)
+        rollover = np.cumsum(balances, axis=1)
+        rollover -= balances
+        np.subtract(spare, rollover, out=rollover)
+        balances -= np.clip(rollover, 0, balances, out=rollover)
+
+        # A paid off debt stays at zero, so counting the months it was unpaid gives its payoff month
+        paid = balances <= PAID_OFF_TOLERANCE
+        balances[paid] = 0
+        unpaid_months += ~paid
+
+    payoff_months = np.where(paid, unpaid_months + 1, -1)
+    interest_paid = interest_paid.sum(axis=1)
+
+    results = []
+    total_debt = amounts.sum()
+    for row, name in enumerate(names):
+        order = columns[row]
+        debt_payoff_months = np.zeros(len(order), dtype=np.int64)
+        debt_payoff_months[order] = payoff_months[row]
+        paid_order = order[np.argsort(payoff_months[row], kind="stable")]
+        results.append(StrategyResult(
+            strategy=name,
+            months=int(payoff_months[row].max()) if paid[row].all() else -1,
+            monthly_payment=float(budget[row, 0]),
+            total_paid=round(float(total_debt + interest_paid[row]), 2),
+            total_interest_paid=round(float(interest_paid[row]), 2),
+            payoff_order=[debts[i].name for i in paid_order if debt_payoff_months[i] > 0],
+            payoff_months=debt_payoff_months.tolist(),
+        ))
+
+    Display.completed(service, Display.DEBUG)
+    return results
+
+
+def _debt_columns(debts: list, rate_shocks=0):
+    """
+    Turn the debts into columns, cleaned the same way as calculate_repayment
+    :param debts: List of debts, left unchanged
+    :param rate_shocks: Change of every interest rate, in percentage points, may add leading scenario axes
+    :return: amounts, monthly_rates, min_payments with the minimum payments raised to cover the interest
+    """
+    debts = as_debts(debts)
+    amounts = np.array([debt.amount for debt in debts], dtype=float)
+    rates = (np.array([debt.interest_rate for debt in debts], dtype=float) + rate_shocks) * (10**(-2))
+    monthly_rates = rates / 12
+    min_payments = np.maximum(
+        np.array([debt.min_payment for debt in debts], dtype=float),
+        amounts * monthly_rates
+    )
+    amounts = np.broadcast_to(amounts, monthly_rates.shape)
+    return amounts, monthly_rates, min_payments
+
+
+def _possible_columns(amounts: np.ndarray, monthly_rates: np.ndarray, min_payments: np.ndarray, extra_payment=0):
+    """
+    The same conditions as check_if_possible, for debts in columns
+    :return: Boolean, per scenario if there are leading scenario axes
+    """
+    return (
+        np.all(amounts > 0, axis=-1) & np.all(min_payments > 0, axis=-1) & np.all(monthly_rates > 0, axis=-1)
+        & (min_payments.sum(axis=-1) + extra_payment > (amounts * monthly_rates).sum(axis=-1))
+    )
+
+
+def _single_debt_balance(amount: float, min_payment: float, monthly_rate: float, extra_payment=0):
+    """
+    Closed form remaining balance for a single debt
+    :param amount: Starting balance of the debt
+    :param min_payment: Minimum payment of the debt
+    :param monthly_rate: Interest rate per month, in decimal
+    :param extra_payment: Additional payment per month
+    :return: Function of the month returning (remaining balance, interest paid so far), and the payoff month
+    """
+    growth = 1 + monthly_rate
+    payoff, final_payment = _payoff_month(amount, min_payment, monthly_rate)
+    # Distance from the balance at which the minimum payment only covers the interest,
+    # a debt that is never paid off sits exactly on that balance
+    gap = min_payment / monthly_rate - amount if math.isfinite(payoff) else 0.0
+
+    def balance(month: int):
+        paid_month = min(month, payoff)
+        interest = paid_month * min_payment - (gap * (growth ** paid_month - 1) if gap else 0.0)
+        remaining = amount + interest - month * (min_payment + extra_payment)
+        if month >= payoff:
+            # the unused part of the final minimum payment is not paid again
+            remaining += (min_payment - final_payment) * (month - payoff + 1)
+        return remaining, interest
+
+    return balance, payoff
+
+
+def _payoff_month(amount: float, min_payment: float, monthly_rate: float):
+    """
+    Find the month a single debt is paid off by its minimum payment alone
+    :param amount: Starting balance of the debt
+    :param min_payment: Minimum payment of the debt
+    :param monthly_rate: Interest rate per month, in decimal
+    :return: The payoff month (math.inf if never paid off) and the size of the final payment
+    """
+    growth = 1 + monthly_rate
+    surplus = min_payment - monthly_rate * amount
+    if surplus <= 0:
+        return math.inf, 0.0
+
+    months = 1 + max(0, math.ceil(math.log(min_payment / (growth * surplus)) / math.log(growth)))
+    steady = min_payment / monthly_rate
+    return months, (steady - (steady - amount) * growth ** (months - 1)) * growth
+
+
+def _portfolio_balance(amounts: np.ndarray, min_payments: np.ndarray, monthly_rates: np.ndarray, extra_payment=0):
+    """
+    Closed form remaining balance for several debts at once.
+    Debts are on the last axis, any leading axis holds scenarios that are solved side by side.
+    :param amounts: Starting balance per debt
+    :param min_payments: Minimum payment per debt
+    :param monthly_rates: Interest rate per month per debt, in decimal
+    :param extra_payment: Additional payment per month, per scenario
+    :return: Function of the month (per scenario) returning (remaining balance, interest paid so far),
+    and the last payoff month per scenario
+    """
+    amounts, min_payments, monthly_rates = np.broadcast_arrays(amounts, min_payments, monthly_rates)
+    growth, paying, steady, gap, payoff = _amortization(amounts, min_payments, monthly_rates)
+    final_payment = np.where(paying, (steady - gap * growth ** np.where(paying, payoff - 1, 0)) * growth, 0.0)
+
+    total_amount = amounts.sum(axis=-1)
+    total_payment = min_payments.sum(axis=-1) + extra_payment
+
+    def balance(month):
+        month = np.asarray(month)
+        debt_month = month[..., None]
+        paid_month = np.minimum(debt_month, payoff)
+        interest = (paid_month * min_payments - gap * (growth ** np.where(paying, paid_month, 0) - 1)).sum(axis=-1)
+        # the unused part of each final minimum payment is not paid again
+        unused = ((min_payments - final_payment) * np.maximum(debt_month - payoff + 1, 0)).sum(axis=-1)
+        remaining = total_amount + interest - month * total_payment + unused
+        return remaining, interest
+
+    return balance, payoff.max(axis=-1)
+
+
+def _amortization(amounts: np.ndarray, min_payments: np.ndarray, monthly_rates: np.ndarray):
+    """
+    Closed form amortization of every debt paid by its minimum payment alone
+    :param amounts: Starting balance per debt
+    :param min_payments: Minimum payment per debt
+    :param monthly_rates: Interest rate per month per debt, in decimal
+    :return: growth per month, whether the debt is ever paid off, the balance at which the minimum payment
+    only covers the interest, the distance from it, and the payoff month (inf if never paid off).
+    Until it is paid off the balance after month t is steady - gap * growth ** t
+    """
+    growth = 1 + monthly_rates
+    surplus = min_payments - monthly_rates * amounts
+    paying = surplus > 0
+
+    # A debt that is never paid off sits exactly on the steady balance
+    steady = np.where(paying, min_payments / np.where(paying, monthly_rates, 1), amounts)
+    gap = np.where(paying, steady - amounts, 0.0)
+
+    payoff = np.full(amounts.shape, np.inf)
+    payoff[paying] = 1 + np.maximum(0, np.ceil(
+        np.log(min_payments[paying] / (growth[paying] * surplus[paying])) / np.log(growth[paying])
+    ))
+    return growth, paying, steady, gap, payoff
+
+
+def _first_paid_month(balance, last_payoff: float):
+    """
+    Find the first month the remaining balance is paid off
+    :param balance: Function of the month returning (remaining balance, interest paid so far),
+    the remaining balance never increases from one month to the next
+    :param last_payoff: The month the last debt is paid off by its minimum payment, or math.inf
+    :return: The number of months
+    """
+    # Bracketing the payoff month, every debt is paid off by its own minimum payment at the latest
+    low = 0
+    if math.isfinite(last_payoff):
+        high = int(last_payoff)
+    else:
+        high = 1
+        while balance(high)[0] > PAID_OFF_TOLERANCE:
+            low, high = high, high * 2
+
+    # Bisection over whole months
+    while high - low > 1:
+        middle = (low + high) // 2
+        if balance(middle)[0] > PAID_OFF_TOLERANCE:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def _first_paid_months(balance, last_payoff: np.ndarray):
+    """
+    Find the first month the remaining balance is paid off, for every scenario at once
+    :param balance: Function of the month per scenario returning (remaining balance, interest paid so far),
+    the remaining balance never increases from one month to the next
+    :param last_payoff: The month the last debt is paid off by its minimum payment per scenario, or inf
+    :return: The number of months per scenario
+    """
+    # Bracketing the payoff months, doubling only where some debt is never paid off by its minimum
+    finite = np.isfinite(last_payoff)
+    low = np.zeros(last_payoff.shape, dtype=np.int64)
+    high = np.where(finite, last_payoff, 1).astype(np.int64)
+    growing = ~finite & (balance(high)[0] > PAID_OFF_TOLERANCE)
+    while growing.any():
+        low = np.where(growing, high, low)
+        high = np.where(growing, high * 2, high)
+        growing &= balance(high)[0] > PAID_OFF_TOLERANCE
+
+    # Bisection over whole months, all scenarios move together
+    while (high - low > 1).any():
+        middle = (low + high) // 2
+        unpaid = balance(middle)[0] > PAID_OFF_TOLERANCE
+        searching = high - low > 1
+        low = np.where(searching & unpaid, middle, low)
+        high = np.where(searching & ~unpaid, middle, high)
+    return high
 
 
 def priority_payment(debts: list):
@@ -76,26 +973,25 @@ def priority_payment(debts: list):
     :param debts: List of debts
     :return: The name of the debt to prioritize
     """
-    sorted_debts = sorted(debts, key=lambda x: x['interest_rate'])
+    sorted_debts = sorted(as_debts(debts), key=lambda x: x.interest_rate)
 
     # Displaying in the console
-    Display.message(service, "Priority payment found")
-    return sorted_debts[-1]['name']
+    Display.debug(service, "Priority payment found")
+    return sorted_debts[-1].name
 
 
 def perc_to_dec(debts: list):
     """
     Change the interest rate from percentage to decimal
-    :param debts: List of debts
-    :return: List of debts with interest rate in decimal
+    :param debts: List of debts, left unchanged
+    :return: New list of debts with interest rate in decimal
     """
     final_debts = []
-    for debt in debts:
-        debt['interest_rate'] = debt['interest_rate'] * (10**(-2))
-        final_debts.append(debt)
+    for debt in as_debts(debts):
+        final_debts.append(debt._replace(interest_rate=debt.interest_rate * (10**(-2))))
 
     # Displaying in the console
-    Display.message(service, "Interest rates converted to decimal")
+    Display.debug(service, "Interest rates converted to decimal")
     return final_debts
 
 
@@ -106,35 +1002,36 @@ def check_min_payment(debts: list):
     :return: List of booleans per debt
     """
     results = []
-    for debt in debts:
-        if debt['min_payment'] < (debt['amount'] * (debt['interest_rate'] / 12)):
+    for debt in as_debts(debts):
+        if debt.min_payment < (debt.amount * (debt.interest_rate / 12)):
             results.append(False)
         else:
             results.append(True)
 
     # Displaying in the console
     if all(results):
-        Display.message(service, "Minimum payments are enough to cover interest")
+        Display.debug(service, "Minimum payments are enough to cover interest")
     else:
-        Display.message(service, "Minimum payments not enough to cover interest")
+        Display.debug(service, "Minimum payments not enough to cover interest")
     return results
 
 
-def change_min_payment(debt: dict):
+def change_min_payment(debt: Debt):
     """
     Change the minimum payment to cover the interest
-    :param debt: dict of debt
-    :return: Dict of debt with the minimum payment changed
+    :param debt: Debt
+    :return: New Debt with the minimum payment changed
     """
-    name = debt['name']
-    current_min_payment = debt['min_payment']
+    debt = as_debt(debt)
+    name = debt.name
+    current_min_payment = debt.min_payment
 
     # The amount of the debt that goes to interest
-    min_payment = (debt['amount'] * (debt['interest_rate'] / 12))
-    debt['min_payment'] = min_payment
+    min_payment = (debt.amount * (debt.interest_rate / 12))
+    debt = debt._replace(min_payment=min_payment)
 
     # Displaying in the console
-    Display.message(service, f"{name}'s minimum payment changed. From: {current_min_payment} to: {min_payment}")
+    Display.debug(service, "%s's minimum payment changed. From: %s to: %s", name, current_min_payment, min_payment)
     return debt
 
 
@@ -147,15 +1044,15 @@ def check_if_possible(debts: list, extra_payment: float):
     """
     total_payment = 0 + extra_payment
     total_interest = 0
-    for debt in debts:
-        if not debt["amount"] > 0:
+    for debt in as_debts(debts):
+        if not debt.amount > 0:
             return False
-        if not debt["min_payment"] > 0:
+        if not debt.min_payment > 0:
             return False
-        if not debt["interest_rate"] > 0:
+        if not debt.interest_rate > 0:
             return False
-        total_payment += debt["min_payment"]
-        total_interest += debt["amount"] * (debt["interest_rate"] / 12)
+        total_payment += debt.min_payment
+        total_interest += debt.amount * (debt.interest_rate / 12)
 
     if total_payment <= total_interest:
         return False
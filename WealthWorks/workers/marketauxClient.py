@@ -0,0 +1,255 @@
+"""
+MarketAux Client:
+A client for the MarketAux API that keeps to the per-minute quota of the plan, retries failed requests and keeps
+a ledger of the API credits used per run
+"""
+try:
+    import consoleStatements as Display
+except ImportError:
+    from WealthWorks.workers import consoleStatements as Display
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any
+
+import asyncio
+import datetime
+import httpx
+import os
+import random
+import time
+
+# The MarketAux API, can be changed with the MARKETAUX_URL environment variable (e.g. to a local mock server)
+MARKETAUX_URL = "https://api.marketaux.com/v1"
+
+# Status codes worth retrying, any other error is not fixed by asking again
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class QuotaExhausted(httpx.HTTPError):
+    """Raised instead of sending a request once the credit budget of the run is used up"""
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, each request takes a token and tokens come back at the per-minute rate.
+    Up to capacity requests can be sent at once after a quiet period.
+    """
+
+    def __init__(self, requests_per_minute: float, capacity: Optional[int] = None, clock=time.monotonic):
+        """
+        :param requests_per_minute: The number of requests per minute of the plan
+        :param capacity: The maximum number of tokens, requests_per_minute if None
+        :param clock: The function giving the current time in seconds
+        """
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity or max(1, int(requests_per_minute))
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def waitTime(self) -> float:
+        """
+        Add the tokens that came back since the last call
+        :return: The seconds until a token is available, 0 if there is one
+        """
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self, sleep=asyncio.sleep):
+        """
+        Wait until a token is available and take it
+        :param sleep: The function used to wait
+        """
+        async with self.lock:
+            delay = self.waitTime()
+            while delay > 0:
+                await sleep(delay)
+                delay = self.waitTime()
+            self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """
+        Stop handing out tokens for a while, e.g. when the API asks to slow down
+        :param seconds: The number of seconds to pause
+        """
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class QuotaLedger:
+    """The API credits used during a run and what they returned"""
+
+    def __init__(self):
+        self.credits = 0
+        self.articles = 0
+        self.retries = 0
+        self.status_codes: Dict[int, int] = {}
+
+    def record(self, status_code: int):
+        """
+        Record a request sent to the API, every request sent uses a credit
+        :param status_code: The status code of the response
+        """
+        self.credits += 1
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+
+    def articlesPerCredit(self) -> float:
+        """
+        :return: The number of new articles per credit used
+        """
+        return self.articles / self.credits if self.credits else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        :return: The ledger as a dictionary
+        """
+        return {
+            "credits": self.credits,
+            "articles": self.articles,
+            "articles_per_credit": round(self.articlesPerCredit(), 2),
+            "retries": self.retries,
+            "status_codes": dict(self.status_codes)
+        }
+
+    def report(self, service: str):
+        """
+        Display the ledger in the console
+        :param service: The name of the service displaying the ledger
+        """
+        Display.message(
+            service, "%d credits used for %d new articles (%.2f per credit), %d retries",
+            self.credits, self.articles, self.articlesPerCredit(), self.retries
+        )
+
+
+class MarketauxClient:
+    """
+    Client for the MarketAux API, used like httpx.AsyncClient with async with and get.
+
+    Requests wait for a token of the TokenBucket, so they keep to the per-minute quota, and no more than concurrency
+    requests are in flight at the same time. Responses with a status code
+    in RETRY_STATUS_CODES and connection errors are retried with jittered exponential backoff, waiting at least as
+    long as the Retry-After header asks. Every request sent is recorded in the QuotaLedger.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        requests_per_minute: Optional[float] = None,
+        concurrency: int = 3,
+        max_retries: int = 4,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        credit_budget: Optional[int] = None,
+        client: Optional[httpx.AsyncClient] = None,
+        sleep=asyncio.sleep
+    ):
+        """
+        :param base_url: The URL of the MarketAux API, MARKETAUX_URL or the MarketAux website if None
+        :param requests_per_minute: The per-minute quota of the plan, MARKETAUX_REQUESTS_PER_MINUTE or 60 if None
+        :param concurrency: The maximum number of requests in flight, and of connections kept open
+        :param max_retries: The maximum number of retries of a request
+        :param backoff: The wait before the first retry in seconds, doubled on every retry
+        :param max_backoff: The longest wait between retries in seconds
+        :param credit_budget: The maximum number of credits to use, no limit if None
+        :param client: An open httpx client to send the requests with, a new one is created and closed if None
+        :param sleep: The function used to wait
+        """
+        if requests_per_minute is None:
+            requests_per_minute = float(os.getenv("MARKETAUX_REQUESTS_PER_MINUTE", 60))
+        self.bucket = TokenBucket(requests_per_minute)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.ledger = QuotaLedger()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.credit_budget = credit_budget
+        self.sleep = sleep
+        self.owns_client = client is None
+        self.client = client or httpx.AsyncClient(
+            base_url=base_url or os.getenv("MARKETAUX_URL", MARKETAUX_URL),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            timeout=30
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the httpx client, if it was created by this client"""
+        if self.owns_client:
+            await self.client.aclose()
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        """
+        Send a GET request, retrying it if it fails with a status code worth retrying or a connection error
+        :param url: The path of the endpoint, e.g. /news/all
+        :param params: The query parameters
+        :return: The last response, which may still have an error status code
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.credit_budget is not None and self.ledger.credits >= self.credit_budget:
+                raise QuotaExhausted(f"Credit budget of {self.credit_budget} used up")
+            await self.bucket.acquire(self.sleep)
+
+            response = None
+            try:
+                async with self.semaphore:
+                    response = await self.client.get(url, params=params)
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoffTime(attempt)
+            else:
+                self.ledger.record(response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return response
+                delay = max(self.backoffTime(attempt), retryAfter(response) or 0)
+
+            self.ledger.retries += 1
+            Display.debug("MarketAux client", "Retrying %s in %.1f seconds", url, delay)
+            if response is not None and response.status_code == 429:
+                # The other requests have to wait as well, the next token is only handed out after the delay
+                self.bucket.pause(delay)
+            else:
+                await self.sleep(delay)
+
+    def backoffTime(self, attempt: int) -> float:
+        """
+        The wait before a retry, exponential in the attempt with full jitter
+        :param attempt: The number of the attempt that failed, starting at 0
+        :return: The wait in seconds
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def retryAfter(response: httpx.Response) -> Optional[float]:
+    """
+    This function reads the Retry-After header of a response
+    :param response: The response
+    :return: The seconds to wait, None if there is no valid header
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    # A -0000 zone gives a naive datetime, the date is still in UTC
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
@@ -4,23 +4,42 @@ NewsCleaner class is used to clean duplicate articles from the db.
 import postgrest.exceptions
 
 import consoleStatements as Display
-from typing import List, Dict, Any
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from typing import List, Dict, Any, Optional
+from supabaseClient import getClient, getSettings
+from newsFingerprint import INDEX_FILE, FingerprintIndex, fingerprints
+from supabase import Client
+from contextlib import closing
 
+import argparse
 import os
 
+# Number of ids per delete request, about 4KB of URL with ids up to 7 digits
+DELETE_CHUNK_SIZE = 500
 
-def clean_news() -> None:
+# Number of articles per select request, the default maximum of Supabase
+FETCH_PAGE_SIZE = 1000
+
+
+def clean_news(supabase: Optional[Client] = None, full: bool = False) -> None:
+    """
+    This function removes the duplicate articles from the db
+
+    Only the articles that arrived since the last run are checked, against a persistent index of the articles kept
+    (see FingerprintIndex in newsFingerprint.py), so a run costs as much as the new articles and not the whole table.
+    The ids are left as they are, the pages of the newsFetcher do not need them to be contiguous.
+
+    :param supabase: A Supabase client to use, the shared client if None
+    :param full: Check the whole table again, building the index from scratch
+    """
     service = "NewsCleaner Service"
 
     # Displaying start confirmation
     Display.start(service)
 
-    # Loading environment variables
-    load_dotenv()
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_api_key = os.environ.get("SUPABASE_API_KEY")
+    # Loading the settings
+    settings = getSettings()
+    supabase_url = settings.supabase_url
+    supabase_api_key = settings.supabase_api_key
 
     # Checking if API keys were provided
     if supabase_url is None:
@@ -32,68 +51,144 @@ def clean_news() -> None:
         Display.completed(service)
         raise SystemExit(0)
 
-    # We clean the db by:
-    # getting data -> removing duplicates(if any) -> deleting the duplicates -> Ordering the ids in the db
-    data = fetchNews(supabase_url, supabase_api_key, service)
-    cleaned_data, data_len = removeDuplicates(data, service)
-    deleteArticles(url=supabase_url, key=supabase_api_key, service=service, old_articles=data, new_articles=cleaned_data)
-    updateArticleIds(url=supabase_url, key=supabase_api_key, service=service, articles=cleaned_data)
+    # Get the Supabase client, shared by the steps
+    supabase = supabase or getClient(supabase_url, supabase_api_key)
 
+    with closing(FingerprintIndex(os.getenv("NEWS_INDEX_FILE", INDEX_FILE))) as index:
+        # Forgetting the articles the size correction removed, and starting over if the table was emptied
+        oldest_id, newest_id = fetchIdRange(supabase_url, supabase_api_key, supabase=supabase)
+        if full or newest_id is None or newest_id < index.checkpoint():
+            index.reset()
+        if oldest_id is not None:
+            index.forgetBefore(oldest_id)
 
-def fetchNews(url: str, key: str, service: str) -> List[Dict[str, Any]]:
+        # We clean the db by:
+        # getting the new data -> removing duplicates(if any) -> deleting the duplicates -> keeping the index
+        data = fetchNews(supabase_url, supabase_api_key, service, supabase=supabase, after_id=index.checkpoint())
+        cleaned_data, data_len = removeDuplicates(data, service, index=index)
+        deleted = deleteArticles(
+            url=supabase_url, key=supabase_api_key, service=service, old_articles=data, new_articles=cleaned_data,
+            supabase=supabase
+        )
+
+        # The new articles are only marked as checked once their duplicates are gone
+        if deleted == len(data) - data_len:
+            index.commit(checkpoint=data[-1]["id"] if data else index.checkpoint())
+        else:
+            index.rollback()
+
+    Display.completed(service)
+
+
+def fetchIdRange(url: str, key: str, supabase: Optional[Client] = None) -> (Optional[int], Optional[int]):
     """
-    This function gets the news articles from the Supabase database
+    This function gets the ids of the oldest and the newest news articles in the Supabase database
     :param url: Supabase URL
     :param key: Supabase API key
-    :param service: Name of the service
-    :return: List of news articles
+    :param supabase: A Supabase client to use, the shared client if None
+    :return: The oldest and the newest id, both None if the table is empty
     """
-    # Create a Supabase client
-    supabase: Client = create_client(url, key)
-    response = supabase.table("WealthworksNews").select("*", count='exact').order("id", desc=False).execute()
+    supabase = supabase or getClient(url, key)
+    oldest = supabase.table("WealthworksNews").select("id").order("id", desc=False).limit(1).execute().data
+    newest = supabase.table("WealthworksNews").select("id").order("id", desc=True).limit(1).execute().data
+    if not oldest or not newest:
+        return None, None
+    return oldest[0]["id"], newest[0]["id"]
 
-    # Get the data from the response
-    data = response.data
+
+def fetchNews(
+        url: str,
+        key: str,
+        service: str,
+        supabase: Optional[Client] = None,
+        after_id: int = 0
+) -> List[Dict[str, Any]]:
+    """
+    This function gets the news articles from the Supabase database, a page at a time
+    :param url: Supabase URL
+    :param key: Supabase API key
+    :param service: Name of the service
+    :param supabase: A Supabase client to use, the shared client if None
+    :param after_id: Only get the articles with a higher id
+    :return: List of news articles, oldest first, with the columns the duplicates are found on
+    """
+    # Get the shared Supabase client
+    supabase = supabase or getClient(url, key)
+
+    # Get the data page by page, from the last id of the previous page
+    data = []
+    while True:
+        response = (
+            supabase.table("WealthworksNews").select("id", "url", "title", "description").gt("id", after_id)
+            .order("id", desc=False).limit(FETCH_PAGE_SIZE).execute()
+        )
+        data.extend(response.data)
+        if len(response.data) < FETCH_PAGE_SIZE:
+            break
+        after_id = response.data[-1]["id"]
 
     return data
 
 
-def removeDuplicates(data: List[Dict[str, Any]], service: str) -> (List[Dict[str, Any]], int):
+def removeDuplicates(
+        data: List[Dict[str, Any]],
+        service: str,
+        threshold: Optional[float] = None,
+        index: Optional[FingerprintIndex] = None
+) -> (List[Dict[str, Any]], int):
     """
     This function removes duplicate articles from the list of articles and returns the cleaned list
-    :param data: The list of articles
+
+    An article is a duplicate if its url or normalized title is the same as, or its title and description are close
+    to, those of an earlier article of the list or of the index (see newsFingerprint.py). The articles kept are added
+    to the index.
+
+    :param data: The list of articles, oldest first
     :param service: Name of the service
+    :param threshold: The similarity from which articles are near duplicates, NEWS_SIMILARITY_THRESHOLD if None
+    :param index: The index of the articles already kept, an index in memory if None
     :return: A tuple containing the cleaned list of articles and the length of the cleaned list
     """
-    # This function works by turning a list into a dictionary(HashMap) and then back into a list
-    # This way, we can remove duplicates from the list
-
-    # Remove articles with url duplicates
-    test_data = {}
-    for item in data:
-        test_data[item["url"]] = item
-    new_data = list(test_data.values())
-
-    # Remove articles with title duplicates
-    test_data = {}
-    for item in new_data:
-        test_data[item["title"]] = item
-    new_data = list(test_data.values())
+    if index is None:
+        with closing(FingerprintIndex(":memory:", threshold)) as index:
+            return removeDuplicates(data, service, index=index)
+
+    new_data = []
+    near_duplicates = 0
+    for item, fingerprint in zip(data, fingerprints(data)):
+        title_key = normalizeTitle(item["title"])
+        if index.findExact(item["url"], title_key) is not None:
+            continue
+        if index.findSimilar(fingerprint) is not None:
+            near_duplicates += 1
+            continue
+        index.add(item["id"], item["url"], title_key, fingerprint)
+        new_data.append(item)
 
     old_len = len(data)
     new_len = len(new_data)
-    Display.message(service, f"Removed {old_len - new_len} duplicate articles")
+    Display.message(service, "Removed %d duplicate articles, %d of them near duplicates", old_len - new_len, near_duplicates)
 
     return new_data, new_len
 
 
+def normalizeTitle(title: str) -> str:
+    """
+    This function normalizes a title so that titles only differing in case or spacing are duplicates
+    :param title: The title of an article
+    :return: The normalized title, lower case with single spaces
+    """
+    return " ".join((title or "").split()).lower()
+
+
 def deleteArticles(
         url: str,
         key: str,
         service: str,
         old_articles: List[Dict[str, Any]],
-        new_articles: List[Dict[str, Any]]
-) -> None:
+        new_articles: List[Dict[str, Any]],
+        supabase: Optional[Client] = None
+) -> int:
     """
     This function deletes articles from the Supabase db that are not present in the new list of articles
     :param url: Supabase URL
@@ -101,65 +196,32 @@ def deleteArticles(
     :param service: Name of the service
     :param old_articles: The old list of articles
     :param new_articles: The new list of articles
-    :return: None
+    :param supabase: A Supabase client to use, the shared client if None
+    :return: The number of articles deleted
     """
-    # Create a Supabase client
-    supabase: Client = create_client(url, key)
-
-    # List of ids of articles to be deleted
-    ids = []
+    # Get the shared Supabase client
+    supabase = supabase or getClient(url, key)
 
-    if len(old_articles) > len(new_articles):
-        # Find the ids of the articles to be deleted
-        for article in old_articles:
-            if article not in new_articles:
-                ids.append(article['id'])
+    # Ids of the articles to be deleted, the ones not kept in the new list
+    kept_ids = {article['id'] for article in new_articles}
+    ids = [article['id'] for article in old_articles if article['id'] not in kept_ids]
 
-        # Bulk delete the articles
+    # Bulk delete the articles, a chunk at a time so the id filter stays within the URL length limit
+    deleted = 0
+    for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+        chunk = ids[start:start + DELETE_CHUNK_SIZE]
         try:
-            supabase.table('WealthworksNews').delete().in_('id', ids).execute()
-            Display.message(service, f"{len(ids)} articles deleted from db successfully")
+            supabase.table('WealthworksNews').delete().in_('id', chunk).execute()
+            deleted += len(chunk)
         except postgrest.exceptions.APIError as e:
-            Display.message(service, f"Error deleting articles: {e}")
-
-
-def updateArticleIds(
-        url: str,
-        key: str,
-        service: str,
-        articles: List[Dict[str, Any]],
-) -> None:
-    """
-    This function updates the ids of the articles in the db, if the ids are not in order
-    :param url: Supabase URL
-    :param key: Supabase API key
-    :param service: Name of the service
-    :param articles: The list of articles
-    :return: None
-    """
-    # Create a Supabase client
-    supabase: Client = create_client(url, key)
-
-    # Number of articles updated
-    updated_articles: int = 0
-
-    # Update the id of each article to be in order
-    for i, article in enumerate(articles):
-        new_id = i + 1
-
-        # Check if the id of the article is not already in order
-        if article['id'] != new_id:
-            try:
-                # Update the id of the article
-                supabase.table('WealthworksNews').update({'id': new_id}).eq('id', article['id']).execute()
-                updated_articles += 1
-                Display.message(service, f"Updated article with id {article['id']} to {new_id}")
-            except postgrest.exceptions.APIError as e:
-                # Display error message if the article could not be updated
-                Display.message(service, f"Error updating article with id {article['id']}: {e}")
+            Display.error(service, "Error deleting articles: %s", e)
 
-    Display.message(service, f"{updated_articles} articles updated successfully")
+    if ids:
+        Display.message(service, "%d articles deleted from db successfully", deleted)
+    return deleted
 
 
 if __name__ == '__main__':
-    clean_news()
+    parser = argparse.ArgumentParser(description="Remove the duplicate news articles from the database")
+    parser.add_argument("--full", action="store_true", help="check the whole table again, building the index from scratch")
+    clean_news(full=parser.parse_args().full)
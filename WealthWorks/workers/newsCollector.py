@@ -3,13 +3,45 @@ News Collector Service:
 This service collects news articles from the MarketAux API and sends them to the Supabase database
 """
 import consoleStatements as Display
-from typing import Optional, List, Dict, Any
-from supabase import create_client, Client
-from dotenv import load_dotenv
-from newsCleanner import clean_news
-
-import requests
+from marketauxClient import MarketauxClient
+from newsCleanner import normalizeTitle
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+from supabaseClient import getClient, getSettings
+from supabase import Client
+
+import asyncio
+import datetime
+import httpx
+import json
 import os
+import postgrest.exceptions
+
+# PostgREST error code of a database function that does not exist
+MISSING_FUNCTION = "PGRST202"
+
+# Postgres error codes of an on_conflict column without a unique constraint, of a unique constraint broken by an
+# insert and of a column that does not exist
+NO_UNIQUE_CONSTRAINT = "42P10"
+UNIQUE_VIOLATION = "23505"
+UNDEFINED_COLUMN = "42703"
+
+# Postgres error classes of data the database rejects whatever the number of tries, data exceptions and integrity
+# constraint violations, and the codes of an unknown column and of a body PostgREST cannot read
+PERMANENT_ERROR_CLASSES = ("22", "23")
+PERMANENT_ERROR_CODES = (UNDEFINED_COLUMN, "PGRST102", "PGRST204")
+
+# Number of urls or titles looked up per request, about 8KB of URL with urls of 200 characters
+LOOKUP_CHUNK_SIZE = 40
+
+# Where the watermark of the incremental collection is kept, can be changed with NEWS_WATERMARK_FILE
+WATERMARK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "newsWatermark.json")
+
+# Query of the news requested from MarketAux
+NEWS_PARAMS = {
+    "industries": "Financial,Technology,Real Estate",
+    "filter_entities": "true",
+    "language": "en"
+}
 
 
 def main():
@@ -17,11 +49,11 @@ def main():
     this_service = "News Collector Service"
     Display.start(this_service)
 
-    # Loading environment variables
-    load_dotenv()
-    marketaux_key = os.getenv("MARKETAUX_API_KEY")
-    supabase_key = os.getenv("SUPABASE_API_KEY")
-    supabase_url = os.getenv("SUPABASE_URL")
+    # Loading the settings
+    settings = getSettings()
+    marketaux_key = settings.marketaux_api_key
+    supabase_key = settings.supabase_api_key
+    supabase_url = settings.supabase_url
 
     # Checking if API keys were provided
     if marketaux_key is None:
@@ -37,101 +69,327 @@ def main():
         Display.completed(this_service)
         raise SystemExit(0)  # Kill the program
 
-    # Get the news articles from marketaux
-    news_articles = getNews(service=this_service, key=marketaux_key)
-
-    # Send the news to the supabase database
-    sendToDb(service=this_service, key=supabase_key, url=supabase_url, articles=news_articles)
+    # Get the news articles from marketaux that are newer than the last run and send them to the supabase database
+    asyncio.run(collectNews(
+        marketaux_key=marketaux_key,
+        supabase_key=supabase_key,
+        supabase_url=supabase_url,
+        service=this_service
+    ))
 
     # Correct the size of the database
-    correctDbSize(key=supabase_key, url=supabase_url)
+    correctDbSize(key=supabase_key, url=supabase_url, max_age_days=maxAgeDays())
 
     # Display completion of service
     Display.completed(this_service)
 
-    # Clean the database, comment out if not required
-    clean_news()
 
+async def collectNews(
+    marketaux_key: str,
+    supabase_key: str,
+    supabase_url: str,
+    service: Optional[str] = "News Collector Service",
+    client: Optional[MarketauxClient] = None,
+    supabase: Optional[Client] = None
+) -> int:
+    """
+    This function collects the news articles published since the last run and sends them to the Supabase database
+
+    The articles stream through the stages of newsPipeline.py, which drop the incomplete items, the duplicates and
+    the near duplicates, the same story syndicated by several sources. Its SupabaseSink keeps them in the spool
+    until the database takes them, and the watermark only moves once they are in the spool.
+
+    :param marketaux_key: The API key for the MarketAux API
+    :param supabase_key: The API key for the Supabase API
+    :param supabase_url: The URL for the Supabase database
+    :param service: The name of the service you are calling this program
+    :param client: An open MarketAux client to reuse, a new one is created and closed if None
+    :param supabase: A Supabase client to use, the shared client if None
+    :return: The number of articles inserted
+    """
+    # Imported here, the pipeline imports this module for the MarketAux source and the inserts
+    from newsPipeline import SupabaseSink, marketauxSource, runPipeline
+
+    if client is None:
+        async with newsClient() as client:
+            return await collectNews(marketaux_key, supabase_key, supabase_url, service, client, supabase)
+
+    sink = SupabaseSink(key=supabase_key, url=supabase_url, supabase=supabase, service=service)
+    source = marketauxSource(marketaux_key, client, max_pages=int(os.getenv("MARKETAUX_PAGES", 3)), service=service)
+    await runPipeline(source, [sink])
+    return sink.inserted
 
-def getNews(
+
+async def iterNewsSince(
     key: str,
-    service: Optional[str] = "News fetcher service"
-) -> List[Dict[str, Any]]:
+    watermark: Dict[str, Any],
+    client: MarketauxClient,
+    service: Optional[str] = "News fetcher service",
+    max_pages: int = 3
+) -> AsyncIterator[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
     """
-    This function gets the news articles from the MarketAux API
+    This function yields the news published since the watermark one page at a time, in page order
 
-    You can get the API key and documentation from the MarketAux website: https://www.marketaux.com/
+    Only articles published after the watermark are requested, oldest first, so a run stopped by max_pages or a
+    failed request moves the watermark no further than the articles it got, and the next run resumes from there.
+    The first page is requested on its own, so a quiet period costs a single small request. If it is full, the
+    following pages are requested concurrently, as many at a time as the client allows. The first run, without a
+    watermark, gets the newest articles instead.
 
     :param key: The API key for the MarketAux API
+    :param watermark: The watermark of the last run, see loadWatermark
+    :param client: An open client
     :param service: The name of the service you are calling this program
+    :param max_pages: The maximum number of pages to request
+    :return: The new items of each page as returned by MarketAux, with the watermark including them
+    """
+    # Oldest first from the watermark, the first run starts from the newest articles
+    if watermark["published_at"]:
+        params = {**newsParams(key), "sort": "published_asc", "published_after": watermark["published_at"][:19]}
+    else:
+        params = {**newsParams(key), "sort": "published_desc"}
+    seen = set(watermark["uuids"])
+
+    # The following pages are only requested if the first one is full, then all at once
+    response = await getNewsPage(client, params, 1, service)
+    pending = []
+    if response is not None and not lastPage(response):
+        pending = [asyncio.ensure_future(getNewsPage(client, params, page, service))
+                   for page in range(2, pageCount(response, max_pages) + 1)]
+
+    new_watermark = watermark
+    try:
+        for page in range(1, len(pending) + 2):
+            if page > 1:
+                response = await pending[page - 2]
+            # Stopping at a failed request, the pages after it would leave a gap behind the watermark
+            if response is None:
+                break
+
+            data = response["data"]
+            new_data = [item for item in data if item["uuid"] not in seen and item["published_at"] >= (watermark["published_at"] or "")]
+            # Articles published during the run shift the newest first pages, so a page can repeat the one before
+            seen.update(item["uuid"] for item in new_data)
+            client.ledger.articles += len(new_data)
+            new_watermark = advanceWatermark(new_watermark, new_data)
+            yield new_data, new_watermark
+
+            if lastPage(response):
+                break
+    finally:
+        # The pages after the last one are not needed
+        for request in pending:
+            request.cancel()
+
+
+async def getNewsPage(
+    client: MarketauxClient,
+    params: Dict[str, Any],
+    page: int,
+    service: Optional[str] = "News fetcher service"
+) -> Optional[Dict[str, Any]]:
+    """
+    This function requests one page of news from the MarketAux API
+
+    :param client: An open client
+    :param params: The query parameters, without the page
+    :param page: The number of the page
+    :param service: The name of the service you are calling this program
+    :return: The response as returned by MarketAux, None if the request failed
+    """
+    try:
+        r = await client.get("/news/all", params={**params, "page": page})
+    except httpx.HTTPError as e:
+        Display.error(service, "Request failed: %s", e)
+        return None
+
+    # Request error handling
+    if r.status_code != 200:
+        reportStatus(service, r.status_code)
+        return None
+    return r.json()
+
+
+def lastPage(response: Dict[str, Any]) -> bool:
+    """
+    This function checks if a MarketAux response is the last page, a page that is not full
+
+    :param response: The response as returned by MarketAux
+    :return: True if there are no pages after it
+    """
+    data = response["data"]
+    meta = response.get("meta", {})
+    return not data or meta.get("returned", len(data)) < meta.get("limit", 0)
+
+
+def pageCount(response: Dict[str, Any], max_pages: int) -> int:
+    """
+    This function finds the number of pages to request from the first page of a MarketAux response
+
+    :param response: The first page as returned by MarketAux
+    :param max_pages: The maximum number of pages to request
+    :return: The number of pages holding the articles found, at most max_pages
+    """
+    meta = response.get("meta", {})
+    if meta.get("found") is None or not meta.get("limit"):
+        return max_pages
+    return max(1, min(max_pages, -(-meta["found"] // meta["limit"])))
+
+
+def loadWatermark(path: str) -> Dict[str, Any]:
+    """
+    This function loads the watermark of the incremental collection
+
+    The watermark holds the latest published_at seen and the uuids of the articles published at that moment,
+    so articles sharing the timestamp are not collected twice.
+
+    :param path: The path of the watermark file
+    :return: The watermark, empty if the file does not exist yet
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"published_at": None, "uuids": []}
+
+
+def saveWatermark(path: str, watermark: Dict[str, Any]):
+    """
+    This function saves the watermark of the incremental collection, the file is replaced in one step
+
+    :param path: The path of the watermark file
+    :param watermark: The watermark to save
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(watermark, f)
+    os.replace(temp_path, path)
+
+
+def advanceWatermark(watermark: Dict[str, Any], data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    This function moves the watermark to the latest articles of a MarketAux response
+
+    :param watermark: The current watermark
+    :param data: The "data" list of the response
+    :return: The new watermark
+    """
+    published_at = max([item["published_at"] for item in data] + [watermark["published_at"] or ""])
+    if not published_at:
+        return watermark
+    uuids = [item["uuid"] for item in data if item["published_at"] == published_at]
+    if published_at == watermark["published_at"]:
+        uuids = watermark["uuids"] + uuids
+    return {"published_at": published_at, "uuids": uuids}
+
+
+def newsParams(key: str) -> Dict[str, Any]:
+    """
+    This function builds the query of the news requested from MarketAux
+
+    The number of articles per page can be set with MARKETAUX_PAGE_LIMIT, the larger the page the more articles each
+    API credit returns (up to the maximum of the plan).
+
+    :param key: The API key for the MarketAux API
+    :return: The query parameters, without the page
+    """
+    params = {**NEWS_PARAMS, "api_token": key}
+    page_limit = os.getenv("MARKETAUX_PAGE_LIMIT")
+    if page_limit:
+        params["limit"] = int(page_limit)
+    return params
+
+
+def newsClient(base_url: Optional[str] = None, concurrency: Optional[int] = None) -> MarketauxClient:
+    """
+    This function creates a client for the MarketAux API that keeps its connections alive between requests,
+    keeps to the per-minute quota and retries failed requests (see marketauxClient.py)
+
+    :param base_url: The URL of the MarketAux API, MARKETAUX_URL or the MarketAux website if None
+    :param concurrency: The maximum number of requests in flight, MARKETAUX_CONCURRENCY or 3 if None
+    :return: The client, to be used with async with
+    """
+    credit_budget = os.getenv("MARKETAUX_CREDIT_BUDGET")
+    return MarketauxClient(
+        base_url=base_url,
+        concurrency=concurrency or int(os.getenv("MARKETAUX_CONCURRENCY", 3)),
+        credit_budget=int(credit_budget) if credit_budget else None
+    )
+
+
+def parseArticles(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    This function extracts the article info from the news of a MarketAux response
+
+    :param data: The "data" list of the response
     :return: A list of dictionaries containing the news articles
     """
-    # Creating an array to store the articles
     articles = []
-    # Generating 3 requests to the API, each returning 3 news stories (So 9 stories in total)
-    for n in range(1, 4):
-        r = requests.get(
-            f"https://api.marketaux.com/v1/news/all?industries=Financial,Technology,Real Estate&filter_entities=true&language=en&page={n}&api_token={key}")
-        status_code = r.status_code
-        # Request error handling
-        if status_code != 200:
-            if status_code == 400:
-                Display.message(service, "Parameter issues")
-            elif status_code == 401:
-                Display.message(service, "No Api token")
-            elif status_code == 402:
-                Display.message(service, "Usage limit reached")
-            elif status_code == 403:
-                Display.message(service, "You too broke, UP your subscription")
-            elif status_code == 429:
-                Display.message(service, "Too many requests in the last minute")
-            else:
-                Display.message(service, f"Error - check the error docs for status code {status_code}")
-        else:
-            data = r.json()
-            data = data["data"]
-
-            for i in range(len(data)):
-                # Extracting information from the request
-                title = data[i]["title"]
-                description = data[i]["description"]
-                url = data[i]["url"]
-                image = data[i]["image_url"]
-                source = data[i]["source"]
-                company_name = data[i]["entities"][0]["name"]
-                symbol = data[i]["entities"][0]["symbol"]
-                equity_type = data[i]["entities"][0]["type"]
-                country = data[i]["entities"][0]["country"]
-                sentiment_score = data[i]["entities"][0]["sentiment_score"]
-
-                # Add the article info to the array
-                articles.append({
-                    "title": title,
-                    "description": description,
-                    "url": url,
-                    "image": image,
-                    "source": source,
-                    "name": company_name,
-                    "symbol": symbol,
-                    "equity_type": equity_type,
-                    "country": country,
-                    "sentiment_score": sentiment_score
-                })
-
-            # Displaying confirmation to terminal
-            Display.message(service, "Articles successfully acquired")
-
+    for i in range(len(data)):
+        # Extracting information from the request
+        entity = data[i]["entities"][0]
+
+        # Add the article info to the array
+        articles.append({
+            "title": data[i]["title"],
+            "description": data[i]["description"],
+            "url": data[i]["url"],
+            "image": data[i]["image_url"],
+            "source": data[i]["source"],
+            "name": entity["name"],
+            "symbol": entity["symbol"],
+            "equity_type": entity["type"],
+            "country": entity["country"],
+            "sentiment_score": entity["sentiment_score"]
+        })
     return articles
 
 
+def reportStatus(service: str, status_code: int):
+    """
+    This function displays the reason a MarketAux request failed
+
+    :param service: The name of the service you are calling this program
+    :param status_code: The status code of the response
+    """
+    if status_code == 400:
+        Display.message(service, "Parameter issues")
+    elif status_code == 401:
+        Display.message(service, "No Api token")
+    elif status_code == 402:
+        Display.message(service, "Usage limit reached")
+    elif status_code == 403:
+        Display.message(service, "You too broke, UP your subscription")
+    elif status_code == 429:
+        Display.message(service, "Too many requests in the last minute")
+    else:
+        Display.message(service, "Error - check the error docs for status code %s", status_code)
+
+
+def maxAgeDays() -> Optional[int]:
+    """
+    This function reads the number of days articles are kept for from NEWS_MAX_AGE_DAYS
+
+    :return: The number of days, None if articles are kept until the database is full
+    """
+    max_age_days = os.getenv("NEWS_MAX_AGE_DAYS")
+    return int(max_age_days) if max_age_days else None
+
+
 def sendToDb(
     key: str,
     url: str,
     articles: List[Dict[str, Any]],
-    service: Optional[str] = "Supabase insert service"
-):
+    service: Optional[str] = "Supabase insert service",
+    supabase: Optional[Client] = None
+) -> int:
     """
-    This function sends the news articles to the Supabase database
+    This function sends the news articles to the Supabase database, skipping the ones already stored
+
+    Articles are inserted with the insert_news database function, which skips any article whose url or normalized
+    title is already in the table (see newsDatabase.md). If the function is not set up, the articles are upserted
+    on their url instead, ignoring the duplicates. That needs the url constraint to be the only one, for a table
+    without it or with the title_key constraint as well, see insertMissing.
 
     You can get the API key and documentation from the Supabase website: https://supabase.com/
 
@@ -139,59 +397,154 @@ def sendToDb(
     :param url: The URL for the Supabase database
     :param articles: The list of dictionaries containing the news articles
     :param service: The name of the service you are calling this program
+    :param supabase: A Supabase client to use, the shared client if None
+    :return: The number of articles inserted
     """
-    supabase: Client = create_client(url, key)
-
-    # Inserting the articles into the database
-    supabase.table("WealthworksNews").insert(articles).execute()
+    supabase = supabase or getClient(url, key)
+
+    # Inserting the new articles into the database
+    try:
+        inserted = supabase.rpc("insert_news", {"articles": articles}).execute().data
+    except postgrest.exceptions.APIError as e:
+        if e.code != MISSING_FUNCTION:
+            raise
+        Display.message(service, "insert_news is not set up, upserting on url")
+        try:
+            response = supabase.table("WealthworksNews").upsert(articles, on_conflict="url", ignore_duplicates=True).execute()
+            inserted = len(response.data)
+        except postgrest.exceptions.APIError as e:
+            if e.code not in (NO_UNIQUE_CONSTRAINT, UNIQUE_VIOLATION):
+                raise
+            Display.message(service, "url is not the only unique column, inserting the articles not stored yet")
+            inserted = insertMissing(articles, supabase)
 
     # Displaying confirmation to terminal
-    Display.message(service, "Articles inserted successfully")
+    Display.message(service, "%d of %d articles inserted successfully", inserted, len(articles))
+    return inserted
+
+
+def permanentError(e: Exception) -> bool:
+    """
+    This function tells if the database rejected articles for good, so sending them again would fail the same way,
+    rather than because it could not be reached
+
+    :param e: The error of sendToDb
+    :return: True if the error is permanent
+    """
+    if not isinstance(e, postgrest.exceptions.APIError) or not e.code:
+        return False
+    return e.code.startswith(PERMANENT_ERROR_CLASSES) or e.code in PERMANENT_ERROR_CODES
+
+
+def insertMissing(articles: List[Dict[str, Any]], supabase: Client) -> int:
+    """
+    This function inserts the articles whose url and normalized title are not in the table yet, without relying on
+    the constraints of newsDatabase.md
+
+    The stored urls and title keys are looked up first, LOOKUP_CHUNK_SIZE at a time, then the other articles are
+    inserted in one request. The titles are only checked if the table has the title_key column.
+
+    :param articles: The list of dictionaries containing the news articles
+    :param supabase: A Supabase client to use
+    :return: The number of articles inserted
+    """
+    stored_urls = storedValues(supabase, "url", [article["url"] for article in articles])
+    try:
+        stored_keys = storedValues(supabase, "title_key", [normalizeTitle(article["title"]) for article in articles])
+    except postgrest.exceptions.APIError as e:
+        if e.code != UNDEFINED_COLUMN:
+            raise
+        stored_keys = set()
+
+    # Skipping the stored articles and the repeats within the list
+    new_articles = []
+    for article in articles:
+        title_key = normalizeTitle(article["title"])
+        if article["url"] in stored_urls or title_key in stored_keys:
+            continue
+        stored_urls.add(article["url"])
+        stored_keys.add(title_key)
+        new_articles.append(article)
+
+    if not new_articles:
+        return 0
+    return len(supabase.table("WealthworksNews").insert(new_articles).execute().data)
+
+
+def storedValues(supabase: Client, column: str, values: List[str]) -> set:
+    """
+    This function looks up which of the values are already in a column of the news table
+
+    :param supabase: A Supabase client to use
+    :param column: The column
+    :param values: The values to look up
+    :return: The values that are stored
+    """
+    values = list(dict.fromkeys(value for value in values if value is not None))
+    stored = set()
+    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        # Quoting every value, urls and titles can hold the commas and parentheses of the in filter
+        chunk = ",".join(
+            '"%s"' % value.replace("\\", "\\\\").replace('"', '\\"')
+            for value in values[start:start + LOOKUP_CHUNK_SIZE]
+        )
+        response = supabase.table("WealthworksNews").select(column).filter(column, "in", f"({chunk})").execute()
+        stored.update(row[column] for row in response.data)
+    return stored
 
 
 def correctDbSize(
     key: str,
     url: str,
     max_size: Optional[int] = 1000,
-    service: Optional[str] = "DB size correction service"
-):
+    service: Optional[str] = "DB size correction service",
+    supabase: Optional[Client] = None,
+    max_age_days: Optional[int] = None
+) -> int:
     """
     This function corrects the size of the database by removing the oldest news articles, for size optimization
 
+    The articles are removed with the trim_news database function, in one statement on the server (see
+    newsDatabase.md). If the function is not set up, the id of the newest article to remove is looked up and
+    everything up to it is deleted in one request.
+
     :param key: The API key for the Supabase API
     :param url: The URL for the Supabase database
-    :param max_size: The maximum size of the database
+    :param max_size: The maximum size of the database, no limit if None
     :param service: The name of the service you are calling this program
+    :param supabase: A Supabase client to use, the shared client if None
+    :param max_age_days: The number of days articles are kept for, no limit if None
+    :return: The number of articles removed
     """
     # Displaying start confirmation
     Display.start(service)
 
-    supabase: Client = create_client(url, key)
-    # Getting the number of news articles in the database
-    response = supabase.table("WealthworksNews").select("id", count='exact').execute()
-    db_size = response.count
+    supabase = supabase or getClient(url, key)
+    try:
+        removed = supabase.rpc("trim_news", {"max_rows": max_size, "max_age_days": max_age_days}).execute().data
+    except postgrest.exceptions.APIError as e:
+        if e.code != MISSING_FUNCTION:
+            raise
+        Display.message(service, "trim_news is not set up, deleting below a cutoff")
+        removed = 0
+
+        # Removing the articles older than the maximum age
+        if max_age_days is not None:
+            cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max_age_days)
+            response = supabase.table("WealthworksNews").delete().lt("created_at", cutoff.isoformat()).execute()
+            removed += len(response.data)
+
+        # Removing the oldest articles beyond the maximum size, everything up to the newest one that does not fit
+        if max_size is not None:
+            response = supabase.table("WealthworksNews").select("id").order("id", desc=True).range(max_size, max_size).execute()
+            if response.data:
+                response = supabase.table("WealthworksNews").delete().lte("id", response.data[0]["id"]).execute()
+                removed += len(response.data)
 
-    # If the number of news articles is greater than 1000, remove the oldest articles
-    if db_size > max_size:
-        # Displaying message to terminal
-        Display.message(service, "Size is greater than max size")
-
-        # Getting the oldest news articles
-        response = supabase.table("WealthworksNews").select("id").limit(db_size - max_size).order("id", desc=False).execute()
-        data = response.data
-        ids = [i["id"] for i in data]
-
-        # Removing the oldest news articles
-        supabase.table("WealthworksNews").delete().in_("id", ids).execute()
-
-        # Displaying confirmation to terminal
-        Display.completed(service)
-    else:
-        # Displaying message to terminal
-        Display.message(service, "Size is less than max size")
-
-        # Displaying completion of service
-        Display.completed(service)
+    # Displaying confirmation to terminal
+    Display.message(service, "%d articles removed", removed)
+    Display.completed(service)
+    return removed
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+"""
+News Daemon Service:
+This service keeps running and collects, cleans and trims the news on its own schedule, reusing the same MarketAux
+and Supabase clients for every run instead of starting a new program each time
+"""
+import consoleStatements as Display
+from typing import Optional, Callable, Awaitable
+from supabaseClient import getClient, getSettings
+from supabase import Client
+from marketauxClient import MarketauxClient, QuotaLedger
+from newsCollector import collectNews, correctDbSize, maxAgeDays, newsClient
+from newsCleanner import clean_news
+
+import asyncio
+import fcntl
+import math
+import os
+import signal
+import time
+
+# Where the lock that stops two daemons from running at once is kept, can be changed with NEWS_DAEMON_LOCK
+LOCK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "newsDaemon.lock")
+
+
+def main():
+    # Displaying start confirmation
+    this_service = "News Daemon Service"
+    Display.start(this_service)
+
+    # Loading the settings
+    settings = getSettings()
+    marketaux_key = settings.marketaux_api_key
+    supabase_key = settings.supabase_api_key
+    supabase_url = settings.supabase_url
+
+    # Checking if API keys were provided
+    if marketaux_key is None:
+        Display.message(this_service, " MarketAux API Key is not set")
+        Display.completed(this_service)
+        raise SystemExit(0)  # Kill the program
+    if supabase_url is None:
+        Display.message(this_service, " Supabase URL is not set")
+        Display.completed(this_service)
+        raise SystemExit(0)  # Kill the program
+    if supabase_key is None:
+        Display.message(this_service, " Supabase API Key is not set")
+        Display.completed(this_service)
+        raise SystemExit(0)  # Kill the program
+
+    # Making sure this is the only daemon running
+    lock = open(os.getenv("NEWS_DAEMON_LOCK", LOCK_FILE), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        Display.message(this_service, "Another daemon is already running")
+        Display.completed(this_service)
+        raise SystemExit(0)  # Kill the program
+
+    asyncio.run(runDaemon(
+        marketaux_key=marketaux_key,
+        supabase_key=supabase_key,
+        supabase_url=supabase_url,
+        collect_interval=float(os.getenv("NEWS_COLLECT_INTERVAL", 30)) * 60,
+        clean_interval=float(os.getenv("NEWS_CLEAN_INTERVAL", 1440)) * 60,
+        trim_interval=float(os.getenv("NEWS_TRIM_INTERVAL", 30)) * 60,
+        service=this_service
+    ))
+
+    # Display completion of service
+    lock.close()
+    Display.completed(this_service)
+
+
+async def runDaemon(
+    marketaux_key: str,
+    supabase_key: str,
+    supabase_url: str,
+    collect_interval: float = 30 * 60,
+    clean_interval: float = 24 * 60 * 60,
+    trim_interval: float = 30 * 60,
+    service: Optional[str] = "News Daemon Service",
+    client: Optional[MarketauxClient] = None,
+    supabase: Optional[Client] = None,
+    stop: Optional[asyncio.Event] = None
+):
+    """
+    This function runs the collect, clean and trim jobs on their intervals until it is stopped
+
+    The jobs share one lock, so two runs never touch the database at the same time, and a job is never started
+    again while it is still running. SIGTERM and SIGINT stop the daemon once the running job has finished.
+
+    :param marketaux_key: The API key for the MarketAux API
+    :param supabase_key: The API key for the Supabase API
+    :param supabase_url: The URL for the Supabase database
+    :param collect_interval: The seconds between the starts of two collections
+    :param clean_interval: The seconds between the starts of two cleanings
+    :param trim_interval: The seconds between the starts of two trims of the database size
+    :param service: The name of the service you are calling this program
+    :param client: An open MarketAux client to reuse, a new one is created and closed if None
+    :param supabase: A Supabase client to use, the shared client if None
+    :param stop: The event that stops the daemon, one set by SIGTERM and SIGINT is created if None
+    """
+    if client is None:
+        async with newsClient() as client:
+            return await runDaemon(
+                marketaux_key, supabase_key, supabase_url, collect_interval, clean_interval, trim_interval,
+                service, client, supabase, stop
+            )
+
+    # Warm clients, reused by every run
+    supabase = supabase or getClient(supabase_url, supabase_key)
+
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, stop.set)
+
+    lock = asyncio.Lock()
+
+    async def collect():
+        # Every run gets its own quota ledger
+        client.ledger = QuotaLedger()
+        await collectNews(
+            marketaux_key=marketaux_key, supabase_key=supabase_key, supabase_url=supabase_url,
+            service="News Collector Service", client=client, supabase=supabase
+        )
+
+    async def clean():
+        await asyncio.to_thread(clean_news, supabase=supabase)
+
+    async def trim():
+        await asyncio.to_thread(
+            correctDbSize, key=supabase_key, url=supabase_url, supabase=supabase, max_age_days=maxAgeDays()
+        )
+
+    Display.message(service, "Running, collecting every %.0f, cleaning every %.0f and trimming every %.0f seconds",
+                    collect_interval, clean_interval, trim_interval)
+    await asyncio.gather(
+        scheduleJob("collect", collect, collect_interval, lock, stop, service),
+        scheduleJob("clean", clean, clean_interval, lock, stop, service),
+        scheduleJob("trim", trim, trim_interval, lock, stop, service)
+    )
+    Display.message(service, "Stopped")
+
+
+async def scheduleJob(
+    name: str,
+    job: Callable[[], Awaitable[None]],
+    interval: float,
+    lock: asyncio.Lock,
+    stop: asyncio.Event,
+    service: str,
+    clock=time.monotonic,
+    sleep=asyncio.sleep
+):
+    """
+    This function runs a job every interval seconds, starting right away, until the stop event is set
+
+    The starts stay on the interval however long a run takes. If a run takes longer than the interval, the starts
+    that were missed are skipped instead of running back to back.
+
+    :param name: The name of the job
+    :param job: The job to run
+    :param interval: The seconds between the starts of two runs
+    :param lock: The lock held while the job runs
+    :param stop: The event that stops the job
+    :param service: The name of the service you are calling this program
+    :param clock: The function giving the current time in seconds
+    :param sleep: The function used to wait
+    """
+    next_run = clock()
+    while not stop.is_set():
+        async with lock:
+            if stop.is_set():
+                break
+            try:
+                await job()
+            except Exception as e:
+                # A failed run should not stop the daemon
+                Display.error(service, "The %s job failed: %s", name, e)
+
+        # Waiting for the next start on the interval, or until the daemon is stopped
+        now = clock()
+        next_run += interval * max(1, math.ceil((now - next_run) / interval))
+        await waitOrStop(stop, next_run - now, sleep)
+
+
+async def waitOrStop(stop: asyncio.Event, seconds: float, sleep=asyncio.sleep):
+    """
+    This function waits for a number of seconds, or until the stop event is set if that comes first
+
+    :param stop: The event that ends the wait early
+    :param seconds: The seconds to wait
+    :param sleep: The function used to wait
+    """
+    if stop.is_set():
+        return
+    stopped = asyncio.ensure_future(stop.wait())
+    slept = asyncio.ensure_future(sleep(seconds))
+    try:
+        await asyncio.wait({stopped, slept}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopped.cancel()
+        slept.cancel()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,28 +3,44 @@ News Fetcher Service:
 This module contains the functions to fetch the news articles from the Supabase database
 """
 from WealthWorks.workers import consoleStatements as Display
-from typing import Optional, List, Dict, Any
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from typing import Optional, List, Dict, Any, Callable, Tuple
+from WealthWorks.workers.supabaseClient import getClient, getSettings
 
 import os
+import threading
+import time
 
 
 def FetchNews() -> List:
     """
     This function gets the news articles from the database and returns them and a dictionary
     containing the page number as the key and the id of the first news article on that page as the value
+
+    The news are served from newsCache, shared by every session, so the database is only queried when they are
+    older than NEWS_CACHE_TTL, see NewsCache.
+
     :return: A list of dictionaries containing the news articles and a dictionary containing the page number as the key and the id of the first news article on that page as the value
     """
+    news, pageIdIndex = newsCache.get(loadNews)
+
+    # Copies, so a session changing its lists does not change the cache
+    return [list(news), dict(pageIdIndex)]
+
+
+def loadNews() -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
+    """
+    This function gets the news articles and the id of the first news article on each page from the database
+    :return: The news articles, newest first, and the dictionary of getPagesId
+    """
     service = "News Fetcher Service"
 
     # Displaying start confirmation
     Display.start(service)
 
-    # Loading environment variables
-    load_dotenv()
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_api_key = os.environ.get("SUPABASE_API_KEY")
+    # Loading the settings
+    settings = getSettings()
+    supabase_url = settings.supabase_url
+    supabase_api_key = settings.supabase_api_key
 
     # Checking if API keys were provided
     if supabase_url is None:
@@ -39,15 +55,131 @@ def FetchNews() -> List:
     # Get the news articles from the Supabase database
     news = getNews(url=supabase_url, key=supabase_api_key)
 
-    # Get the page number and the id of the first news article on that page
+    # Get the page number and the id of the first news article on that page, from the ids of the articles
     numArticles = 5
-    numPages = findTotalPages(url=supabase_url, key=supabase_api_key, articles_per_page=numArticles)
-    pageIdIndex = getPagesId(number_of_pages=numPages[0], first_id=numPages[1], articles_per_page=numArticles)
+    pageIdIndex = getPagesId(ids=[article['id'] for article in news], articles_per_page=numArticles)
 
     # Display completion of service
     Display.completed(service)
 
-    return [news, pageIdIndex]
+    return news, pageIdIndex
+
+
+class Refresh:
+    """A load of the cached value, that the sessions needing the value wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class NewsCache:
+    """
+    Cache of the news shared by every session, with hit, stale hit and miss counters
+
+    News younger than ttl seconds are served as they are. News younger than ttl + stale_ttl seconds are still served
+    at once, while one background thread loads them again (stale-while-revalidate). Older or missing news are loaded
+    by the first session needing them while the others wait for that same load, so many sessions starting together
+    only query the database once.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, stale_ttl: Optional[float] = None, clock=time.monotonic):
+        """
+        :param ttl: Seconds the news are fresh for, NEWS_CACHE_TTL or 300 if None
+        :param stale_ttl: Seconds stale news are still served for while they are loaded again,
+                          NEWS_CACHE_STALE_TTL or 1800 if None
+        :param clock: The function giving the current time in seconds
+        """
+        self.ttl = float(os.getenv("NEWS_CACHE_TTL", 300)) if ttl is None else ttl
+        self.stale_ttl = float(os.getenv("NEWS_CACHE_STALE_TTL", 1800)) if stale_ttl is None else stale_ttl
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.errors = 0
+        self._value = None
+        self._loaded_at: Optional[float] = None
+        self._refresh: Optional[Refresh] = None
+        self._lock = threading.Lock()
+
+    def get(self, load: Callable[[], Any]) -> Any:
+        """
+        Get the cached value, loading it if it is missing or too old
+        :param load: The function loading the value
+        :return: The value
+        :raises: The error of load, if the value had to be loaded and could not be
+        """
+        with self._lock:
+            age = None if self._loaded_at is None else self.clock() - self._loaded_at
+            if age is not None and age < self.ttl:
+                self.hits += 1
+                return self._value
+
+            if age is not None and age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                if self._refresh is None:
+                    self._refresh = Refresh()
+                    threading.Thread(target=self._load, args=(load, self._refresh, True), daemon=True).start()
+                return self._value
+
+            self.misses += 1
+            refresh, leader = self._refresh, self._refresh is None
+            if leader:
+                refresh = self._refresh = Refresh()
+
+        if leader:
+            self._load(load, refresh, False)
+        else:
+            refresh.done.wait()
+        if refresh.error is not None:
+            raise refresh.error
+        return refresh.value
+
+    def _load(self, load: Callable[[], Any], refresh: Refresh, background: bool):
+        try:
+            refresh.value = load()
+        except BaseException as e:
+            refresh.error = e
+            if background:
+                Display.error("News Cache", "Could not load the news again, serving the cached ones: %s", e)
+        with self._lock:
+            if refresh.error is None:
+                self._value = refresh.value
+                self._loaded_at = self.clock()
+                self.loads += 1
+            else:
+                self.errors += 1
+            self._refresh = None
+        refresh.done.set()
+
+    def clear(self):
+        """
+        Remove the cached value and reset the counters
+        """
+        with self._lock:
+            self._value = None
+            self._loaded_at = None
+            self.hits = self.stale_hits = self.misses = self.loads = self.errors = 0
+
+    def info(self) -> Dict[str, Any]:
+        """
+        :return: hits, stale hits, misses, loads and failed loads of the cache, and the age of the value in seconds
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "errors": self.errors,
+                "age": None if self._loaded_at is None else round(self.clock() - self._loaded_at, 3),
+            }
+
+
+# Cache shared by every session, see FetchNews
+newsCache = NewsCache()
 
 
 def getNews(
@@ -63,7 +195,7 @@ def getNews(
     :param key: The API key for the Supabase API
     :return: The list of dictionaries containing the news articles
     """
-    supabase: Client = create_client(url, key)
+    supabase = getClient(url, key)
     response = supabase.table("WealthworksNews").select("*", count='exact').order("id", desc=True).execute()
     data = response.data
 
@@ -71,60 +203,43 @@ def getNews(
 
 
 def getPagesId(
-    number_of_pages: int,
-    first_id: int,
+    ids: List[int],
     articles_per_page: Optional[int] = 5
 ) -> Dict[int, int]:
     """
     This function returns the id of the first news article on each page
 
-    Example return: {1: 24, 2: 19, 3: 14} where the key value pairs are {page: first_id}
+    The ids do not need to be contiguous, a page holds the articles_per_page newest articles with an id up to its
+    first id, see getNewsPage. So ids freed by the cleaner or the size correction never have to be renumbered.
+
+    Example return: {1: 24, 2: 19, 3: 12} where the key value pairs are {page: first_id}
 
-    :param number_of_pages: The total number of pages possible
-    :param first_id: The id of the first news article on the first page or in other words the newest news article
+    :param ids: The ids of the news articles, newest first
     :param articles_per_page: The number of articles per page
     :return: A dictionary containing the page number as the key and the id of the first news article on that page as the value
     """
-    pages = {}
+    return {page + 1: ids[i] for page, i in enumerate(range(0, len(ids), articles_per_page))}
 
-    # Looping through the pages and finding the id of the first news article on each page
-    for i in range(1, number_of_pages + 1):
-        pages[i] = first_id
-        first_id -= articles_per_page
 
-    return pages
-
-
-def findTotalPages(
+def getNewsPage(
     url: str,
     key: str,
+    first_id: int,
     articles_per_page: Optional[int] = 5
-) -> List[int]:
+) -> List[Dict[str, Any]]:
     """
-    This function finds the total number of pages possible
+    This function gets one page of news articles from the Supabase database
 
     :param url: The URL for the Supabase API
     :param key: The API key for the Supabase API
+    :param first_id: The id of the first news article on the page, see getPagesId
     :param articles_per_page: The number of articles per page
-    :return: The total number of pages possible
+    :return: The list of dictionaries containing the news articles of the page, newest first
     """
-    supabase: Client = create_client(url, key)
-
-    # Finding the first and last id of the news article
-    #
-    # There is a simpler way to do this using a simple query, but supabase doesn't support it, yet
-    # We would have done something like this:
-    # sql = "SELECT COUNT(*) FROM WealthworksNews;"
-    # response = supabase.query(sql).execute()
-    newest_article = supabase.table("WealthworksNews").select("*").limit(1).order("id", desc=True).single().execute()
-    oldest_article = supabase.table("WealthworksNews").select("*").limit(1).order("id", desc=False).single().execute()
-
-    # Finding the total number of articles in the database
-    n_articles = newest_article.data['id'] - (oldest_article.data['id'] - 1)
-
-    # Finding the total number of pages possible
-    n_pages = n_articles // articles_per_page
-    if n_articles % articles_per_page != 0:
-        n_pages += 1
-
-    return [n_pages, newest_article.data['id']]
+    supabase = getClient(url, key)
+    response = (
+        supabase.table("WealthworksNews").select("*").lte("id", first_id).order("id", desc=True)
+        .limit(articles_per_page).execute()
+    )
+
+    return response.data
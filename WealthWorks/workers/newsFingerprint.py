@@ -0,0 +1,387 @@
+"""
+News Fingerprint:
+MinHash fingerprints of the news articles and an LSH index over them, to find the same story syndicated with a
+slightly different title, description or tracking url. The collector and the pipeline use it on the articles they
+ingest, and the cleaner on the whole table.
+"""
+from typing import Optional, List, Dict, Any, Tuple, Hashable
+
+import numpy as np
+import os
+import re
+import sqlite3
+
+# Where the fingerprint index of the cleaner is kept, can be changed with NEWS_INDEX_FILE
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "newsIndex.sqlite3")
+
+# Share of shingles two articles need in common to be near duplicates, can be changed with NEWS_SIMILARITY_THRESHOLD
+SIMILARITY_THRESHOLD = 0.8
+
+# Number of values of a fingerprint, the estimated similarity is within about 0.1 of the real one
+FINGERPRINT_SIZE = 128
+
+# Number of bytes of a shingle, a shingle is kept whole as a 40 bit integer
+SHINGLE_SIZE = 5
+
+# Number of articles fingerprinted at once, bounds the memory used to about 200MB
+CHUNK_ARTICLES = 10_000
+
+# Fingerprint value of an article without any shingle, never a near duplicate
+EMPTY = np.uint32(0xFFFFFFFF)
+
+# Bits of a shingle hash that choose its bin, the other 25 are its value
+BIN_BITS = 7
+VALUE_BITS = 32 - BIN_BITS
+
+# Odd multiplier and offset of the multiply-shift hash of the shingles
+_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_OFFSET = np.uint64(0x632BE59BD9B4E019)
+
+
+def similarityThreshold() -> float:
+    """
+    This function reads the similarity threshold from NEWS_SIMILARITY_THRESHOLD
+
+    :return: The threshold between 0 and 1, near duplicate detection is off at 1 or above
+    """
+    threshold = os.getenv("NEWS_SIMILARITY_THRESHOLD")
+    return float(threshold) if threshold else SIMILARITY_THRESHOLD
+
+
+def articleText(article: Dict[str, Any]) -> str:
+    """
+    This function gives the text an article is compared on, its title and description in lower case, with only
+    letters, digits and single spaces
+
+    :param article: The article
+    :return: The normalized text
+    """
+    text = f"{article.get('title') or ''} {article.get('description') or ''}".lower()
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def shingles(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    This function cuts texts into their overlapping SHINGLE_SIZE byte pieces
+
+    :param texts: The normalized texts
+    :return: The shingles of all the texts one after the other, as integers, and the number of shingles of each text
+    """
+    encoded = [text.encode() for text in texts]
+    lengths = np.fromiter((len(text) for text in encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded) + bytes(SHINGLE_SIZE), dtype=np.uint8).astype(np.uint64)
+
+    # Every window of the joined texts as one integer, then only the windows inside a text
+    windows = np.zeros(len(data) - SHINGLE_SIZE, dtype=np.uint64)
+    for i in range(SHINGLE_SIZE):
+        windows = (windows << np.uint64(8)) | data[i:len(data) - SHINGLE_SIZE + i]
+    counts = np.maximum(lengths - SHINGLE_SIZE + 1, 0)
+    starts = np.cumsum(lengths) - lengths
+    positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return windows[positions], counts
+
+
+def fingerprints(articles: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    This function computes the MinHash fingerprints of articles, with one permutation hashing
+
+    Every shingle is hashed once, the top BIN_BITS bits of the hash choose one of the FINGERPRINT_SIZE bins and the
+    fingerprint keeps the smallest value of every bin. An empty bin borrows the value of the next bin that is not
+    empty, marked with the distance to it, so two fingerprints still agree on a bin with the chance the articles
+    share a shingle (Shrivastava and Li, Densifying One Permutation Hashing, 2014). This is one hash per shingle
+    instead of one per shingle and value.
+
+    :param articles: The articles
+    :return: An array with one row of FINGERPRINT_SIZE values per article, a row of EMPTY for an article without
+             shingles
+    """
+    result = np.full((len(articles), FINGERPRINT_SIZE), EMPTY, dtype=np.uint32)
+    columns = np.arange(FINGERPRINT_SIZE)
+    for start in range(0, len(articles), CHUNK_ARTICLES):
+        chunk = articles[start:start + CHUNK_ARTICLES]
+        values, counts = shingles([articleText(article) for article in chunk])
+
+        # The smallest value of every bin of every article
+        hashes = (values * _MULTIPLIER + _OFFSET) >> np.uint64(32)
+        cells = np.repeat(np.arange(len(chunk)) * FINGERPRINT_SIZE, counts) + (hashes >> np.uint64(VALUE_BITS)).astype(np.int64)
+        bins = np.full(len(chunk) * FINGERPRINT_SIZE, EMPTY, dtype=np.uint32)
+        np.minimum.at(bins, cells, (hashes & np.uint64((1 << VALUE_BITS) - 1)).astype(np.uint32))
+        bins = bins.reshape(len(chunk), FINGERPRINT_SIZE)
+
+        # The next bin that is not empty, going round to the first bins
+        doubled = np.concatenate([bins, bins], axis=1)
+        following = np.where(doubled != EMPTY, np.arange(2 * FINGERPRINT_SIZE), 2 * FINGERPRINT_SIZE)
+        following = np.minimum.accumulate(following[:, ::-1], axis=1)[:, ::-1][:, :FINGERPRINT_SIZE]
+
+        filled = counts > 0
+        rows = np.arange(len(chunk))[filled, None]
+        following = following[filled]
+        result[start:start + len(chunk)][filled] = (
+            doubled[rows, following] | ((following - columns) << VALUE_BITS).astype(np.uint32)
+        )
+    return result
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """
+    This function estimates the share of shingles two articles have in common from their fingerprints
+
+    :param first: The fingerprint of the first article
+    :param second: The fingerprint of the second article
+    :return: The estimated Jaccard similarity, between 0 and 1
+    """
+    return float(np.count_nonzero(first == second)) / FINGERPRINT_SIZE
+
+
+def bandsFor(threshold: float) -> Tuple[int, int]:
+    """
+    This function splits the fingerprint into bands for the LSH index
+
+    Two articles become candidates if all the rows of one of their bands match, the chance of which is
+    1 - (1 - similarity ** rows) ** bands. The split with the most rows per band, so the fewest candidates, that still
+    makes a pair at the threshold a candidate with a 90% chance is used, and the candidates are checked against the
+    threshold afterwards.
+
+    :param threshold: The similarity threshold
+    :return: The number of bands and of rows per band
+    """
+    splits = [(FINGERPRINT_SIZE // rows, rows) for rows in range(1, FINGERPRINT_SIZE + 1) if FINGERPRINT_SIZE % rows == 0]
+    found = [split for split in splits if 1 - (1 - threshold ** split[1]) ** split[0] >= 0.9]
+    return max(found or splits[:1], key=lambda split: split[1])
+
+
+def bandKeys(fingerprint: np.ndarray, bands: int, rows: int) -> List[bytes]:
+    """
+    This function cuts a fingerprint into the keys of its bands in the LSH index
+
+    :param fingerprint: The fingerprint
+    :param bands: The number of bands
+    :param rows: The number of values per band
+    :return: The bytes of every band
+    """
+    raw, width = fingerprint.tobytes(), rows * fingerprint.itemsize
+    return [raw[band * width:(band + 1) * width] for band in range(bands)]
+
+
+class NearDuplicateIndex:
+    """
+    An LSH index of article fingerprints, finding the near duplicates of an article without comparing it to every
+    article in the index
+    """
+
+    def __init__(self, threshold: Optional[float] = None):
+        """
+        :param threshold: The similarity from which articles are near duplicates, NEWS_SIMILARITY_THRESHOLD if None
+        """
+        self.threshold = similarityThreshold() if threshold is None else threshold
+        self.bands, self.rows = bandsFor(self.threshold)
+        self.buckets: List[Dict[bytes, List[Hashable]]] = [{} for _ in range(self.bands)]
+        self.fingerprints: Dict[Hashable, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def keys(self, fingerprint: np.ndarray) -> List[bytes]:
+        return bandKeys(fingerprint, self.bands, self.rows)
+
+    def add(self, key: Hashable, fingerprint: np.ndarray):
+        """
+        This method adds a fingerprint to the index
+        :param key: What identifies the article, e.g. its id
+        :param fingerprint: The fingerprint of the article, see fingerprints
+        """
+        self.fingerprints[key] = fingerprint
+        for bucket, band in zip(self.buckets, self.keys(fingerprint)):
+            bucket.setdefault(band, []).append(key)
+
+    def remove(self, key: Hashable):
+        """
+        This method removes a fingerprint from the index, if it is in it
+        :param key: What identifies the article
+        """
+        fingerprint = self.fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for bucket, band in zip(self.buckets, self.keys(fingerprint)):
+            bucket[band].remove(key)
+            if not bucket[band]:
+                del bucket[band]
+
+    def find(self, fingerprint: np.ndarray) -> Optional[Hashable]:
+        """
+        This method finds an article in the index that is a near duplicate of a fingerprint
+        :param fingerprint: The fingerprint of the article
+        :return: The key of the most similar article at or above the threshold, None if there is none
+        """
+        if self.threshold >= 1 or fingerprint.min() == EMPTY:
+            return None
+        best, best_similarity = None, self.threshold
+        for bucket, band in zip(self.buckets, self.keys(fingerprint)):
+            for key in bucket.get(band, ()):
+                score = similarity(fingerprint, self.fingerprints[key])
+                if score >= best_similarity:
+                    best, best_similarity = key, score
+        return best
+
+
+def removeNearDuplicates(
+    articles: List[Dict[str, Any]],
+    threshold: Optional[float] = None,
+    index: Optional[NearDuplicateIndex] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    This function removes the articles that are near duplicates of an earlier article of the list or of the index
+
+    The first article of every story is kept and added to the index, so passing the same index with every batch
+    also removes the near duplicates across batches.
+
+    :param articles: The articles, oldest first
+    :param threshold: The similarity from which articles are near duplicates, NEWS_SIMILARITY_THRESHOLD if None
+    :param index: The index of the articles already kept, a new one if None
+    :return: The articles kept and the near duplicates removed
+    """
+    index = index if index is not None else NearDuplicateIndex(threshold)
+    if index.threshold >= 1:
+        return list(articles), []
+
+    kept, duplicates = [], []
+    for article, fingerprint in zip(articles, fingerprints(articles)):
+        if index.find(fingerprint) is not None:
+            duplicates.append(article)
+            continue
+        index.add(article.get("id", article.get("url")), fingerprint)
+        kept.append(article)
+    return kept, duplicates
+
+
+class FingerprintIndex:
+    """
+    A persistent index of the urls, title keys and fingerprints of the articles kept in the database, in SQLite,
+    with the id of the last article checked, so the cleaner only checks the articles that arrived since
+
+    Changes are made in a transaction, kept with commit once the duplicates are deleted from the database, or
+    dropped with rollback.
+    """
+
+    def __init__(self, path: str, threshold: Optional[float] = None):
+        """
+        :param path: The path of the index file, ":memory:" for an index that is not kept
+        :param threshold: The similarity from which articles are near duplicates, NEWS_SIMILARITY_THRESHOLD if None
+        """
+        self.threshold = similarityThreshold() if threshold is None else threshold
+        self.bands, self.rows = bandsFor(self.threshold)
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # The bands of 100k articles take about 100MB, kept in memory while the index is built
+        self.connection.execute("PRAGMA cache_size=-131072")
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "id INTEGER PRIMARY KEY, url TEXT UNIQUE, title_key TEXT UNIQUE, fingerprint BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS bands ("
+            "band INTEGER NOT NULL, key BLOB NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (band, key, id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS bands_id ON bands (id);"
+        )
+
+        # The bands depend on the threshold, the index is built again when it changes
+        layout = f"{self.bands}x{self.rows}"
+        if self.setting("layout") != layout:
+            self.reset()
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('layout', ?)", (layout,))
+        self.connection.commit()
+
+    def setting(self, name: str) -> Optional[str]:
+        row = self.connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def checkpoint(self) -> int:
+        """
+        :return: The id of the last article checked, 0 if none was
+        """
+        return int(self.setting("checkpoint") or 0)
+
+    def findExact(self, url: Optional[str], title_key: str) -> Optional[int]:
+        """
+        This method finds an indexed article with the same url or normalized title
+
+        :param url: The url of the article
+        :param title_key: The normalized title of the article
+        :return: The id of the indexed article, None if there is none
+        """
+        row = self.connection.execute(
+            "SELECT id FROM articles WHERE url = ? OR title_key = ? LIMIT 1", (url, title_key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def findSimilar(self, fingerprint: np.ndarray) -> Optional[int]:
+        """
+        This method finds an indexed article that is a near duplicate of a fingerprint
+
+        :param fingerprint: The fingerprint of the article, see fingerprints
+        :return: The id of the most similar indexed article at or above the threshold, None if there is none
+        """
+        if self.threshold >= 1 or fingerprint.min() == EMPTY:
+            return None
+
+        keys = bandKeys(fingerprint, self.bands, self.rows)
+        candidates = self.connection.execute(
+            "SELECT DISTINCT articles.id, articles.fingerprint FROM bands JOIN articles ON articles.id = bands.id "
+            f"WHERE {' OR '.join('(band = ? AND key = ?)' for _ in keys)}",
+            [value for band, key in enumerate(keys) for value in (band, key)]
+        ).fetchall()
+        best, best_similarity = None, self.threshold
+        for article_id, blob in candidates:
+            score = similarity(fingerprint, np.frombuffer(blob, dtype=np.uint32))
+            if score >= best_similarity:
+                best, best_similarity = article_id, score
+        return best
+
+    def add(self, article_id: int, url: Optional[str], title_key: str, fingerprint: np.ndarray):
+        """
+        This method adds an article to the index
+        :param article_id: The id of the article
+        :param url: The url of the article
+        :param title_key: The normalized title of the article
+        :param fingerprint: The fingerprint of the article
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?)", (article_id, url, title_key, fingerprint.tobytes())
+        )
+        if fingerprint.min() != EMPTY:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO bands VALUES (?, ?, ?)",
+                [(band, key, article_id) for band, key in enumerate(bandKeys(fingerprint, self.bands, self.rows))]
+            )
+
+    def forgetBefore(self, article_id: int):
+        """
+        This method removes the articles with a lower id from the index, the ones the size correction deleted
+        :param article_id: The id of the oldest article in the database
+        """
+        self.connection.execute("DELETE FROM articles WHERE id < ?", (article_id,))
+        self.connection.execute("DELETE FROM bands WHERE id < ?", (article_id,))
+
+    def reset(self):
+        """
+        This method empties the index, so every article is checked again
+        """
+        self.connection.execute("DELETE FROM articles")
+        self.connection.execute("DELETE FROM bands")
+        self.connection.execute("DELETE FROM meta WHERE name = 'checkpoint'")
+
+    def commit(self, checkpoint: int):
+        """
+        This method keeps the changes to the index
+        :param checkpoint: The id of the last article checked
+        """
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('checkpoint', ?)", (str(checkpoint),))
+        self.connection.commit()
+
+    def rollback(self):
+        """
+        This method drops the changes to the index since the last commit
+        """
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,416 @@
+"""
+News Pipeline Service:
+This service streams news articles through the stages fetch -> parse/validate -> dedupe -> enrich -> sink, one batch
+at a time, timing every stage. The source can be the MarketAux API or a file of MarketAux items, and the articles can
+be written to Supabase, a SQLite database and/or a JSONL file, so the same ingestion runs offline for backfills and
+benchmarks. The newsCollector runs it from MarketAux into Supabase.
+
+Example, loading a backfill into a local SQLite database:
+    python newsPipeline.py --source backfill.jsonl --sink sqlite:news.sqlite3
+"""
+import consoleStatements as Display
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Iterable
+from contextlib import contextmanager
+from supabase import Client
+from supabaseClient import getClient, getSettings
+from marketauxClient import MarketauxClient
+from newsCollector import (
+    WATERMARK_FILE, correctDbSize, iterNewsSince, loadWatermark, maxAgeDays, newsClient, parseArticles,
+    permanentError, saveWatermark, sendToDb
+)
+from newsCleanner import normalizeTitle
+from newsFingerprint import NearDuplicateIndex, removeNearDuplicates
+from newsSpool import SPOOL_FILE, drainSpool, spoolArticles
+
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import postgrest.exceptions
+import sqlite3
+import time
+
+# Stages of the pipeline, in order
+STAGES = ("fetch", "parse", "dedupe", "enrich", "sink")
+
+# Columns of an article, as stored in the database
+ARTICLE_COLUMNS = (
+    "title", "description", "url", "image", "source", "name", "symbol", "equity_type", "country", "sentiment_score"
+)
+
+# Keys parseArticles reads from a MarketAux item and from its first entity
+ITEM_KEYS = ("title", "description", "url", "image_url", "source")
+ENTITY_KEYS = ("name", "symbol", "type", "country", "sentiment_score")
+
+
+class StageTimings:
+    """The time spent in each stage of the pipeline and the number of articles that came out of it"""
+
+    def __init__(self):
+        self.seconds = {stage: 0.0 for stage in STAGES}
+        self.articles = {stage: 0 for stage in STAGES}
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Add the time spent in the with block to a stage
+        :param stage: The name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - start
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: The seconds, articles and articles per second of every stage
+        """
+        return {
+            stage: {
+                "seconds": round(self.seconds[stage], 6),
+                "articles": self.articles[stage],
+                "articles_per_second": round(self.articles[stage] / self.seconds[stage], 1) if self.seconds[stage] else 0.0
+            }
+            for stage in STAGES
+        }
+
+    def report(self, service: str):
+        """
+        Display the timings in the console
+        :param service: The name of the service displaying the timings
+        """
+        for stage in STAGES:
+            Display.message(service, "%-6s %6d articles in %.3f seconds", stage, self.articles[stage], self.seconds[stage])
+
+
+class JsonlSink:
+    """Appends the articles to a JSONL file, one article per line"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, articles: List[Dict[str, Any]]):
+        self.file.write("".join(json.dumps(article) + "\n" for article in articles))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SQLiteSink:
+    """Stores the articles in a SQLite database, skipping the ones with a url or normalized title already stored"""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS WealthworksNews ("
+            f"id INTEGER PRIMARY KEY AUTOINCREMENT, {', '.join(ARTICLE_COLUMNS)}, title_key TEXT, "
+            f"UNIQUE (url), UNIQUE (title_key))"
+        )
+
+    def write(self, articles: List[Dict[str, Any]]):
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR IGNORE INTO WealthworksNews ({', '.join(ARTICLE_COLUMNS)}, title_key) "
+                f"VALUES ({', '.join('?' * (len(ARTICLE_COLUMNS) + 1))})",
+                [[article[column] for column in ARTICLE_COLUMNS] + [normalizeTitle(article["title"])]
+                 for article in articles]
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+class SupabaseSink:
+    """
+    Stores the articles in the Supabase database through the spool of newsSpool.py, skipping the ones already stored
+
+    Every batch is written to the spool, so the articles are kept while the database is unreachable. The spool is
+    sent to the database with sendToDb when the sink is closed, oldest first and including the articles left by
+    earlier runs, and the articles the database rejects for good are moved to the dead letters.
+    """
+
+    def __init__(
+        self,
+        key: Optional[str] = None,
+        url: Optional[str] = None,
+        supabase: Optional[Client] = None,
+        spool_path: Optional[str] = None,
+        service: Optional[str] = "News Pipeline Service"
+    ):
+        settings = getSettings()
+        self.key = key or settings.supabase_api_key
+        self.url = url or settings.supabase_url
+        self.supabase = supabase or getClient(self.url, self.key)
+        self.spool_path = spool_path or os.getenv("NEWS_SPOOL_FILE", SPOOL_FILE)
+        self.service = service
+        # The number of articles inserted in the database
+        self.inserted = 0
+
+    def write(self, articles: List[Dict[str, Any]]):
+        spoolArticles(self.spool_path, articles)
+
+    def send(self, articles: List[Dict[str, Any]]):
+        self.inserted += sendToDb(key=self.key, url=self.url, articles=articles, service=self.service,
+                                  supabase=self.supabase)
+
+    def close(self):
+        try:
+            drainSpool(self.spool_path, self.send, permanent=permanentError)
+        except (postgrest.exceptions.APIError, httpx.HTTPError) as e:
+            Display.error(self.service, "Could not send the articles, they stay in the spool: %s", e)
+
+
+def makeSink(spec: str):
+    """
+    This function creates a sink from its description
+
+    :param spec: supabase, sqlite:PATH or jsonl:PATH
+    :return: The sink
+    """
+    kind, _, path = spec.partition(":")
+    if kind == "supabase":
+        return SupabaseSink()
+    if kind == "sqlite" and path:
+        return SQLiteSink(path)
+    if kind == "jsonl" and path:
+        return JsonlSink(path)
+    raise ValueError(f"Unknown sink '{spec}', expected supabase, sqlite:PATH or jsonl:PATH")
+
+
+async def marketauxSource(
+    key: str,
+    client: MarketauxClient,
+    watermark_path: Optional[str] = None,
+    max_pages: int = 3,
+    service: Optional[str] = "News Pipeline Service"
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    This function yields the news published since the last run, one MarketAux page at a time
+
+    The watermark is only saved once the last page has been through every stage.
+
+    :param key: The API key for the MarketAux API
+    :param client: An open MarketAux client
+    :param watermark_path: The path of the watermark file, NEWS_WATERMARK_FILE or the default if None
+    :param max_pages: The maximum number of pages to request
+    :param service: The name of the service you are calling this program
+    :return: The items of each page as returned by MarketAux
+    """
+    watermark_path = watermark_path or os.getenv("NEWS_WATERMARK_FILE", WATERMARK_FILE)
+    watermark = new_watermark = loadWatermark(watermark_path)
+    async for items, new_watermark in iterNewsSince(key=key, watermark=watermark, client=client, service=service,
+                                                    max_pages=max_pages):
+        yield items
+    if new_watermark != watermark:
+        saveWatermark(watermark_path, new_watermark)
+    client.ledger.report(service)
+
+
+async def fileSource(path: str, batch_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    This function yields the MarketAux items of a JSONL file, one item per line, in batches
+
+    :param path: The path of the file
+    :param batch_size: The number of items per batch
+    :return: The batches of items
+    """
+    batch = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def fetchStage(source: AsyncIterator, timings: StageTimings) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    This stage times the source of the pipeline
+    :param source: The batches of MarketAux items
+    :param timings: The timings of the pipeline
+    :return: The same batches
+    """
+    while True:
+        with timings.measure("fetch"):
+            try:
+                items = await source.__anext__()
+            except StopAsyncIteration:
+                return
+        timings.articles["fetch"] += len(items)
+        yield items
+
+
+async def parseStage(batches: AsyncIterator, timings: StageTimings) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    This stage drops the items that are not complete articles and turns the rest into articles
+    :param batches: The batches of MarketAux items
+    :param timings: The timings of the pipeline
+    :return: The batches of articles
+    """
+    async for items in batches:
+        with timings.measure("parse"):
+            articles = parseArticles([item for item in items if validItem(item)])
+        timings.articles["parse"] += len(articles)
+        yield articles
+
+
+async def dedupeStage(batches: AsyncIterator, timings: StageTimings) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    This stage drops the articles with a url or normalized title that already came through the pipeline, and the
+    near duplicates of the articles that came through, see newsFingerprint.py
+    :param batches: The batches of articles
+    :param timings: The timings of the pipeline
+    :return: The batches of new articles
+    """
+    urls = set()
+    titles = set()
+    index = NearDuplicateIndex()
+    async for articles in batches:
+        with timings.measure("dedupe"):
+            unique = []
+            for article in articles:
+                title = normalizeTitle(article["title"])
+                if article["url"] not in urls and title not in titles:
+                    urls.add(article["url"])
+                    titles.add(title)
+                    unique.append(article)
+            unique, _ = removeNearDuplicates(unique, index=index)
+        timings.articles["dedupe"] += len(unique)
+        yield unique
+
+
+async def enrichStage(
+    batches: AsyncIterator,
+    timings: StageTimings,
+    enrichers: Iterable[Callable[[Dict[str, Any]], Dict[str, Any]]]
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    This stage passes every article through the enrichers, in order
+    :param batches: The batches of articles
+    :param timings: The timings of the pipeline
+    :param enrichers: The functions taking an article and returning the enriched article
+    :return: The batches of enriched articles
+    """
+    enrichers = list(enrichers)
+    async for articles in batches:
+        with timings.measure("enrich"):
+            for enricher in enrichers:
+                articles = [enricher(article) for article in articles]
+        timings.articles["enrich"] += len(articles)
+        yield articles
+
+
+def cleanText(article: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    This enricher removes the extra whitespace around the title and the description
+
+    :param article: The article
+    :return: The cleaned article
+    """
+    return {
+        **article,
+        "title": (article["title"] or "").strip(),
+        "description": (article["description"] or "").strip()
+    }
+
+
+def validItem(item: Dict[str, Any]) -> bool:
+    """
+    This function checks that a MarketAux item has everything an article needs, every key parseArticles reads, a
+    title and a url
+
+    :param item: The item as returned by MarketAux
+    :return: True if the item can be turned into an article
+    """
+    if not isinstance(item, dict) or any(key not in item for key in ITEM_KEYS):
+        return False
+    entities = item.get("entities")
+    if not isinstance(entities, list) or not entities or not isinstance(entities[0], dict):
+        return False
+    return bool(item["title"]) and bool(item["url"]) and all(key in entities[0] for key in ENTITY_KEYS)
+
+
+async def runPipeline(
+    source: AsyncIterator[List[Dict[str, Any]]],
+    sinks: List,
+    enrichers: Iterable[Callable[[Dict[str, Any]], Dict[str, Any]]] = (cleanText,),
+    service: Optional[str] = "News Pipeline Service"
+) -> StageTimings:
+    """
+    This function streams the batches of the source through the stages into every sink
+
+    Only one batch is in the pipeline at a time. The sinks are written and closed from a worker thread, so the event
+    loop is free while they wait on the disk or the network.
+
+    :param source: The batches of MarketAux items, e.g. marketauxSource or fileSource
+    :param sinks: The sinks the articles are written to
+    :param enrichers: The functions every article is passed through before it is written
+    :param service: The name of the service you are calling this program
+    :return: The timings of the stages
+    """
+    Display.start(service)
+    timings = StageTimings()
+    batches = enrichStage(dedupeStage(parseStage(fetchStage(source, timings), timings), timings), timings, enrichers)
+    try:
+        async for articles in batches:
+            if not articles:
+                continue
+            with timings.measure("sink"):
+                for sink in sinks:
+                    await asyncio.to_thread(sink.write, articles)
+            timings.articles["sink"] += len(articles)
+    finally:
+        for sink in sinks:
+            await asyncio.to_thread(sink.close)
+
+    timings.report(service)
+    Display.completed(service)
+    return timings
+
+
+async def runFromArguments(arguments: argparse.Namespace) -> StageTimings:
+    """
+    This function runs the pipeline with the source and sinks given on the command line, then corrects the size of
+    the Supabase database if it is one of the sinks
+    :param arguments: The parsed command line arguments
+    :return: The timings of the stages
+    """
+    sinks = [makeSink(spec) for spec in arguments.sink or ["supabase"]]
+    if arguments.source != "marketaux":
+        timings = await runPipeline(fileSource(arguments.source, arguments.batch_size), sinks)
+    else:
+        marketaux_key = getSettings().marketaux_api_key
+        if marketaux_key is None:
+            raise SystemExit("MarketAux API Key is not set")
+        async with newsClient() as client:
+            timings = await runPipeline(marketauxSource(marketaux_key, client, max_pages=arguments.pages), sinks)
+
+    for sink in sinks:
+        if isinstance(sink, SupabaseSink):
+            await asyncio.to_thread(
+                correctDbSize, key=sink.key, url=sink.url, supabase=sink.supabase, max_age_days=maxAgeDays()
+            )
+    return timings
+
+
+def main():
+    # Loading the settings, so the defaults below can come from the .env file
+    getSettings()
+
+    parser = argparse.ArgumentParser(description="Stream news articles from a source into one or more sinks")
+    parser.add_argument("--source", default="marketaux", help="marketaux, or the path of a JSONL file of MarketAux items")
+    parser.add_argument("--sink", action="append", help="supabase, sqlite:PATH or jsonl:PATH, can be repeated")
+    parser.add_argument("--pages", type=int, default=int(os.getenv("MARKETAUX_PAGES", 3)),
+                        help="maximum number of MarketAux pages")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of items per batch of a file source")
+    asyncio.run(runFromArguments(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
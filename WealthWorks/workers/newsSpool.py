@@ -0,0 +1,139 @@
+"""
+News Spool:
+A local SQLite spool the collector writes the fetched articles to before they are sent to the Supabase database,
+so articles that already cost API credits are not lost while the database is unreachable. Articles the database
+rejects for good are moved to the dead_letters table of the spool, so they do not hold up the others.
+"""
+try:
+    import consoleStatements as Display
+except ImportError:
+    from WealthWorks.workers import consoleStatements as Display
+from contextlib import closing
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+import json
+import os
+import sqlite3
+
+# Where the spool is kept, can be changed with NEWS_SPOOL_FILE
+SPOOL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "newsSpool.sqlite3")
+
+service = "News Spool"
+
+
+def openSpool(path: str) -> sqlite3.Connection:
+    """
+    This function opens the spool, creating it the first time
+
+    :param path: The path of the spool file
+    :return: The connection to the spool, every commit is synced to disk
+    """
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=FULL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS spool ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "article TEXT NOT NULL, "
+        "spooled_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS dead_letters ("
+        "id INTEGER PRIMARY KEY, "
+        "article TEXT NOT NULL, "
+        "error TEXT NOT NULL, "
+        "failed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    return connection
+
+
+def spoolArticles(path: str, articles: List[Dict[str, Any]]) -> int:
+    """
+    This function appends a batch of articles to the spool, in one transaction
+
+    :param path: The path of the spool file
+    :param articles: The list of dictionaries containing the news articles
+    :return: The number of articles waiting in the spool
+    """
+    with closing(openSpool(path)) as connection:
+        with connection:
+            connection.executemany("INSERT INTO spool (article) VALUES (?)", [(json.dumps(a),) for a in articles])
+        return connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+
+def drainSpool(
+    path: str,
+    send: Callable[[List[Dict[str, Any]]], Any],
+    batch_size: int = 500,
+    max_batches: int = 10,
+    permanent: Optional[Callable[[Exception], bool]] = None
+) -> int:
+    """
+    This function sends the spooled articles to the database, oldest first, in batches
+
+    A batch is only removed from the spool once send returns, so a batch that fails stays in the spool and is sent
+    again by the next drain. send must therefore skip articles that are already stored, like sendToDb does.
+    A batch that fails with a permanent error is split in halves until the articles that fail are alone, and those
+    are moved to the dead letters (see sendRows), the others are sent.
+
+    :param path: The path of the spool file
+    :param send: The function that stores a list of articles, raising if it fails
+    :param batch_size: The number of articles sent at once
+    :param max_batches: The maximum number of batches sent by one drain
+    :param permanent: The function telling if an error of send is permanent, every error is retried if None
+    :return: The number of articles sent
+    """
+    sent = 0
+    with closing(openSpool(path)) as connection:
+        for _ in range(max_batches):
+            rows = connection.execute("SELECT id, article FROM spool ORDER BY id LIMIT ?", (batch_size,)).fetchall()
+            if not rows:
+                break
+
+            sent += sendRows(connection, rows, send, permanent)
+
+        waiting = connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+    if waiting:
+        Display.message(service, "%d articles still waiting in the spool", waiting)
+    return sent
+
+
+def sendRows(
+    connection: sqlite3.Connection,
+    rows: List[Tuple[int, str]],
+    send: Callable[[List[Dict[str, Any]]], Any],
+    permanent: Optional[Callable[[Exception], bool]] = None
+) -> int:
+    """
+    This function sends consecutive rows of the spool and removes them from it once they are sent
+
+    If send fails with an error that is not permanent, the rows stay in the spool and the error is raised. If the
+    error is permanent, the rows are sent again in two halves, down to a single article, which is moved to the
+    dead letters with its error.
+
+    :param connection: The connection to the spool
+    :param rows: The ids and articles of the rows, in id order
+    :param send: The function that stores a list of articles, raising if it fails
+    :param permanent: The function telling if an error of send is permanent, every error is retried if None
+    :return: The number of articles sent
+    """
+    try:
+        send([json.loads(article) for _, article in rows])
+    except Exception as e:
+        if permanent is None or not permanent(e):
+            raise
+        if len(rows) > 1:
+            middle = len(rows) // 2
+            sent = sendRows(connection, rows[:middle], send, permanent)
+            return sent + sendRows(connection, rows[middle:], send, permanent)
+
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO dead_letters (id, article, error) VALUES (?, ?, ?)",
+                               (rows[0][0], rows[0][1], str(e)))
+            connection.execute("DELETE FROM spool WHERE id = ?", (rows[0][0],))
+        Display.error(service, "Article %d moved to the dead letters: %s", rows[0][0], e)
+        return 0
+
+    with connection:
+        connection.execute("DELETE FROM spool WHERE id BETWEEN ? AND ?", (rows[0][0], rows[-1][0]))
+    return len(rows)
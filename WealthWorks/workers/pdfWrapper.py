@@ -91,7 +91,7 @@ def create_pdf(expense_data: list, savings_data: list, summary_data: list) -> by
     :return: pdf_data: The PDF data as a bytes string
     """
     # Displaying in the console
-    Display.start(service)
+    Display.start(service, Display.DEBUG)
 
     # Create a BytesIO object to write the PDF to
     buffer = BytesIO()
@@ -155,5 +155,5 @@ def create_pdf(expense_data: list, savings_data: list, summary_data: list) -> by
     buffer.close()
 
     # Display in the console
-    Display.completed(service)
+    Display.completed(service, Display.DEBUG)
     return pdf_data
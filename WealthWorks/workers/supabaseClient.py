@@ -0,0 +1,82 @@
+"""
+Supabase Client:
+The settings of the workers and one Supabase client shared by the collector, the cleaner and the web app, both
+loaded the first time they are needed
+"""
+try:
+    import consoleStatements as Display
+except ImportError:
+    from WealthWorks.workers import consoleStatements as Display
+from typing import Optional, NamedTuple, Dict, Tuple
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+import os
+import threading
+
+
+class Settings(NamedTuple):
+    """The API keys and URLs of the workers, None if they are not set"""
+    marketaux_api_key: Optional[str]
+    supabase_api_key: Optional[str]
+    supabase_url: Optional[str]
+
+
+# The settings and the clients per (url, key), guarded by the lock so they are only created once
+_settings: Optional[Settings] = None
+_clients: Dict[Tuple[str, str], Client] = {}
+_lock = threading.Lock()
+
+
+def getSettings() -> Settings:
+    """
+    This function loads the settings from the environment and the .env file, only the first time it is called
+
+    :return: The settings
+    """
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                load_dotenv()
+                _settings = Settings(
+                    marketaux_api_key=os.getenv("MARKETAUX_API_KEY"),
+                    supabase_api_key=os.getenv("SUPABASE_API_KEY"),
+                    supabase_url=os.getenv("SUPABASE_URL")
+                )
+    return _settings
+
+
+def getClient(url: Optional[str] = None, key: Optional[str] = None) -> Client:
+    """
+    This function returns the Supabase client for a URL and API key, creating it the first time
+
+    The client keeps its HTTP connections open, so every caller sharing it reuses the same connection pool.
+
+    :param url: The URL for the Supabase database, SUPABASE_URL if None
+    :param key: The API key for the Supabase API, SUPABASE_API_KEY if None
+    :return: The Supabase client
+    """
+    if url is None or key is None:
+        settings = getSettings()
+        url = url or settings.supabase_url
+        key = key or settings.supabase_api_key
+
+    client = _clients.get((url, key))
+    if client is None:
+        with _lock:
+            client = _clients.get((url, key))
+            if client is None:
+                Display.debug("Supabase Client", "Creating a client for %s", url)
+                client = _clients[(url, key)] = create_client(url, key)
+    return client
+
+
+def resetClients():
+    """
+    This function forgets the settings and the clients, so they are loaded again the next time they are needed
+    """
+    global _settings
+    with _lock:
+        _settings = None
+        _clients.clear()